@@ -1,10 +1,7 @@
 import database as DB
+import passwords as PW
 
 def register_user(email: str, name: str, nickname: str, password: str):
-    if DB.email_exists(email):
-        return False, "이미 가입된 이메일입니다."
-    if nickname and DB.nickname_exists(nickname):
-        return False, "이미 사용 중인 닉네임입니다."
     try:
         DB.create_user(email, name, nickname, password)
         return True, "가입 완료! 로그인해주세요."
@@ -21,6 +18,8 @@ def login_user(login_id: str, password: str):
         return None, "존재하지 않는 계정입니다."
     if not DB.check_pw(password, row["pw_hash"]):
         return None, "비밀번호가 올바르지 않습니다."
+    if PW.needs_rehash(row["pw_hash"]):
+        DB.rehash_password_later(row["id"], password, row["pw_hash"])
     return dict(id=row["id"], name=row["name"], email=row["email"], nickname=row["nickname"]), "ok"
 
 def issue_reset_token(email: str):
@@ -0,0 +1,52 @@
+"""동선 solver 벤치마크: 무작위 지점 5~500개에서 거리/시간 비교.
+
+    python bench_route.py                 # 기본 크기들, 크기당 5회
+    python bench_route.py 10 50 200 -r 3  # 크기/반복 지정
+
+NN(최근접 이웃만) / heuristic(NN + 2-opt/Or-opt) / exact(Held-Karp, ROUTE_EXACT_MAX 이하만)
+각각의 평균 순환 거리(km)와 평균 시간(ms)을 출력한다. 결과를 남기려면 bench_output.txt 로 리다이렉트.
+"""
+import argparse, time
+import numpy as np
+import planner_core as PC
+
+SIZES = [5, 8, 10, 12, 15, 20, 50, 100, 200, 500]
+
+def _tour(Dm, path):
+    return PC.path_length(Dm, path + [path[0]])
+
+def _heuristic(Dm):
+    n = len(Dm)
+    Dx = np.zeros((n+1, n+1)); Dx[:n, :n] = Dm; Dx[n, :n] = Dm[0]; Dx[:n, n] = Dm[:, 0]
+    return PC._local_search(Dx, PC._nearest_neighbor(Dx, 0, n))[:-1]
+
+def bench(n, reps, rng):
+    solvers = {"nn": lambda D: PC._nearest_neighbor(D, 0), "heuristic": _heuristic}
+    if n <= PC.ROUTE_EXACT_MAX: solvers["exact"] = lambda D: PC.held_karp(D, 0)
+    out = {k: [0.0, 0.0] for k in solvers}
+    for _ in range(reps):
+        # 서울 근방 약 40km 사각형
+        Dm = PC.distance_matrix(rng.uniform(37.4, 37.7, n), rng.uniform(126.8, 127.2, n))
+        for k, fn in solvers.items():
+            t0 = time.perf_counter(); path = fn(Dm); ms = (time.perf_counter() - t0) * 1000
+            assert sorted(path) == list(range(n)), k
+            out[k][0] += _tour(Dm, path) / reps; out[k][1] += ms / reps
+    return out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("sizes", nargs="*", type=int, default=SIZES)
+    ap.add_argument("-r", "--reps", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=0)
+    a = ap.parse_args()
+    rng = np.random.default_rng(a.seed)
+    print(f"{'n':>4} {'solver':<10} {'km':>9} {'ms':>8} {'vs best':>8}")
+    for n in a.sizes:
+        res = bench(n, a.reps, rng)
+        best = min(km for km, _ in res.values())
+        for k, (km, ms) in res.items():
+            print(f"{n:>4} {k:<10} {km:>9.2f} {ms:>8.2f} {100*(km/best-1):>7.2f}%")
+    print("selected solver: Held-Karp for n <=", PC.ROUTE_EXACT_MAX, "else heuristic")
+
+if __name__ == "__main__":
+    main()
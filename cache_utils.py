@@ -0,0 +1,73 @@
+import threading, time
+from collections import OrderedDict
+
+_MISSING = object()
+
+class LRUCache:
+    """프로세스 전역에서 공유하는 크기 제한 LRU (스레드 안전)."""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            v = self._data.get(key, _MISSING)
+            if v is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return v
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_compute(self, key, fn):
+        v = self.get(key, _MISSING)
+        if v is _MISSING:
+            v = fn(); self.put(key, v)
+        return v
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear(); self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self._data), "maxsize": self.maxsize}
+
+    def __len__(self):
+        return len(self._data)
+
+class TTLCache(LRUCache):
+    """LRU + 항목별 만료(초). 다른 프로세스의 변경은 ttl 안에서만 늦게 보인다."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        super().__init__(maxsize)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        v = super().get(key, _MISSING)
+        if v is _MISSING: return default
+        expires, value = v
+        if expires < time.monotonic():
+            with self._lock:
+                self._data.pop(key, None); self.hits -= 1; self.misses += 1
+            return default
+        return value
+
+    def put(self, key, value):
+        super().put(key, (time.monotonic() + self.ttl, value))
@@ -0,0 +1,27 @@
+"""파생 테이블(정산 잔액 room_balances/room_expense_totals, 투표 집계 poll_option_counts)이
+원본(expenses, poll_votes)과 맞는지 검사하고, 필요하면 다시 만든다.
+
+    python check_balances.py          # 어긋난 곳이 있으면 exit 1
+    python check_balances.py --fix    # 어긋난 방/투표만 다시 계산
+    python check_balances.py --rebuild  # 전부 다시 계산
+"""
+import sys
+import database as DB
+
+def main(argv):
+    DB.init_db()
+    if "--rebuild" in argv:
+        DB.rebuild_room_balances(); DB.rebuild_poll_counts(); print("rebuilt all"); return 0
+    bad_rooms, bad_polls = DB.verify_room_balances(), DB.verify_poll_counts()
+    for rid in bad_rooms: print("MISMATCH room", rid)
+    for pid in bad_polls: print("MISMATCH poll", pid)
+    if (bad_rooms or bad_polls) and "--fix" in argv:
+        for rid in bad_rooms: DB.rebuild_room_balances(rid)
+        if bad_polls: DB.rebuild_poll_counts()      # 투표 집계는 작아서 통째로
+        bad_rooms, bad_polls = DB.verify_room_balances(), DB.verify_poll_counts()
+        print("fixed" if not (bad_rooms or bad_polls) else f"still mismatched: {bad_rooms} {bad_polls}")
+    print("mismatched rooms:", len(bad_rooms), "polls:", len(bad_polls))
+    return 1 if bad_rooms or bad_polls else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
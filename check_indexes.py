@@ -0,0 +1,67 @@
+"""database.py 안의 모든 쿼리를 EXPLAIN QUERY PLAN 으로 돌려 full scan 이 있으면 실패.
+
+    python check_indexes.py        # 문제 없으면 exit 0, full scan 있으면 exit 1
+
+빈 임시 DB에 init_db() 스키마를 만든 뒤 검사한다. 의도적으로 전체를 훑는 쿼리
+(관리/복구용)는 SQL 안에 `-- full-scan-ok` 주석을 달아 예외 처리한다.
+"""
+import ast, os, re, sys, sqlite3, tempfile
+import database as DB
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(DB.__file__)), "database.py")
+DML = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b", re.I)
+FULL_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW)(\S+)")
+ALLOW = "-- full-scan-ok"
+
+def collect_queries(path=SRC):
+    """(lineno, sql, dynamic) — execute/executemany 첫 인자로 쓰인 문자열 리터럴."""
+    tree = ast.parse(open(path, encoding="utf-8").read())
+    out = []
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and node.func.attr in ("execute", "executemany") and node.args):
+            continue
+        arg = node.args[0]
+        if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+            sql, dynamic = arg.value, False
+        elif isinstance(arg, ast.JoinedStr):
+            # f-string 구간은 자리표시자 하나로 치환해서 시도
+            sql = "".join(v.value if isinstance(v, ast.Constant) else "?" for v in arg.values)
+            dynamic = True
+        else:
+            continue
+        if DML.match(sql):
+            out.append((node.lineno, sql, dynamic))
+    return sorted(out)
+
+def explain(conn, sql):
+    rows = conn.execute("EXPLAIN QUERY PLAN " + sql, [None] * sql.count("?")).fetchall()
+    return [r[3] for r in rows]
+
+def main():
+    tmp = tempfile.mkdtemp()
+    DB.DB_PATH = os.path.join(tmp, "plan.sqlite")
+    DB.init_db()
+    conn = DB.get_conn()
+    bad = 0
+    for lineno, sql, dynamic in collect_queries():
+        head = " ".join(sql.split())[:90]
+        try:
+            plan = explain(conn, sql)
+        except sqlite3.Error as e:
+            if dynamic:
+                print(f"SKIP  database.py:{lineno}  (dynamic SQL: {e})  {head}")
+                continue
+            print(f"ERROR database.py:{lineno}  {e}  {head}"); bad += 1
+            continue
+        scans = [p for p in plan if FULL_SCAN.match(p)]
+        if scans and ALLOW not in sql:
+            print(f"SCAN  database.py:{lineno}  {'; '.join(scans)}  {head}"); bad += 1
+        else:
+            print(f"ok    database.py:{lineno}  {'; '.join(plan) or '-'}")
+    DB.close_all()
+    print("full scans:", bad)
+    return 1 if bad else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
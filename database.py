@@ -1,17 +1,151 @@
-import sqlite3, os, bcrypt, secrets, string, datetime as dt
+import sqlite3, os, math, secrets, string, threading, time, datetime as dt
+from contextlib import contextmanager
+from dataclasses import dataclass
+from types import MappingProxyType
+from cache_utils import LRUCache, TTLCache
+from room_events import BUS
+import passwords as PW
+from planner_core import DayAggregate, schedule_days, split_won, min_transfers
 
 DB_PATH = os.environ.get("PLANNER_DB", "planner.sqlite")
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+# ---------- Connections ----------
+# Streamlit 은 rerun / fragment 실행마다 새 ScriptRunner 스레드를 쓴다. 그래서 커넥션을 스레드에 묶어 두지
+# 않고 작은 풀에서 빌려 쓴다: 스레드가 처음 get_conn() 할 때 하나 빌리고 (PRAGMA·페이지 캐시·mmap 이 살아
+# 있는 채로), 스레드가 끝나 thread-local 이 지워지면 풀로 돌아간다. 풀은 놀고 있는 커넥션을 POOL_SIZE 개까지만
+# 들고, 넘치는 건 닫는다. 호출부에서 close() 하지 말 것. 쓰기는 transaction(), 여러 번 읽기는 read_transaction().
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,       # 음수 = KiB (16MB)
+    "mmap_size": 134217728,     # 128MB
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+POOL_SIZE = int(os.environ.get("PLANNER_DB_POOL", "8"))
+
+_local = threading.local()
+_pool = []                 # 놀고 있는 (path, conn)
+_open = set()              # 열려 있는 모든 커넥션 (close_all 용)
+_pool_lock = threading.Lock()
+pool_stats = {"opened": 0, "reused": 0}
+
+def _open_conn(path:str):
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
     conn.row_factory = sqlite3.Row
+    for k, v in PRAGMAS.items():
+        conn.execute(f"PRAGMA {k}={v}")
+    return conn
+
+def _checkout(path:str):
+    with _pool_lock:
+        while _pool:
+            p, conn = _pool.pop()
+            if p == path:
+                pool_stats["reused"] += 1; return conn
+            _open.discard(conn); conn.close()          # DB_PATH 가 바뀜 (테스트)
+    conn = _open_conn(path)
+    with _pool_lock:
+        _open.add(conn); pool_stats["opened"] += 1
     return conn
 
+def _checkin(conn, path:str):
+    try:
+        if conn.in_transaction: conn.execute("ROLLBACK")
+    except sqlite3.Error:
+        path = None                                    # 닫혔거나 망가짐 → 버린다
+    with _pool_lock:
+        if conn in _open and path == DB_PATH and len(_pool) < POOL_SIZE:
+            _pool.append((path, conn)); return
+        _open.discard(conn)
+    try: conn.close()
+    except sqlite3.Error: pass
+
+class _Lease:
+    """스레드가 빌린 커넥션. 스레드가 끝나 thread-local 이 지워지면 풀로 반납."""
+    __slots__ = ("conn", "path")
+
+    def __init__(self, conn, path):
+        self.conn, self.path = conn, path
+
+    def __del__(self):
+        _checkin(self.conn, self.path)
+
+def get_conn():
+    """현재 스레드가 빌린 커넥션 (없으면 풀에서 빌림)."""
+    lease = getattr(_local, "lease", None)
+    if lease is not None and lease.path == DB_PATH and lease.conn in _open:
+        return lease.conn
+    _local.lease = None                                # 경로가 바뀌었으면 옛 커넥션 반납
+    _local.lease = _Lease(_checkout(DB_PATH), DB_PATH)
+    _local.depth, _local.bumped, _local.mine = 0, {}, None
+    return _local.lease.conn
+
+def close_all():
+    """모든 커넥션 닫기 (테스트/종료용). 다른 스레드가 빌려 간 것도 닫히므로 그 스레드는 다시 빌려야 한다."""
+    with _pool_lock:
+        for conn in _open: conn.close()
+        _open.clear(); _pool.clear()
+    _local.__dict__.clear()
+
+@contextmanager
+def transaction(write:bool=True):
+    """BEGIN IMMEDIATE(쓰기) / BEGIN(읽기 스냅샷). 중첩 호출은 바깥 트랜잭션에 합류."""
+    conn = get_conn()
+    if _local.depth:
+        _local.depth += 1
+        try: yield conn.cursor()
+        finally: _local.depth -= 1
+        return
+    conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+    _local.depth = 1; _local.bumped = {}
+    try:
+        yield conn.cursor()
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK"); raise
+    else:                                      # 커밋 뒤 작업은 실패해도 되돌릴 트랜잭션이 없다
+        BUS.publish_many(_local.bumped)        # 커밋된 버전만 알린다
+        if _local.mine is not None:            # track_my_versions() 한 스레드만 (백그라운드 워커는 안 쌓는다)
+            for r, v in _local.bumped.items(): _local.mine.setdefault(r, set()).add(v)
+    finally:
+        _local.depth = 0; _local.bumped = {}
+
+def read_transaction():
+    return transaction(write=False)
+
+_init_done = set()          # 이 프로세스에서 스키마를 확인한 DB 경로
+_init_lock = threading.Lock()
+
 def init_db():
+    """스키마 생성/마이그레이션. 프로세스·DB 경로당 한 번만 실제로 돈다 (다시 불러도 바로 반환)."""
+    with _init_lock:
+        if DB_PATH in _init_done: return
+        _init_db()
+        _init_done.add(DB_PATH)
+
+def _cols(conn, table:str)->set:
+    return {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+
+# (테이블, 컬럼, 추가 SQL, 뒤따르는 SQL) — 없는 컬럼만 쓰기 트랜잭션 하나에서 추가한다
+MIGRATIONS = [
+    ("users", "nickname", "ALTER TABLE users ADD COLUMN nickname TEXT",
+     "UPDATE users SET nickname = name WHERE nickname IS NULL OR nickname='' -- full-scan-ok (one-off migration)"),
+    ("expenses", "category", "ALTER TABLE expenses ADD COLUMN category TEXT", None),
+    # room 단위 캐시 무효화용 카운터
+    ("rooms", "version", "ALTER TABLE rooms ADD COLUMN version INTEGER NOT NULL DEFAULT 0", None),
+    # 좌표 대기 중인 검색어; 채워지면 NULL
+    ("itinerary_items", "geo_query", "ALTER TABLE itinerary_items ADD COLUMN geo_query TEXT", None),
+    ("room_expense_totals", "version", "ALTER TABLE room_expense_totals ADD COLUMN version INTEGER NOT NULL DEFAULT 0", None),
+]
+
+def _init_db():
     conn = get_conn(); cur = conn.cursor()
+    had_balances = conn.execute("PRAGMA table_info(room_balances)").fetchall()
+    had_poll_counts = conn.execute("PRAGMA table_info(poll_option_counts)").fetchall()
 
+    # executescript는 자체적으로 COMMIT 하므로 transaction() 밖에서 실행
     cur.executescript("""
-    PRAGMA journal_mode=WAL;
 
     CREATE TABLE IF NOT EXISTS users(
       id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -38,6 +172,7 @@ def init_db():
       final_start TEXT,
       final_end   TEXT,
       created_at TEXT NOT NULL,
+      version INTEGER NOT NULL DEFAULT 0,
       FOREIGN KEY(owner_id) REFERENCES users(id)
     );
 
@@ -73,6 +208,7 @@ def init_db():
       start_time TEXT, end_time TEXT,
       is_anchor INTEGER NOT NULL DEFAULT 0,
       notes TEXT,
+      geo_query TEXT,
       created_by INTEGER,
       created_at TEXT NOT NULL,
       FOREIGN KEY(room_id) REFERENCES rooms(id),
@@ -93,6 +229,33 @@ def init_db():
       FOREIGN KEY(payer_id) REFERENCES users(id)
     );
 
+    -- 지출별 참여자 (행이 없으면 방 멤버 전원이 나눠 냄)
+    CREATE TABLE IF NOT EXISTS expense_participants(
+      expense_id INTEGER NOT NULL,
+      user_id INTEGER NOT NULL,
+      PRIMARY KEY(expense_id, user_id),
+      FOREIGN KEY(expense_id) REFERENCES expenses(id),
+      FOREIGN KEY(user_id) REFERENCES users(id)
+    );
+
+    -- 정산용 누적 잔액 (add_expense/delete_expense 가 같은 트랜잭션에서 갱신, check_balances.py 로 검증/재구축)
+    -- paid: 낸 돈, owed: 참여자 지정 지출에서 부담할 몫 (전원 분담분은 room_expense_totals.shared 로 읽을 때 나눈다)
+    CREATE TABLE IF NOT EXISTS room_balances(
+      room_id TEXT NOT NULL,
+      user_id INTEGER NOT NULL,
+      paid INTEGER NOT NULL DEFAULT 0,
+      owed INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY(room_id, user_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS room_expense_totals(
+      room_id TEXT PRIMARY KEY,
+      total INTEGER NOT NULL DEFAULT 0,
+      shared INTEGER NOT NULL DEFAULT 0,
+      n INTEGER NOT NULL DEFAULT 0,
+      version INTEGER NOT NULL DEFAULT 0     -- 지출이 바뀔 때마다 +1 (지출 그래프 캐시 키)
+    );
+
     CREATE TABLE IF NOT EXISTS announcements(
       id INTEGER PRIMARY KEY AUTOINCREMENT,
       room_id TEXT NOT NULL,
@@ -122,6 +285,14 @@ def init_db():
       text TEXT NOT NULL,
       FOREIGN KEY(poll_id) REFERENCES polls(id)
     );
+    -- 보기별 득표 수 (cast_vote 가 같은 트랜잭션에서 증감, check_balances.py 로 검증/재구축)
+    CREATE TABLE IF NOT EXISTS poll_option_counts(
+      poll_id INTEGER NOT NULL,
+      option_id INTEGER NOT NULL,
+      c INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY(poll_id, option_id)
+    );
+
     CREATE TABLE IF NOT EXISTS poll_votes(
       poll_id INTEGER NOT NULL,
       option_id INTEGER NOT NULL,
@@ -132,6 +303,48 @@ def init_db():
       FOREIGN KEY(option_id) REFERENCES poll_options(id),
       FOREIGN KEY(user_id) REFERENCES users(id)
     );
+    CREATE TABLE IF NOT EXISTS reset_tokens(
+      token TEXT PRIMARY KEY,
+      user_id INTEGER NOT NULL,
+      expires_at TEXT NOT NULL,
+      used INTEGER NOT NULL DEFAULT 0,
+      created_at TEXT NOT NULL,
+      FOREIGN KEY(user_id) REFERENCES users(id)
+    );
+
+    -- 지오코딩 결과 캐시 (정규화한 검색어 기준, found=0 은 "없음" 캐시)
+    CREATE TABLE IF NOT EXISTS geocode_cache(
+      query TEXT PRIMARY KEY,
+      lat REAL, lon REAL,
+      found INTEGER NOT NULL,
+      provider TEXT NOT NULL,
+      fetched_at TEXT NOT NULL
+    );
+
+    -- 보낼 메일 대기열 (email_utils 의 워커가 처리). next_attempt_at 이 지난 pending 만 보낸다
+    CREATE TABLE IF NOT EXISTS email_outbox(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      to_addr TEXT NOT NULL,
+      subject TEXT NOT NULL,
+      body TEXT NOT NULL,
+      status TEXT NOT NULL DEFAULT 'pending',
+      attempts INTEGER NOT NULL DEFAULT 0,
+      next_attempt_at TEXT NOT NULL,
+      last_error TEXT,
+      created_at TEXT NOT NULL,
+      sent_at TEXT
+    );
+
+    -- room_id / poll_id 기준 접근 경로용 보조 인덱스 (check_indexes.py 로 점검)
+    CREATE INDEX IF NOT EXISTS memberships_room_idx    ON memberships(room_id, submitted, user_id);
+    CREATE INDEX IF NOT EXISTS availability_room_idx   ON availability(room_id, day, status, user_id);
+    CREATE INDEX IF NOT EXISTS itinerary_room_day_idx  ON itinerary_items(room_id, day, position);
+    CREATE INDEX IF NOT EXISTS expenses_room_idx       ON expenses(room_id, created_at);
+    CREATE INDEX IF NOT EXISTS announcements_room_idx  ON announcements(room_id, pinned, created_at);
+    CREATE INDEX IF NOT EXISTS polls_room_idx          ON polls(room_id, created_at);
+    CREATE INDEX IF NOT EXISTS poll_options_poll_idx   ON poll_options(poll_id);
+    CREATE INDEX IF NOT EXISTS poll_votes_user_idx     ON poll_votes(poll_id, user_id, option_id);
+    CREATE INDEX IF NOT EXISTS email_outbox_due_idx    ON email_outbox(status, next_attempt_at);
     """)
 
     # ---- site admins ----
@@ -143,33 +356,38 @@ def init_db():
       )
     """)
 
-    # rooms.final_* migration already handled above. Users.nickname migration:
-    cur.execute("PRAGMA table_info(users)")
-    ucols = [r[1] for r in cur.fetchall()]
-    if "nickname" not in ucols:
-        cur.execute("ALTER TABLE users ADD COLUMN nickname TEXT")
-        cur.execute("UPDATE users SET nickname = name WHERE nickname IS NULL OR nickname=''")
-
-    # expenses.category migration (if older DB)
-    cur.execute("PRAGMA table_info(expenses)")
-    ecols = [r[1] for r in cur.fetchall()]
-    if "category" not in ecols:
-        cur.execute("ALTER TABLE expenses ADD COLUMN category TEXT")
-
-    conn.commit(); conn.close()
+    # PRAGMA table_info 는 락 없이 읽고, 빠진 컬럼이 있을 때만 쓰기 트랜잭션을 연다
+    todo = [m for m in MIGRATIONS if m[1] not in _cols(conn, m[0])]
+    if todo:
+        with transaction() as cur:
+            for table, col, add, after in todo:
+                if col in _cols(conn, table): continue      # 그 사이 다른 프로세스가 추가
+                cur.execute(add)
+                if after: cur.execute(after)
+    conn.execute("""CREATE INDEX IF NOT EXISTS itinerary_geo_pending_idx
+                    ON itinerary_items(geo_query) WHERE geo_query IS NOT NULL""")
+
+    if not had_balances: rebuild_room_balances()     # 기존 DB: 지출에서 한 번 채운다
+    if not had_poll_counts: rebuild_poll_counts()     # 기존 DB: 투표에서 한 번 채운다
+    conn.execute("PRAGMA optimize")                   # 프로세스 시작 때 한 번
+
+# 사이트 관리자 여부 캐시 (방 화면마다 읽음). 이 프로세스의 변경은 즉시 무효화, 다른 프로세스 변경은 TTL 안에 반영
+_USER_TTL = float(os.environ.get("PLANNER_USER_CACHE_TTL", "60"))
+ADMIN_CACHE = TTLCache(maxsize=2048, ttl=_USER_TTL)
 
 # ---------- Site Admins ----------
 def is_site_admin(user_id:int|None)->bool:
     if not user_id: return False
-    c=get_conn().cursor()
-    c.execute("SELECT 1 FROM site_admins WHERE user_id=?", (user_id,))
-    ok = bool(c.fetchone()); c.connection.close(); return ok
+    return ADMIN_CACHE.get_or_compute(user_id, lambda: get_conn().execute(
+        "SELECT 1 FROM site_admins WHERE user_id=?", (user_id,)).fetchone() is not None)
 
 def grant_admin_by_user_id(user_id:int)->bool:
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("INSERT OR IGNORE INTO site_admins(user_id,granted_at) VALUES(?,?)",
-                (user_id, dt.datetime.utcnow().isoformat()))
-    conn.commit(); ok = cur.rowcount>0; conn.close(); return ok
+    with transaction() as cur:
+        cur.execute("INSERT OR IGNORE INTO site_admins(user_id,granted_at) VALUES(?,?)",
+                    (user_id, dt.datetime.utcnow().isoformat()))
+        changed=cur.rowcount>0
+    ADMIN_CACHE.pop(user_id)
+    return changed
 
 def grant_admin_by_email(email:str)->bool:
     u=get_user_by_email(email)
@@ -179,49 +397,72 @@ def grant_admin_by_email(email:str)->bool:
 def revoke_admin_by_email(email:str)->bool:
     u=get_user_by_email(email)
     if not u: return False
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("DELETE FROM site_admins WHERE user_id=?", (u["id"],))
-    conn.commit(); ok=cur.rowcount>0; conn.close(); return ok
+    with transaction() as cur:
+        cur.execute("DELETE FROM site_admins WHERE user_id=?", (u["id"],))
+        changed=cur.rowcount>0
+    ADMIN_CACHE.pop(u["id"])
+    return changed
 
 # ---- Auth primitives ----
+# bcrypt 는 passwords 의 전용 풀에서 (동시 실행 수 제한, 지연 시간 측정)
 def hash_pw(pw:str)->bytes:
-    return bcrypt.hashpw(pw.encode("utf-8"), bcrypt.gensalt())
+    return PW.hash_pw(pw)
 
 def check_pw(pw:str, pw_hash:bytes)->bool:
-    try: return bcrypt.checkpw(pw.encode("utf-8"), pw_hash)
-    except Exception: return False
-
-def email_exists(email:str)->bool:
-    c=get_conn().cursor(); c.execute("SELECT 1 FROM users WHERE email=?", (email,)); r=c.fetchone(); c.connection.close(); return bool(r)
-
-def nickname_exists(nick:str)->bool:
-    c=get_conn().cursor(); c.execute("SELECT 1 FROM users WHERE nickname=?", (nick,)); r=c.fetchone(); c.connection.close(); return bool(r)
+    return PW.check_pw(pw, pw_hash)
+
+def rehash_password_later(user_id:int, pw:str, old_hash:bytes):
+    """로그인 성공 후 비용(rounds)이 바뀐 해시를 백그라운드에서 새 비용으로 교체.
+    그 사이 비밀번호가 바뀌었으면(old_hash 불일치) 덮어쓰지 않는다."""
+    def save(fut):
+        try:
+            with transaction() as cur:
+                cur.execute("UPDATE users SET pw_hash=? WHERE id=? AND pw_hash=?", (fut.result(), user_id, old_hash))
+        except Exception as e:
+            print("rehash 실패:", e)
+    PW.hash_pw_async(pw).add_done_callback(save)
+
+def _taken(email:str, nickname:str):
+    """이미 쓰이는 쪽: 'email_taken' | 'nickname_taken' | None (한 쿼리)"""
+    r=get_conn().execute("SELECT MAX(email=?), MAX(nickname=?) FROM users WHERE email=? OR nickname=?",
+                         (email, nickname, email, nickname)).fetchone()
+    if r[0]: return "email_taken"
+    if r[1]: return "nickname_taken"
+    return None
 
 def create_user(email:str, name:str, nickname:str, pw:str):
-    if email_exists(email): raise ValueError("email_taken")
-    if nickname and nickname_exists(nickname): raise ValueError("nickname_taken")
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("INSERT INTO users(email,name,nickname,pw_hash,created_at) VALUES(?,?,?,?,?)",
-                (email, name, nickname, hash_pw(pw), dt.datetime.utcnow().isoformat()))
-    conn.commit(); uid=cur.lastrowid; conn.close(); return uid
-
+    """중복 검사는 UNIQUE 제약(email, users_nickname_uq)에 맡긴다 → email_taken / nickname_taken.
+    bcrypt 전에 한 번 미리 봐서 뻔한 중복 가입에 해시를 낭비하지 않는다 (경합은 제약이 잡는다)."""
+    taken=_taken(email, nickname or None)
+    if taken: raise ValueError(taken)
+    pw_hash=hash_pw(pw)   # bcrypt는 트랜잭션(쓰기 락) 밖에서
+    try:
+        with transaction() as cur:
+            cur.execute("INSERT INTO users(email,name,nickname,pw_hash,created_at) VALUES(?,?,?,?,?)",
+                        (email, name, nickname or None, pw_hash, dt.datetime.utcnow().isoformat()))
+            return cur.lastrowid
+    except sqlite3.IntegrityError as e:
+        if "users.email" in str(e): raise ValueError("email_taken")
+        if "users.nickname" in str(e): raise ValueError("nickname_taken")
+        raise
+
+# 사용자 행은 캐시하지 않는다: 로그인/재설정/초대 때 한 번씩뿐이고, 다른 프로세스의 비밀번호 변경이
+# 바로 보여야 한다.
 def get_user_by_email(email:str):
-    c=get_conn().cursor(); c.execute("SELECT * FROM users WHERE email=?", (email,)); r=c.fetchone(); c.connection.close(); return r
+    return get_conn().execute("SELECT * FROM users WHERE email=?", (email,)).fetchone()
 
 def get_user_by_login(login:str):
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("SELECT * FROM users WHERE email=?", (login,)); row=cur.fetchone()
-    if not row:
-        cur.execute("SELECT * FROM users WHERE nickname=?", (login,)); row=cur.fetchone()
-    conn.close(); return row
+    """이메일 또는 닉네임으로 한 번에 조회 (둘 다 맞으면 이메일 우선)"""
+    return get_conn().execute("SELECT * FROM users WHERE email=? OR nickname=? ORDER BY email=? DESC LIMIT 1",
+                              (login,)*3).fetchone()
 
 def get_user(user_id:int):
-    c=get_conn().cursor(); c.execute("SELECT * FROM users WHERE id=?", (user_id,)); r=c.fetchone(); c.connection.close(); return r
+    return get_conn().execute("SELECT * FROM users WHERE id=?", (user_id,)).fetchone()
 
 def update_password(user_id:int, new_pw:str):
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("UPDATE users SET pw_hash=? WHERE id=?", (hash_pw(new_pw), user_id))
-    conn.commit(); conn.close()
+    pw_hash=hash_pw(new_pw)
+    with transaction() as cur:
+        cur.execute("UPDATE users SET pw_hash=? WHERE id=?", (pw_hash, user_id))
 
 # reset token
 def create_reset_token(email:str, ttl_minutes:int=30):
@@ -229,22 +470,96 @@ def create_reset_token(email:str, ttl_minutes:int=30):
     if not user: return None, "no_user"
     token = secrets.token_urlsafe(32)
     expires = (dt.datetime.utcnow() + dt.timedelta(minutes=ttl_minutes)).isoformat()
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("INSERT INTO reset_tokens(token,user_id,expires_at,used,created_at) VALUES(?,?,?,?,?)",
-                (token, user["id"], expires, 0, dt.datetime.utcnow().isoformat()))
-    conn.commit(); conn.close(); return token, "ok"
+    with transaction() as cur:
+        cur.execute("INSERT INTO reset_tokens(token,user_id,expires_at,used,created_at) VALUES(?,?,?,?,?)",
+                    (token, user["id"], expires, 0, dt.datetime.utcnow().isoformat()))
+    return token, "ok"
 
 def verify_reset_token(token:str):
-    c=get_conn().cursor(); c.execute("SELECT * FROM reset_tokens WHERE token=?", (token,)); row=c.fetchone(); c.connection.close()
+    row=get_conn().execute("SELECT * FROM reset_tokens WHERE token=?", (token,)).fetchone()
     if not row: return None, "not_found"
     if row["used"]: return None, "used"
     if dt.datetime.fromisoformat(row["expires_at"]) < dt.datetime.utcnow(): return None, "expired"
     return row, "ok"
 
 def consume_reset_token(token:str):
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("UPDATE reset_tokens SET used=1 WHERE token=?", (token,))
-    conn.commit(); conn.close()
+    with transaction() as cur:
+        cur.execute("UPDATE reset_tokens SET used=1 WHERE token=?", (token,))
+
+# ---- Room versions / derived cache ----
+# 방 데이터를 바꾸는 모든 쓰기는 같은 트랜잭션 안에서 _bump() 한다.
+# 파생 집계는 (room_id, version, kind) 키로 프로세스 전역 LRU에 캐시.
+ROOM_CACHE = LRUCache(maxsize=int(os.environ.get("PLANNER_ROOM_CACHE", "256")))
+
+def _note_bumps(cur):
+    # RETURNING id, version 결과를 모아 두었다가 transaction() 이 COMMIT 뒤에 BUS 로 알린다
+    rows = cur.fetchall()
+    for r in rows: _local.bumped[r[0]] = r[1]
+    return len(rows)
+
+def _bump(cur, room_id:str):
+    cur.execute("UPDATE rooms SET version=version+1 WHERE id=? RETURNING id, version", (room_id,))
+    _note_bumps(cur)
+
+def _bump_poll(cur, poll_id:int):
+    cur.execute("UPDATE rooms SET version=version+1 WHERE id=(SELECT room_id FROM polls WHERE id=?) RETURNING id, version", (poll_id,))
+    _note_bumps(cur)
+
+def track_my_versions():
+    """이 스레드가 커밋하는 방 버전을 모으기 시작 (Streamlit 실행마다 새 스레드라 실행 단위로 끝난다)."""
+    get_conn(); _local.mine = {}
+
+def take_my_versions()->dict:
+    """track_my_versions() 이후 이 스레드가 커밋한 방 버전들 {room_id: {version,...}} (가져가면 비움).
+    화면이 자기 쓰기로 올라간 버전과 다른 사람의 변경을 구분할 때 쓴다."""
+    get_conn(); mine = _local.mine or {}
+    if _local.mine is not None: _local.mine = {}
+    return mine
+
+def room_version(room_id:str)->int|None:
+    r=get_conn().execute("SELECT version FROM rooms WHERE id=?", (room_id,)).fetchone()
+    return r["version"] if r else None
+
+# ---- Change watcher ----
+# 이 프로세스의 쓰기는 transaction() 이 COMMIT 뒤에 바로 BUS 로 알린다. 다른 프로세스(관리 스크립트,
+# 두 번째 서버)의 쓰기는 여기서 잡는다: PRAGMA data_version 은 "다른 커넥션이 커밋하면" 바뀌는 값이라
+# 평소엔 그 숫자 하나만 읽고, 바뀌었을 때만 보고 있는 방들의 version 을 한 번에 읽는다.
+WATCH_INTERVAL = float(os.environ.get("PLANNER_WATCH_INTERVAL", "1.0"))
+_watcher = None
+_watcher_lock = threading.Lock()
+
+def _watch_changes(interval:float):
+    last = None
+    while True:
+        try:
+            conn = get_conn()
+            dv = conn.execute("PRAGMA data_version").fetchone()[0]
+            rooms = BUS.watched_rooms()
+            if dv != last and rooms:
+                q = ",".join("?"*len(rooms))
+                found = {r[0]: r[1] for r in conn.execute(f"SELECT id, version FROM rooms WHERE id IN ({q})", rooms)}
+                for room_id in rooms:
+                    if room_id in found: BUS.publish(room_id, found[room_id])
+                    else:                                   # 다른 곳에서 삭제됨
+                        BUS.publish(room_id, (BUS.version(room_id) or 0) + 1); BUS.unwatch(room_id)
+            last = dv
+        except sqlite3.Error as e:
+            print("change watcher:", e)
+        time.sleep(interval)
+
+def start_change_watcher(interval:float=None):
+    """프로세스당 하나 (여러 번 불러도 됨). 0 이하 간격이면 시작하지 않는다."""
+    global _watcher
+    interval = WATCH_INTERVAL if interval is None else interval
+    if interval <= 0: return None
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = threading.Thread(target=_watch_changes, args=(interval,), name="db-change-watcher", daemon=True)
+            _watcher.start()
+        return _watcher
+
+def cache_stats()->dict:
+    return ROOM_CACHE.stats()
 
 # ---- Rooms / Members ----
 def gen_room_id(n=6):
@@ -254,15 +569,15 @@ def gen_room_id(n=6):
 def create_room(owner_id:int, title:str, start:str, end:str, min_days:int, quorum:int,
                 w_full=1.0, w_am=0.3, w_pm=0.1, w_eve=0.5):
     rid = gen_room_id()
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("""INSERT INTO rooms(id,title,owner_id,start,end,min_days,quorum,
-                 w_full,w_am,w_pm,w_eve,created_at)
-                 VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
-                (rid,title,owner_id,start,end,min_days,quorum,
-                 w_full,w_am,w_pm,w_eve,dt.datetime.utcnow().isoformat()))
-    cur.execute("INSERT OR IGNORE INTO memberships(user_id,room_id,role,submitted) VALUES(?,?,?,0)",
-                (owner_id,rid,"owner"))
-    conn.commit(); conn.close(); return rid
+    with transaction() as cur:
+        cur.execute("""INSERT INTO rooms(id,title,owner_id,start,end,min_days,quorum,
+                     w_full,w_am,w_pm,w_eve,created_at)
+                     VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
+                    (rid,title,owner_id,start,end,min_days,quorum,
+                     w_full,w_am,w_pm,w_eve,dt.datetime.utcnow().isoformat()))
+        cur.execute("INSERT OR IGNORE INTO memberships(user_id,room_id,role,submitted) VALUES(?,?,?,0)",
+                    (owner_id,rid,"owner"))
+    return rid
 
 def update_room(owner_id:int, room_id:str, **fields):
     if not fields: return False
@@ -272,133 +587,139 @@ def update_room(owner_id:int, room_id:str, **fields):
             keys.append(f"{k}=?"); vals.append(v)
     if not keys: return False
     vals += [owner_id, room_id]
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute(f"UPDATE rooms SET {', '.join(keys)} WHERE owner_id=? AND id=?", vals)
-    conn.commit(); ok=cur.rowcount>0; conn.close(); return ok
+    with transaction() as cur:
+        cur.execute(f"UPDATE rooms SET {', '.join(keys)}, version=version+1 WHERE owner_id=? AND id=? RETURNING id, version", vals)
+        return _note_bumps(cur)>0
+
+def _delete_room_rows(cur, room_id:str):
+    cur.execute("DELETE FROM memberships WHERE room_id=?", (room_id,))
+    cur.execute("DELETE FROM availability WHERE room_id=?", (room_id,))
+    cur.execute("DELETE FROM itinerary_items WHERE room_id=?", (room_id,))
+    cur.execute("DELETE FROM expense_participants WHERE expense_id IN (SELECT id FROM expenses WHERE room_id=?)", (room_id,))
+    cur.execute("DELETE FROM expenses WHERE room_id=?", (room_id,))
+    cur.execute("DELETE FROM room_balances WHERE room_id=?", (room_id,))
+    cur.execute("DELETE FROM room_expense_totals WHERE room_id=?", (room_id,))
+    cur.execute("DELETE FROM announcements WHERE room_id=?", (room_id,))
+    cur.execute("DELETE FROM poll_votes WHERE poll_id IN (SELECT id FROM polls WHERE room_id=?)", (room_id,))
+    cur.execute("DELETE FROM poll_option_counts WHERE poll_id IN (SELECT id FROM polls WHERE room_id=?)", (room_id,))
+    cur.execute("DELETE FROM poll_options WHERE poll_id IN (SELECT id FROM polls WHERE room_id=?)", (room_id,))
+    cur.execute("DELETE FROM polls WHERE room_id=?", (room_id,))
 
 def delete_room(room_id:str, owner_id:int):
     """Delete by owner (legacy API)."""
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("DELETE FROM rooms WHERE id=? AND owner_id=?", (room_id, owner_id))
-    did=cur.rowcount
-    if did:
-        cur.execute("DELETE FROM memberships WHERE room_id=?", (room_id,))
-        cur.execute("DELETE FROM availability WHERE room_id=?", (room_id,))
-        cur.execute("DELETE FROM itinerary_items WHERE room_id=?", (room_id,))
-        cur.execute("DELETE FROM expenses WHERE room_id=?", (room_id,))
-        cur.execute("DELETE FROM announcements WHERE room_id=?", (room_id,))
-        cur.execute("DELETE FROM polls WHERE room_id=?", (room_id,))
-        cur.execute("DELETE FROM poll_options WHERE poll_id NOT IN (SELECT id FROM polls)")
-        cur.execute("DELETE FROM poll_votes WHERE poll_id NOT IN (SELECT id FROM polls)")
-    conn.commit(); conn.close(); return bool(did)
+    with transaction() as cur:
+        cur.execute("DELETE FROM rooms WHERE id=? AND owner_id=? RETURNING id, version+1", (room_id, owner_id))
+        did=_note_bumps(cur)          # 보고 있던 세션도 한 번 다시 그려 '방 없음'을 보게
+        if did: _delete_room_rows(cur, room_id)
+    return bool(did)
 
 def admin_delete_room(room_id:str):
     """Delete regardless of owner (site admin use)."""
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("DELETE FROM rooms WHERE id=?", (room_id,))
-    did=cur.rowcount
-    if did:
-        cur.execute("DELETE FROM memberships WHERE room_id=?", (room_id,))
-        cur.execute("DELETE FROM availability WHERE room_id=?", (room_id,))
-        cur.execute("DELETE FROM itinerary_items WHERE room_id=?", (room_id,))
-        cur.execute("DELETE FROM expenses WHERE room_id=?", (room_id,))
-        cur.execute("DELETE FROM announcements WHERE room_id=?", (room_id,))
-        cur.execute("DELETE FROM polls WHERE room_id=?", (room_id,))
-        cur.execute("DELETE FROM poll_options WHERE poll_id NOT IN (SELECT id FROM polls)")
-        cur.execute("DELETE FROM poll_votes WHERE poll_id NOT IN (SELECT id FROM polls)")
-    conn.commit(); conn.close(); return bool(did)
+    with transaction() as cur:
+        cur.execute("DELETE FROM rooms WHERE id=? RETURNING id, version+1", (room_id,))
+        did=_note_bumps(cur)          # 보고 있던 세션도 한 번 다시 그려 '방 없음'을 보게
+        if did: _delete_room_rows(cur, room_id)
+    return bool(did)
 
 def list_my_rooms(user_id:int):
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("""SELECT r.*, m.role, m.submitted FROM rooms r
+    return get_conn().execute("""SELECT r.*, m.role, m.submitted FROM rooms r
                    JOIN memberships m ON m.room_id=r.id
                    WHERE m.user_id=?
-                   ORDER BY r.created_at DESC""", (user_id,))
-    rows=cur.fetchall(); conn.close(); return rows
+                   ORDER BY r.created_at DESC""", (user_id,)).fetchall()
 
 def get_room(room_id:str):
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("SELECT * FROM rooms WHERE id=?", (room_id,)); room=cur.fetchone()
-    cur.execute("""SELECT u.id,u.name,u.email,u.nickname,m.role,m.submitted
-                   FROM memberships m JOIN users u ON u.id=m.user_id
-                   WHERE m.room_id=? ORDER BY u.name""", (room_id,))
-    members=cur.fetchall()
-    conn.close(); return room, members
+    with read_transaction() as cur:
+        cur.execute("SELECT * FROM rooms WHERE id=?", (room_id,)); room=cur.fetchone()
+        cur.execute("""SELECT u.id,u.name,u.email,u.nickname,m.role,m.submitted
+                       FROM memberships m JOIN users u ON u.id=m.user_id
+                       WHERE m.room_id=? ORDER BY u.name""", (room_id,))
+        members=cur.fetchall()
+    return room, members
 
 def invite_user_by_email(room_id:str, email:str):
     u=get_user_by_email(email)
     if not u: return False, "해당 이메일의 사용자가 아직 없어요."
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("INSERT OR IGNORE INTO memberships(user_id,room_id,role,submitted) VALUES(?,?,?,0)",
-                (u["id"], room_id, "member"))
-    conn.commit(); conn.close(); return True, "초대 완료"
+    with transaction() as cur:
+        cur.execute("INSERT OR IGNORE INTO memberships(user_id,room_id,role,submitted) VALUES(?,?,?,0)",
+                    (u["id"], room_id, "member"))
+        if cur.rowcount: _bump(cur, room_id)
+    return True, "초대 완료"
 
 def remove_member(room_id:str, user_id:int):
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("DELETE FROM availability WHERE user_id=? AND room_id=?", (user_id, room_id))
-    cur.execute("DELETE FROM memberships WHERE user_id=? AND room_id=?", (user_id, room_id))
-    conn.commit(); conn.close()
+    with transaction() as cur:
+        cur.execute("DELETE FROM availability WHERE user_id=? AND room_id=?", (user_id, room_id))
+        cur.execute("DELETE FROM memberships WHERE user_id=? AND room_id=?", (user_id, room_id))
+        _bump(cur, room_id)
 
 # ---- Availability / Submission ----
+DEFAULT_WEIGHTS = {"full":1.0, "am":0.7, "pm":0.5, "eve":0.4, "off":0.0}
+
 def get_weights(room):
-    return {"full":1.0, "am":0.7, "pm":0.5, "eve":0.4, "off":0.0}
-
-def upsert_availability(user_id:int, room_id:str, items:dict):
-    conn=get_conn(); cur=conn.cursor()
-    for day, status in items.items():
-        cur.execute("""INSERT INTO availability(user_id,room_id,day,status)
-                       VALUES (?,?,?,?)
-                       ON CONFLICT(user_id,room_id,day)
-                       DO UPDATE SET status=excluded.status""",
-                    (user_id,room_id,day,status))
-    conn.commit(); conn.close()
+    """방에 저장된 가중치(rooms.w_*). 가중치 벡터는 방 집계(DayAggregate)와 함께 version 단위로 캐시된다."""
+    if room is None: return dict(DEFAULT_WEIGHTS)
+    return {"full": float(room["w_full"]), "am": float(room["w_am"]),
+            "pm": float(room["w_pm"]), "eve": float(room["w_eve"]), "off": 0.0}
+
+def _set_submitted(cur, user_id:int, room_id:str, submitted:bool)->int:
+    cur.execute("UPDATE memberships SET submitted=? WHERE user_id=? AND room_id=? AND submitted<>?",
+                (1 if submitted else 0, user_id, room_id, 1 if submitted else 0))
+    return cur.rowcount
+
+def upsert_availability(user_id:int, room_id:str, items:dict, submitted:bool|None=None)->int:
+    """바뀐 날짜만 한 트랜잭션에서 executemany. submitted 를 주면 제출 플래그도 같이 갱신.
+    반환값: 바뀐 availability 행 수."""
+    with transaction() as cur:
+        cur.execute("SELECT day,status FROM availability WHERE user_id=? AND room_id=?", (user_id, room_id))
+        cur_map={r["day"]: r["status"] for r in cur.fetchall()}
+        return apply_availability_delta(user_id, room_id,
+            {day: status for day, status in items.items() if cur_map.get(day)!=status}, submitted)
+
+def apply_availability_delta(user_id:int, room_id:str, delta:dict, submitted:bool|None=None)->int:
+    """호출부가 이미 계산한 변경분(day -> status)만 저장. 반환값: 건드린 행 수."""
+    with transaction() as cur:
+        n=0
+        if delta:
+            cur.executemany("""INSERT INTO availability(user_id,room_id,day,status)
+                               VALUES (?,?,?,?)
+                               ON CONFLICT(user_id,room_id,day)
+                               DO UPDATE SET status=excluded.status""",
+                            [(user_id,room_id,day,status) for day,status in delta.items()])
+            n=cur.rowcount
+        flag=_set_submitted(cur, user_id, room_id, submitted) if submitted is not None else 0
+        if n or flag: _bump(cur, room_id)
+    return n
 
 def get_my_availability(user_id:int, room_id:str)->dict:
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("SELECT day,status FROM availability WHERE user_id=? AND room_id=?", (user_id,room_id))
-    rows=cur.fetchall(); conn.close()
+    rows=get_conn().execute("SELECT day,status FROM availability WHERE user_id=? AND room_id=?", (user_id,room_id)).fetchall()
     return {r["day"]: r["status"] for r in rows}
 
-def clear_my_availability(user_id:int, room_id:str):
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("DELETE FROM availability WHERE user_id=? AND room_id=?", (user_id, room_id))
-    conn.commit(); conn.close()
+def clear_my_availability(user_id:int, room_id:str, submitted:bool|None=None):
+    with transaction() as cur:
+        cur.execute("DELETE FROM availability WHERE user_id=? AND room_id=?", (user_id, room_id))
+        n=cur.rowcount
+        flag=_set_submitted(cur, user_id, room_id, submitted) if submitted is not None else 0
+        if n or flag: _bump(cur, room_id)
 
 def set_submitted(user_id:int, room_id:str, submitted:bool):
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("UPDATE memberships SET submitted=? WHERE user_id=? AND room_id=?",
-                (1 if submitted else 0, user_id, room_id))
-    conn.commit(); conn.close()
+    with transaction() as cur:
+        if _set_submitted(cur, user_id, room_id, submitted): _bump(cur, room_id)
 
 def all_submitted(room_id:str)->bool:
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("SELECT COUNT(*) AS c FROM memberships WHERE room_id=?", (room_id,)); total=cur.fetchone()["c"]
-    if total==0: conn.close(); return False
-    cur.execute("SELECT COUNT(*) AS c FROM memberships WHERE room_id=? AND submitted=1", (room_id,)); done=cur.fetchone()["c"]
-    conn.close(); return done>=total
+    r=get_conn().execute("SELECT COUNT(*) AS c, COALESCE(SUM(submitted),0) AS done FROM memberships WHERE room_id=?", (room_id,)).fetchone()
+    if r["c"]==0: return False
+    return r["done"]>=r["c"]
 
-def day_aggregate(room_id:str):
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("SELECT * FROM rooms WHERE id=?", (room_id,)); room=cur.fetchone()
+def _room_days(room)->list[str]:
+    d0=dt.date.fromisoformat(room["start"]); d1=dt.date.fromisoformat(room["end"])
+    return [(d0+dt.timedelta(days=i)).isoformat() for i in range((d1-d0).days+1)]
+
+def _aggregate(room, rows):
+    """availability rows(user_id,day,status) -> days, agg(DayAggregate, dict처럼도 사용 가능), weights"""
     w=get_weights(room)
-    import datetime as _dt
-    d0=_dt.date.fromisoformat(room["start"]); d1=_dt.date.fromisoformat(room["end"])
-    days=[(d0+_dt.timedelta(days=i)).isoformat() for i in range((d1-d0).days+1)]
-    cur.execute("SELECT user_id, day, status FROM availability WHERE room_id=?", (room_id,))
-    rows=cur.fetchall(); conn.close()
-    agg={d:{"full":0,"am":0,"pm":0,"eve":0,"off":0,"score":0.0} for d in days}
-    for r in rows:
-        if r["day"] in agg: agg[r["day"]][r["status"]] += 1
-    for d in days:
-        a=agg[d]; a["score"]=a["full"]*w["full"] + a["am"]*w["am"] + a["pm"]*w["pm"] + a["eve"]*w["eve"]
-    return room, days, agg, w
+    days=_room_days(room)
+    return days, DayAggregate.from_rows(days, rows, w), w
 
-def availability_names_by_day(room_id:str):
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("""SELECT a.day, a.status, COALESCE(u.nickname, u.name) AS name
-                   FROM availability a JOIN users u ON u.id=a.user_id
-                   WHERE a.room_id=?""", (room_id,))
-    rows=cur.fetchall(); conn.close()
+def _names_by_day(rows):
     out={}
     for r in rows:
         d=r["day"]; s=r["status"]; n=r["name"]
@@ -408,159 +729,565 @@ def availability_names_by_day(room_id:str):
             out[d][s]=sorted(out[d][s], key=lambda x:x.lower())
     return out
 
+def _availability_view(cur, room):
+    """방 availability 파생 데이터 (room.version 단위로 캐시, 공유 객체이므로 수정 금지)."""
+    def build():
+        cur.execute("""SELECT a.user_id, a.day, a.status, COALESCE(u.nickname, u.name) AS name
+                       FROM availability a JOIN users u ON u.id=a.user_id
+                       WHERE a.room_id=?""", (room["id"],))
+        rows=cur.fetchall()
+        days, agg, w = _aggregate(room, rows)
+        by_user={}; user_names={}
+        for r in rows:
+            by_user.setdefault(r["user_id"], {})[r["day"]]=r["status"]; user_names[r["user_id"]]=r["name"]
+        return {"days": tuple(days), "agg": agg, "weights": w,
+                "names_by_day": _names_by_day(rows), "by_user": by_user, "user_names": user_names}
+    return ROOM_CACHE.get_or_compute((room["id"], room["version"], "availability"), build)
+
+def day_aggregate(room_id:str):
+    with read_transaction() as cur:
+        cur.execute("SELECT * FROM rooms WHERE id=?", (room_id,)); room=cur.fetchone()
+        av=_availability_view(cur, room)
+    return room, list(av["days"]), av["agg"], av["weights"]
+
+def availability_names_by_day(room_id:str):
+    with read_transaction() as cur:
+        room=cur.execute("SELECT * FROM rooms WHERE id=?", (room_id,)).fetchone()
+        if not room: return {}
+        return _availability_view(cur, room)["names_by_day"]
+
 def set_final_window(room_id:str, owner_id:int, start:str, end:str)->bool:
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("UPDATE rooms SET final_start=?, final_end=? WHERE id=? AND owner_id=?",
-                (start, end, room_id, owner_id))
-    conn.commit(); ok=cur.rowcount>0; conn.close(); return ok
+    with transaction() as cur:
+        cur.execute("UPDATE rooms SET final_start=?, final_end=?, version=version+1 WHERE id=? AND owner_id=? RETURNING id, version",
+                    (start, end, room_id, owner_id))
+        return _note_bumps(cur)>0
 
 def set_final_window_admin(room_id:str, start:str, end:str)->bool:
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("UPDATE rooms SET final_start=?, final_end=? WHERE id=?",
-                (start, end, room_id))
-    conn.commit(); ok=cur.rowcount>0; conn.close(); return ok
+    with transaction() as cur:
+        cur.execute("UPDATE rooms SET final_start=?, final_end=?, version=version+1 WHERE id=? RETURNING id, version",
+                    (start, end, room_id))
+        return _note_bumps(cur)>0
 
 # ---------- Itinerary ----------
 def list_items(room_id:str, day:str):
-    c=get_conn().cursor()
-    c.execute("""SELECT * FROM itinerary_items
-                 WHERE room_id=? AND day=? ORDER BY position ASC""",(room_id,day))
-    rows=c.fetchall(); c.connection.close(); return rows
+    return get_conn().execute("""SELECT * FROM itinerary_items
+                 WHERE room_id=? AND day=? ORDER BY position ASC""",(room_id,day)).fetchall()
 
 def add_item(room_id:str, day:str, name:str, category:str,
              lat=None, lon=None, budget:float=0.0,
              start_time:str=None, end_time:str=None,
-             is_anchor:bool=False, notes:str=None, created_by:int=None):
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("SELECT COALESCE(MAX(position),0)+1 FROM itinerary_items WHERE room_id=? AND day=?", (room_id, day))
-    pos=cur.fetchone()[0]
-    cur.execute("""INSERT INTO itinerary_items
-        (room_id, day, position, name, category, lat, lon, budget, start_time, end_time, is_anchor, notes, created_by, created_at)
-        VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-        (room_id, day, pos, name, category, lat, lon, budget, start_time, end_time, 1 if is_anchor else 0, notes, created_by, dt.datetime.utcnow().isoformat()))
-    conn.commit(); conn.close()
-
-def bulk_save_positions(room_id:str, day:str, items:list[dict]):
-    conn=get_conn(); cur=conn.cursor()
-    for it in items:
-        cur.execute("""UPDATE itinerary_items
-            SET position=?, budget=?, start_time=?, end_time=?, category=?, name=?
-            WHERE id=? AND room_id=? AND day=?""",
-            (int(it["position"]), float(it.get("budget",0)), it.get("start_time"), it.get("end_time"),
-             it.get("category","기타"), it.get("name"), int(it["id"]), room_id, day))
-    conn.commit(); conn.close()
+             is_anchor:bool=False, notes:str=None, created_by:int=None, geo_query:str=None)->int:
+    """geo_query: 좌표를 백그라운드에서 채울 (정규화된) 검색어. 반환: 새 item id"""
+    with transaction() as cur:
+        cur.execute("SELECT COALESCE(MAX(position),0)+1 FROM itinerary_items WHERE room_id=? AND day=?", (room_id, day))
+        pos=cur.fetchone()[0]
+        cur.execute("""INSERT INTO itinerary_items
+            (room_id, day, position, name, category, lat, lon, budget, start_time, end_time, is_anchor, notes, geo_query, created_by, created_at)
+            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
+            (room_id, day, pos, name, category, lat, lon, budget, start_time, end_time, 1 if is_anchor else 0, notes,
+             geo_query if lat is None else None, created_by, dt.datetime.utcnow().isoformat()))
+        _bump(cur, room_id)
+        return cur.lastrowid
+
+def _cell(v):
+    """data_editor 값 -> DB 값: 빈 칸(None/NaN/공백 문자열)은 NULL"""
+    if v is None or (isinstance(v, float) and math.isnan(v)): return None
+    if isinstance(v, str) and not v.strip(): return None
+    return v
+
+def bulk_save_positions(room_id:str, day:str, items:list[dict])->int:
+    """바뀐 행만 executemany 로 UPDATE. 반환값: 갱신한 행 수.
+    빈 칸은 NULL, 예산은 float 로 맞춘 뒤 비교해 손대지 않은 행은 쓰지 않는다."""
+    with transaction() as cur:
+        cur.execute("""SELECT id, position, budget, start_time, end_time, category, name
+                       FROM itinerary_items WHERE room_id=? AND day=?""", (room_id, day))
+        cur_map={r["id"]: tuple(r)[1:] for r in cur.fetchall()}
+        rows=[]
+        for it in items:
+            iid=int(it["id"])
+            if iid not in cur_map: continue
+            old=cur_map[iid]
+            vals=(int(it["position"]), float(_cell(it.get("budget")) or 0), _cell(it.get("start_time")),
+                  _cell(it.get("end_time")), _cell(it.get("category")) or "기타",
+                  _cell(it.get("name")) or old[5])                  # name 은 NOT NULL: 지우면 그대로 둔다
+            if (old[0], float(old[1] or 0), _cell(old[2]), _cell(old[3]), old[4], old[5])!=vals:
+                rows.append(vals+(iid, room_id, day))
+        if rows:
+            cur.executemany("""UPDATE itinerary_items
+                SET position=?, budget=?, start_time=?, end_time=?, category=?, name=?
+                WHERE id=? AND room_id=? AND day=?""", rows)
+            _bump(cur, room_id)
+    return len(rows)
+
+def optimize_room_routes(room_id:str, days:list=None)->dict:
+    """방의 모든 날짜(또는 days)를 한 번에 동선 최적화.
+    한 쿼리로 읽고 → 날짜별로 병렬 최적화 → 한 트랜잭션에서 position 만 갱신.
+    그 사이 장소가 추가/삭제된 날짜는 건너뛴다. 반환: {day: schedule_route 결과 + "changed"}"""
+    rows=get_conn().execute("""SELECT id, day, lat, lon, is_anchor, start_time, end_time
+                 FROM itinerary_items WHERE room_id=? ORDER BY day, position""",(room_id,)).fetchall()
+    by_day={}
+    for r in rows:
+        if days is None or r["day"] in days: by_day.setdefault(r["day"],[]).append(dict(r))
+    results=schedule_days(by_day)
+    with transaction() as cur:
+        cur.execute("SELECT id, day, position FROM itinerary_items WHERE room_id=?", (room_id,))
+        now={}
+        for r in cur.fetchall(): now.setdefault(r["day"],{})[r["id"]]=r["position"]
+        upd=[]
+        for day, res in results.items():
+            cur_pos=now.get(day,{})
+            if set(cur_pos)!={it["id"] for it in by_day[day]}:
+                res["changed"]=None; continue
+            changed=[(p, iid, room_id, day) for p, iid in enumerate(res["order"], 1) if cur_pos[iid]!=p]
+            upd+=changed; res["changed"]=len(changed)
+        if upd:
+            cur.executemany("UPDATE itinerary_items SET position=? WHERE id=? AND room_id=? AND day=?", upd)
+            _bump(cur, room_id)
+    return results
 
 def delete_item(item_id:int, room_id:str):
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("DELETE FROM itinerary_items WHERE id=? AND room_id=?", (item_id, room_id))
-    conn.commit(); conn.close()
+    with transaction() as cur:
+        cur.execute("DELETE FROM itinerary_items WHERE id=? AND room_id=?", (item_id, room_id))
+        if cur.rowcount: _bump(cur, room_id)
+
+# ---------- Geocode cache ----------
+def geocode_cache_get_many(queries:list, pos_ttl:float, neg_ttl:float)->dict:
+    """정규화된 검색어들 -> {query: (lat, lon) 또는 None(없음 캐시)}. 만료/미조회는 빠진다."""
+    if not queries: return {}
+    now=dt.datetime.utcnow(); out={}
+    qs=list(dict.fromkeys(queries))
+    for i in range(0, len(qs), 500):                    # SQLite 바인딩 개수 제한 회피
+        chunk=qs[i:i+500]
+        for r in get_conn().execute(f"""SELECT query, lat, lon, found, fetched_at FROM geocode_cache
+                                        WHERE query IN ({",".join("?"*len(chunk))})""", chunk):
+            age=(now-dt.datetime.fromisoformat(r["fetched_at"])).total_seconds()
+            if age <= (pos_ttl if r["found"] else neg_ttl):
+                out[r["query"]]=(r["lat"], r["lon"]) if r["found"] else None
+    return out
+
+def resolve_geocode(query:str, latlon, provider:str|None)->list:
+    """검색 결과를 캐시에 저장하고 그 검색어로 좌표를 기다리던 장소들을 채운다 (한 트랜잭션).
+    latlon=None 이면 없음 캐시만 남기고 대기 표시를 지운다. provider=None 이면 (이미 캐시된 값) 캐시는 그대로.
+    반환: 영향받은 room_id 목록"""
+    lat, lon = latlon if latlon else (None, None)
+    with transaction() as cur:
+        if provider is not None:
+            cur.execute("""INSERT INTO geocode_cache(query,lat,lon,found,provider,fetched_at) VALUES(?,?,?,?,?,?)
+                           ON CONFLICT(query) DO UPDATE SET lat=excluded.lat, lon=excluded.lon, found=excluded.found,
+                           provider=excluded.provider, fetched_at=excluded.fetched_at""",
+                        (query, lat, lon, 1 if latlon else 0, provider, dt.datetime.utcnow().isoformat()))
+        cur.execute("SELECT DISTINCT room_id FROM itinerary_items WHERE geo_query=?", (query,))
+        rooms=[r[0] for r in cur.fetchall()]
+        if rooms:
+            cur.execute("UPDATE itinerary_items SET lat=COALESCE(lat,?), lon=COALESCE(lon,?), geo_query=NULL WHERE geo_query=?",
+                        (lat, lon, query))
+            for room_id in rooms: _bump(cur, room_id)
+    return rooms
+
+def pending_geocodes()->dict:
+    """좌표를 기다리는 {정규화 검색어: 원래 입력(장소 이름)} (재시작 후 백그라운드 작업 재개용)"""
+    return {r[0]: r[1] for r in get_conn().execute(
+        "SELECT geo_query, MIN(name) FROM itinerary_items WHERE geo_query IS NOT NULL GROUP BY geo_query")}
+
+# ---------- Email outbox ----------
+def _ts(t:dt.datetime=None)->str:
+    return (t or dt.datetime.utcnow()).isoformat()
+
+def enqueue_email(to_addr:str, subject:str, body:str)->int:
+    with transaction() as cur:
+        cur.execute("""INSERT INTO email_outbox(to_addr,subject,body,next_attempt_at,created_at)
+                       VALUES(?,?,?,?,?)""", (to_addr, subject, body, _ts(), _ts()))
+        return cur.lastrowid
+
+def claim_due_emails(limit:int, lease_seconds:float)->list:
+    """보낼 차례인 메일을 최대 limit 개 가져오며 lease 동안 다른 워커가 못 잡게 미뤄 둔다.
+    워커가 죽으면 lease 가 지나 다시 보낼 차례가 된다."""
+    now=dt.datetime.utcnow()
+    with transaction() as cur:
+        cur.execute("""SELECT id, to_addr, subject, body, attempts FROM email_outbox
+                       WHERE status='pending' AND next_attempt_at<=? ORDER BY next_attempt_at LIMIT ?""", (_ts(now), limit))
+        rows=[dict(r) for r in cur.fetchall()]
+        if rows:
+            cur.executemany("UPDATE email_outbox SET attempts=attempts+1, next_attempt_at=? WHERE id=?",
+                            [(_ts(now+dt.timedelta(seconds=lease_seconds)), r["id"]) for r in rows])
+    for r in rows: r["attempts"]+=1
+    return rows
+
+def mark_emails_sent(ids:list):
+    if not ids: return
+    with transaction() as cur:
+        # 보낸 메일은 바로 지운다 (본문에 재설정 토큰이 있고, 남겨 두면 테이블만 커진다)
+        cur.executemany("DELETE FROM email_outbox WHERE id=?", [(i,) for i in ids])
+
+def purge_outbox(keep_days:float=7)->int:
+    """keep_days 보다 오래된 failed(포기한) 메일과 예전 버전이 남긴 sent 행을 지운다. 지운 수"""
+    cutoff=_ts(dt.datetime.utcnow()-dt.timedelta(days=keep_days)); n=0
+    with transaction() as cur:
+        for status in ("failed", "sent"):
+            cur.execute("DELETE FROM email_outbox WHERE status=? AND next_attempt_at<?", (status, cutoff))
+            n+=cur.rowcount
+    return n
+
+def mark_email_failed(email_id:int, error:str, retry_in:float|None):
+    """retry_in 초 뒤 재시도, None 이면 포기(status='failed')"""
+    with transaction() as cur:
+        if retry_in is None:
+            cur.execute("UPDATE email_outbox SET status='failed', last_error=? WHERE id=?", (error, email_id))
+        else:
+            cur.execute("UPDATE email_outbox SET next_attempt_at=?, last_error=? WHERE id=?",
+                        (_ts(dt.datetime.utcnow()+dt.timedelta(seconds=retry_in)), error, email_id))
+
+def next_email_due()->str|None:
+    r=get_conn().execute("SELECT MIN(next_attempt_at) FROM email_outbox WHERE status='pending'").fetchone()
+    return r[0]
+
+def outbox_counts()->dict:
+    return {r[0]: r[1] for r in get_conn().execute(
+        "SELECT status, COUNT(*) FROM email_outbox GROUP BY status -- full-scan-ok (관리용 집계)")}
 
 # ---------- Expenses ----------
-def add_expense(room_id:str, day:str, place:str, payer_id:int, amount:float, memo:str=None, category:str=None):
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("""INSERT INTO expenses(room_id,day,place,payer_id,amount,memo,category,created_at)
-                   VALUES(?,?,?,?,?,?,?,?)""",
-                (room_id, day, place, payer_id, amount, memo, category, dt.datetime.utcnow().isoformat()))
-    conn.commit(); conn.close()
+def _won(amount)->int:
+    """SQLite ROUND 와 같은 반올림(0에서 먼 쪽) → 정수 원"""
+    a=float(amount or 0); w=math.floor(abs(a)+0.5)
+    return int(w if a>=0 else -w)
+
+def _apply_expense(cur, room_id:str, payer_id:int, won:int, participants:list, sign:int):
+    """지출 하나를 누적 잔액에 더하거나(sign=1) 뺀다(sign=-1)."""
+    rows=[(room_id, payer_id, sign*won, 0)]
+    if participants:
+        rows+=[(room_id, u, 0, sign*w) for u, w in split_won(won, participants).items()]
+    cur.executemany("""INSERT INTO room_balances(room_id,user_id,paid,owed) VALUES(?,?,?,?)
+                       ON CONFLICT(room_id,user_id) DO UPDATE SET paid=paid+excluded.paid, owed=owed+excluded.owed""", rows)
+    cur.execute("""INSERT INTO room_expense_totals(room_id,total,shared,n,version) VALUES(?,?,?,?,1)
+                   ON CONFLICT(room_id) DO UPDATE SET total=total+excluded.total, shared=shared+excluded.shared, n=n+excluded.n,
+                   version=version+1""",
+                (room_id, sign*won, 0 if participants else sign*won, sign))
+
+def add_expense(room_id:str, day:str, place:str, payer_id:int, amount:float, memo:str=None, category:str=None,
+                participants:list=None)->int:
+    """participants: 이 지출을 나눠 낼 user id 들 (None/빈 값이면 멤버 전원)"""
+    participants=sorted({int(u) for u in participants}) if participants else None
+    with transaction() as cur:
+        cur.execute("""INSERT INTO expenses(room_id,day,place,payer_id,amount,memo,category,created_at)
+                       VALUES(?,?,?,?,?,?,?,?)""",
+                    (room_id, day, place, payer_id, amount, memo, category, dt.datetime.utcnow().isoformat()))
+        eid=cur.lastrowid
+        if participants:
+            cur.executemany("INSERT INTO expense_participants(expense_id,user_id) VALUES(?,?)",
+                            [(eid, u) for u in participants])
+        _apply_expense(cur, room_id, payer_id, _won(amount), participants, 1)
+        _bump(cur, room_id)
+        return eid
 
 def list_expenses(room_id:str):
-    c=get_conn().cursor()
-    c.execute("""SELECT e.*, u.name AS payer_name, u.nickname AS payer_nick
+    return get_conn().execute("""SELECT e.*, u.name AS payer_name, u.nickname AS payer_nick
                  FROM expenses e JOIN users u ON u.id=e.payer_id
-                 WHERE e.room_id=? ORDER BY e.created_at DESC""",(room_id,))
-    rows=c.fetchall(); c.connection.close(); return rows
+                 WHERE e.room_id=? ORDER BY e.created_at DESC""",(room_id,)).fetchall()
 
 def delete_expense(expense_id:int, room_id:str):
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("DELETE FROM expenses WHERE id=? AND room_id=?", (expense_id, room_id))
-    conn.commit(); conn.close()
+    with transaction() as cur:
+        cur.execute("SELECT payer_id, amount FROM expenses WHERE id=? AND room_id=?", (expense_id, room_id))
+        e=cur.fetchone()
+        if not e: return
+        cur.execute("SELECT user_id FROM expense_participants WHERE expense_id=?", (expense_id,))
+        parts=[r[0] for r in cur.fetchall()]
+        cur.execute("DELETE FROM expenses WHERE id=? AND room_id=?", (expense_id, room_id))
+        cur.execute("DELETE FROM expense_participants WHERE expense_id=?", (expense_id,))
+        _apply_expense(cur, room_id, e["payer_id"], _won(e["amount"]), parts, -1)
+        _bump(cur, room_id)
+
+def _room_balances(cur, room_id:str, member_ids)->tuple:
+    """정수 원 단위 잔액 {user_id: 받을 돈(+)/낼 돈(-)} 과 총액. room_balances 에서 O(멤버 수) 행만 읽는다.
+    전원 분담분(shared)은 합계를 지금 멤버에게 한 번에 나누므로 반올림 오차가 쌓이지 않는다.
+    지금 멤버가 없으면 (전원 나감) 지출에 한 번이라도 얽힌 사람들(잔액 행이 있는 사람)에게 나눈다."""
+    cur.execute("SELECT total, shared FROM room_expense_totals WHERE room_id=?", (room_id,))
+    t=cur.fetchone(); total, shared=(t[0], t[1]) if t else (0, 0)
+    cur.execute("SELECT user_id, paid, owed FROM room_balances WHERE room_id=?", (room_id,))
+    bal={u: 0 for u in member_ids}
+    involved=[]
+    for u, paid, owed in cur.fetchall(): bal[u]=bal.get(u, 0)+paid-owed; involved.append(u)
+    for u, w in split_won(shared, list(member_ids) or involved).items(): bal[u]-=w
+    return bal, total
+
+def _balances_from_expenses(cur, room_id:str|None=None)->tuple:
+    """지출 원본에서 다시 계산한 ({(room,user): [paid, owed]}, {room: [total, shared, n]}) — 검증/재구축용"""
+    where, args=("WHERE e.room_id=?", (room_id,)) if room_id else ("", ())
+    cur.execute(f"""SELECT e.room_id, e.id, e.payer_id, e.amount, p.user_id FROM expenses e
+                    LEFT JOIN expense_participants p ON p.expense_id=e.id {where}
+                    ORDER BY e.room_id, e.id -- full-scan-ok (관리용 재계산)""", args)
+    exps={}
+    for rid, eid, payer, amount, uid in cur.fetchall():
+        e=exps.setdefault(eid, (rid, payer, _won(amount), []))
+        if uid is not None: e[3].append(uid)
+    bal={}; tot={}
+    for rid, payer, won, parts in exps.values():
+        bal.setdefault((rid, payer), [0, 0])[0]+=won
+        for u, w in split_won(won, parts).items(): bal.setdefault((rid, u), [0, 0])[1]+=w
+        t=tot.setdefault(rid, [0, 0, 0]); t[0]+=won; t[1]+=0 if parts else won; t[2]+=1
+    return bal, tot
+
+def verify_room_balances(room_id:str|None=None)->list:
+    """누적 잔액이 지출 원본과 다르거나, 지금 멤버 기준 정산 잔액의 합이 0 이 아닌 room_id 목록 (빈 목록이면 정상)"""
+    with read_transaction() as cur:
+        bal, tot=_balances_from_expenses(cur, room_id)
+        where, args=("WHERE room_id=?", (room_id,)) if room_id else ("", ())
+        cur.execute(f"SELECT room_id, user_id, paid, owed FROM room_balances {where} -- full-scan-ok (관리용 검증)", args)
+        have={(r[0], r[1]): [r[2], r[3]] for r in cur.fetchall() if r[2] or r[3]}
+        cur.execute(f"SELECT room_id, total, shared, n FROM room_expense_totals {where} -- full-scan-ok (관리용 검증)", args)
+        have_t={r[0]: [r[1], r[2], r[3]] for r in cur.fetchall() if r[3]}
+        cur.execute(f"SELECT room_id, user_id FROM memberships {where} -- full-scan-ok (관리용 검증)", args)
+        members={}
+        for r, u in cur.fetchall(): members.setdefault(r, []).append(u)
+        unbalanced={r for r in have_t if sum(_room_balances(cur, r, members.get(r, []))[0].values())}
+    want={k: v for k, v in bal.items() if v[0] or v[1]}
+    bad={k[0] for k in set(want)|set(have) if want.get(k)!=have.get(k)}
+    bad|={k for k in set(tot)|set(have_t) if tot.get(k)!=have_t.get(k)}
+    return sorted(bad|unbalanced)
+
+def rebuild_room_balances(room_id:str|None=None):
+    """지출 원본에서 room_balances / room_expense_totals 를 다시 만든다 (room_id 없으면 전체)"""
+    with transaction() as cur:
+        bal, tot=_balances_from_expenses(cur, room_id)
+        where, args=("WHERE room_id=?", (room_id,)) if room_id else ("", ())
+        cur.execute(f"DELETE FROM room_balances {where} -- full-scan-ok (관리용 재구축)", args)
+        cur.execute(f"SELECT room_id, version FROM room_expense_totals {where} -- full-scan-ok (관리용 재구축)", args)
+        ver=dict(cur.fetchall())          # 버전은 이어서 올린다 (같은 키로 옛 그래프가 캐시에 남지 않게)
+        cur.execute(f"DELETE FROM room_expense_totals {where} -- full-scan-ok (관리용 재구축)", args)
+        cur.executemany("INSERT INTO room_balances(room_id,user_id,paid,owed) VALUES(?,?,?,?)",
+                        [(r, u, p, o) for (r, u), (p, o) in bal.items()])
+        rooms=set(tot)|set(ver)           # 지출이 다 지워진 방도 0 행으로 버전을 이어 간다
+        cur.executemany("INSERT INTO room_expense_totals(room_id,total,shared,n,version) VALUES(?,?,?,?,?)",
+                        [(r, *tot.get(r, (0, 0, 0)), ver.get(r, 0)+1) for r in rooms])
+        for r in rooms: _bump(cur, r)
+
+def expense_chart_data(room_id:str)->dict:
+    """지출 그래프용 합계: {version, by_day:[(day, won)], by_category:[(category, won)]}.
+    SQL GROUP BY 로 집계하고 (room_id, 지출 version) 단위로 캐시. 금액 0 이하는 뺀다."""
+    with read_transaction() as cur:
+        cur.execute("SELECT version FROM room_expense_totals WHERE room_id=?", (room_id,))
+        r=cur.fetchone(); ver=r[0] if r else 0
+        key=(room_id, ver, "expense_charts")
+        hit=ROOM_CACHE.get(key)
+        if hit is not None: return hit
+        cur.execute("""SELECT COALESCE(day,'') AS d, SUM(amount) FROM expenses
+                       WHERE room_id=? AND amount>0 GROUP BY d ORDER BY d""", (room_id,))
+        by_day=[(d, float(a)) for d, a in cur.fetchall()]
+        cur.execute("""SELECT COALESCE(NULLIF(category,''),'기타') AS c, SUM(amount) AS a FROM expenses
+                       WHERE room_id=? AND amount>0 GROUP BY c ORDER BY a DESC""", (room_id,))
+        by_cat=[(c, float(a)) for c, a in cur.fetchall()]
+    out={"version": ver, "by_day": by_day, "by_category": by_cat}
+    ROOM_CACHE.put(key, out)
+    return out
 
 def settle_transfers(room_id:str):
-    exps=list_expenses(room_id)
-    if not exps: return [], 0.0
-    c=get_conn().cursor()
-    c.execute("SELECT u.id,u.name,u.nickname FROM memberships m JOIN users u ON u.id=m.user_id WHERE m.room_id=?", (room_id,))
-    members=c.fetchall(); c.connection.close()
-    ids=[m["id"] for m in members]; n=len(ids)
-    total=sum(e["amount"] or 0 for e in exps); share= total / max(n,1)
-    bal={uid: -share for uid in ids}
-    for e in exps: bal[e["payer_id"]] += (e["amount"] or 0)
-    debtors=[[uid, -amt] for uid,amt in bal.items() if amt < -1e-9]
-    creditors=[[uid,  amt] for uid,amt in bal.items() if amt >  1e-9]
-    debtors.sort(key=lambda x:x[1], reverse=True); creditors.sort(key=lambda x:x[1], reverse=True)
-    transfers=[]; i=j=0
-    while i<len(debtors) and j<len(creditors):
-        duid,d=debtors[i]; cuid,c=creditors[j]
-        x=min(d,c); transfers.append({"from":duid,"to":cuid,"amount":round(x,0)})
-        d-=x; c-=x
-        if d<=1e-9: i+=1
-        else: debtors[i][1]=d
-        if c<=1e-9: j+=1
-        else: creditors[j][1]=c
-    return transfers, total
+    """-> (이체 목록 [{from,to,amount(int)}], 총액(int)). room.version 단위로 캐시"""
+    with read_transaction() as cur:
+        key=(room_id, room_version(room_id), "settle")
+        hit=ROOM_CACHE.get(key)
+        if hit is not None: return hit
+        cur.execute("SELECT user_id FROM memberships WHERE room_id=?", (room_id,))
+        bal, total=_room_balances(cur, room_id, [r[0] for r in cur.fetchall()])
+    out=(min_transfers(bal), total)
+    ROOM_CACHE.put(key, out)
+    return out
 
 # ---------- Announcements ----------
 def add_announcement(room_id:str, title:str, body:str, pinned:int, created_by:int):
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("""INSERT INTO announcements(room_id,title,body,pinned,created_by,created_at)
-                   VALUES(?,?,?,?,?,?)""",
-                (room_id, title, body, int(pinned), created_by, dt.datetime.utcnow().isoformat()))
-    conn.commit(); conn.close()
+    with transaction() as cur:
+        cur.execute("""INSERT INTO announcements(room_id,title,body,pinned,created_by,created_at)
+                       VALUES(?,?,?,?,?,?)""",
+                    (room_id, title, body, int(pinned), created_by, dt.datetime.utcnow().isoformat()))
+        _bump(cur, room_id)
 
 def list_announcements(room_id:str):
-    c=get_conn().cursor()
-    c.execute("""SELECT * FROM announcements WHERE room_id=?
-                 ORDER BY pinned DESC, created_at DESC""", (room_id,))
-    rows=c.fetchall(); c.connection.close(); return rows
+    return get_conn().execute("""SELECT * FROM announcements WHERE room_id=?
+                 ORDER BY pinned DESC, created_at DESC""", (room_id,)).fetchall()
 
 def toggle_pin_announcement(ann_id:int, room_id:str, owner_id:int):
-    conn=get_conn(); cur=conn.cursor()
-    # owner_id check is done in app for admin; here allow any call
-    cur.execute("UPDATE announcements SET pinned=1-pinned WHERE id=? AND room_id=?", (ann_id, room_id))
-    conn.commit(); ok=cur.rowcount>0; conn.close(); return ok
+    with transaction() as cur:
+        # owner_id check is done in app for admin; here allow any call
+        cur.execute("UPDATE announcements SET pinned=1-pinned WHERE id=? AND room_id=?", (ann_id, room_id))
+        ok=cur.rowcount>0
+        if ok: _bump(cur, room_id)
+        return ok
 
 def delete_announcement(ann_id:int, room_id:str, owner_id:int):
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("DELETE FROM announcements WHERE id=? AND room_id=?", (ann_id, room_id))
-    conn.commit(); ok=cur.rowcount>0; conn.close(); return ok
+    with transaction() as cur:
+        cur.execute("DELETE FROM announcements WHERE id=? AND room_id=?", (ann_id, room_id))
+        ok=cur.rowcount>0
+        if ok: _bump(cur, room_id)
+        return ok
 
 # ---------- Polls ----------
 def create_poll(room_id:str, question:str, is_multi:int, options:list[str], closes_at:str|None, created_by:int):
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("""INSERT INTO polls(room_id,question,is_multi,closes_at,created_by,created_at)
-                   VALUES(?,?,?,?,?,?)""",
-                (room_id, question, int(is_multi), closes_at, created_by, dt.datetime.utcnow().isoformat()))
-    pid=cur.lastrowid
-    for t in options:
-        cur.execute("INSERT INTO poll_options(poll_id,text) VALUES(?,?)", (pid, t))
-    conn.commit(); conn.close(); return pid
+    with transaction() as cur:
+        cur.execute("""INSERT INTO polls(room_id,question,is_multi,closes_at,created_by,created_at)
+                       VALUES(?,?,?,?,?,?)""",
+                    (room_id, question, int(is_multi), closes_at, created_by, dt.datetime.utcnow().isoformat()))
+        pid=cur.lastrowid
+        cur.executemany("INSERT INTO poll_options(poll_id,text) VALUES(?,?)", [(pid, t) for t in options])
+        _bump(cur, room_id)
+    return pid
 
 def list_polls(room_id:str):
-    c=get_conn().cursor()
-    c.execute("""SELECT * FROM polls WHERE room_id=? ORDER BY created_at DESC""", (room_id,))
-    rows=c.fetchall(); c.connection.close(); return rows
+    return get_conn().execute("""SELECT * FROM polls WHERE room_id=? ORDER BY created_at DESC""", (room_id,)).fetchall()
 
 def list_poll_options(poll_id:int):
-    c=get_conn().cursor(); c.execute("SELECT * FROM poll_options WHERE poll_id=?", (poll_id,))
-    rows=c.fetchall(); c.connection.close(); return rows
+    return get_conn().execute("SELECT * FROM poll_options WHERE poll_id=?", (poll_id,)).fetchall()
 
 def get_user_votes(poll_id:int, user_id:int):
-    c=get_conn().cursor(); c.execute("SELECT option_id FROM poll_votes WHERE poll_id=? AND user_id=?", (poll_id,user_id))
-    rows=c.fetchall(); c.connection.close(); return [r["option_id"] for r in rows]
+    rows=get_conn().execute("SELECT option_id FROM poll_votes WHERE poll_id=? AND user_id=?", (poll_id,user_id)).fetchall()
+    return [r["option_id"] for r in rows]
 
 def cast_vote(poll_id:int, option_ids:list[int], user_id:int, is_multi:bool):
-    conn=get_conn(); cur=conn.cursor()
-    cur.execute("DELETE FROM poll_votes WHERE poll_id=? AND user_id=?", (poll_id, user_id))
-    for oid in (option_ids if is_multi else option_ids[:1]):
-        cur.execute("""INSERT OR IGNORE INTO poll_votes(poll_id,option_id,user_id,created_at)
-                       VALUES(?,?,?,?)""", (poll_id, int(oid), user_id, dt.datetime.utcnow().isoformat()))
-    conn.commit(); conn.close()
+    new={int(o) for o in (option_ids if is_multi else option_ids[:1])}
+    with transaction() as cur:
+        cur.execute("SELECT option_id FROM poll_votes WHERE poll_id=? AND user_id=?", (poll_id, user_id))
+        old={r["option_id"] for r in cur.fetchall()}
+        gone, added = old-new, new-old
+        if gone:
+            cur.executemany("DELETE FROM poll_votes WHERE poll_id=? AND option_id=? AND user_id=?",
+                            [(poll_id, oid, user_id) for oid in gone])
+        if added:
+            now=dt.datetime.utcnow().isoformat()
+            cur.executemany("""INSERT OR IGNORE INTO poll_votes(poll_id,option_id,user_id,created_at)
+                               VALUES(?,?,?,?)""", [(poll_id, oid, user_id, now) for oid in added])
+        if gone or added:
+            # 같은 쓰기 트랜잭션 안에서 old 를 읽었으므로 diff 가 곧 실제 증감
+            cur.executemany("""INSERT INTO poll_option_counts(poll_id,option_id,c) VALUES(?,?,?)
+                               ON CONFLICT(poll_id,option_id) DO UPDATE SET c=c+excluded.c""",
+                            [(poll_id, oid, -1) for oid in gone]+[(poll_id, oid, 1) for oid in added])
+            _bump_poll(cur, poll_id)
 
 def tally_poll(poll_id:int):
-    c=get_conn().cursor()
-    c.execute("SELECT option_id, COUNT(*) AS c FROM poll_votes WHERE poll_id=? GROUP BY option_id", (poll_id,))
-    rows=c.fetchall()
+    rows=get_conn().execute("SELECT option_id, c FROM poll_option_counts WHERE poll_id=? AND c>0", (poll_id,)).fetchall()
     counts={r["option_id"]: r["c"] for r in rows}
     total=sum(counts.values())
-    c.connection.close()
-    return counts, total
\ No newline at end of file
+    return counts, total
+
+def _poll_counts_from_votes(cur)->dict:
+    cur.execute("SELECT poll_id, option_id, COUNT(*) FROM poll_votes GROUP BY poll_id, option_id -- full-scan-ok (관리용 재계산)")
+    return {(r[0], r[1]): r[2] for r in cur.fetchall()}
+
+def verify_poll_counts()->list:
+    """poll_option_counts 가 poll_votes 와 다른 poll_id 목록 (빈 목록이면 정상)"""
+    with read_transaction() as cur:
+        want=_poll_counts_from_votes(cur)
+        cur.execute("SELECT poll_id, option_id, c FROM poll_option_counts WHERE c<>0 -- full-scan-ok (관리용 검증)")
+        have={(r[0], r[1]): r[2] for r in cur.fetchall()}
+    return sorted({k[0] for k in set(want)|set(have) if want.get(k)!=have.get(k)})
+
+def rebuild_poll_counts():
+    with transaction() as cur:
+        want=_poll_counts_from_votes(cur)
+        cur.execute("DELETE FROM poll_option_counts -- full-scan-ok (관리용 재구축)")
+        cur.executemany("INSERT INTO poll_option_counts(poll_id,option_id,c) VALUES(?,?,?)",
+                        [(p, o, c) for (p, o), c in want.items()])
+        for pid in {p for p, _ in want}: _bump_poll(cur, pid)
+
+def _polls_bundle(cur, room_id:str, user_id:int|None)->tuple:
+    """방의 모든 투표 + 보기 + 보기별 득표(poll_option_counts) + 내 표를 한 쿼리로. 보기당 한 행."""
+    cur.execute("""SELECT p.*, o.id AS option_id, o.text AS option_text,
+                          COALESCE(n.c, 0) AS c, v.user_id IS NOT NULL AS mine
+                   FROM polls p
+                   LEFT JOIN poll_options o ON o.poll_id=p.id
+                   LEFT JOIN poll_option_counts n ON n.poll_id=p.id AND n.option_id=o.id
+                   LEFT JOIN poll_votes v ON v.poll_id=p.id AND v.option_id=o.id AND v.user_id=?
+                   WHERE p.room_id=?
+                   ORDER BY p.created_at DESC, p.id DESC, o.id""", (user_id, room_id))
+    polls={}
+    for r in cur.fetchall():
+        p=polls.get(r["id"])
+        if p is None:
+            p=polls[r["id"]]={k: r[k] for k in r.keys() if k not in ("option_id", "option_text", "c", "mine")}
+            p.update(options=[], option_text={}, my_votes=set(), counts={}, total=0)
+        if r["option_id"] is None: continue
+        p["options"].append({"id": r["option_id"], "poll_id": r["id"], "text": r["option_text"]})
+        p["option_text"][r["option_id"]]=r["option_text"]
+        if r["c"]: p["counts"][r["option_id"]]=r["c"]; p["total"]+=r["c"]
+        if r["mine"]: p["my_votes"].add(r["option_id"])
+    return tuple(polls.values())
+
+def load_polls_bundle(room_id:str, user_id:int|None)->tuple:
+    """({**poll, options:[{id,text}], option_text:{id:text}, counts:{id:n}, total, my_votes:set}, ...) 최신순"""
+    return _polls_bundle(get_conn().cursor(), room_id, user_id)
+
+# ---------- Room snapshot ----------
+# room_page 섹션(fragment)별로 필요한 데이터. room/members/is_admin 은 항상 읽는다.
+SNAPSHOT_SECTIONS = ("board", "time", "plan", "cost")
+
+@dataclass(frozen=True)
+class RoomSnapshot:
+    """room_page 한 번 렌더에 필요한 데이터 (읽기 전용). 읽지 않은 섹션의 필드는 None."""
+    room: sqlite3.Row
+    members: tuple
+    is_admin: bool
+    sections: frozenset = frozenset(SNAPSHOT_SECTIONS)
+    announcements: tuple = None     # board
+    polls: tuple = None             # board, load_polls_bundle 형식
+    my_availability: MappingProxyType = None   # time
+    days: tuple = None
+    agg: DayAggregate = None
+    weights: MappingProxyType = None
+    names_by_day: MappingProxyType = None
+    user_names: MappingProxyType = None   # user_id -> 표시 이름 (agg.person_day 행과 매칭)
+    items_by_day: MappingProxyType = None # plan
+    expenses: tuple = None          # cost
+    transfers: tuple = None
+    transfer_names: MappingProxyType = None   # 이체에 나오는 모든 user_id -> 표시 이름 (나간 멤버 포함)
+    total: float = None
+
+    @property
+    def all_submitted(self)->bool:
+        return bool(self.members) and all(m["submitted"] for m in self.members)
+
+    def items_for(self, day:str)->tuple:
+        return self.items_by_day.get(day, ())
+
+def load_room_snapshot(room_id:str, user_id:int|None, sections=SNAPSHOT_SECTIONS):
+    """방 페이지 데이터를 하나의 읽기 트랜잭션, 고정된 쿼리 수로 읽는다. 방이 없으면 None.
+    sections 로 필요한 섹션만 (fragment 가 자기 섹션만 다시 그릴 때).
+    availability 집계·정산은 room.version 이 같으면 ROOM_CACHE 에서 재사용."""
+    sections = frozenset(sections); out = {}
+    with read_transaction() as cur:
+        cur.execute("SELECT * FROM rooms WHERE id=?", (room_id,)); room=cur.fetchone()
+        if not room: return None
+        cur.execute("""SELECT u.id,u.name,u.email,u.nickname,m.role,m.submitted
+                       FROM memberships m JOIN users u ON u.id=m.user_id
+                       WHERE m.room_id=? ORDER BY u.name""", (room_id,))
+        members=cur.fetchall()
+        is_admin=is_site_admin(user_id)
+        if "board" in sections:
+            cur.execute("""SELECT * FROM announcements WHERE room_id=?
+                           ORDER BY pinned DESC, created_at DESC""", (room_id,))
+            out.update(announcements=tuple(cur.fetchall()), polls=_polls_bundle(cur, room_id, user_id))
+        if "time" in sections:
+            av=_availability_view(cur, room)
+            out.update(my_availability=MappingProxyType(av["by_user"].get(user_id, {})),
+                       days=av["days"], agg=av["agg"], weights=MappingProxyType(av["weights"]),
+                       names_by_day=MappingProxyType(av["names_by_day"]), user_names=MappingProxyType(av["user_names"]))
+        if "plan" in sections:
+            cur.execute("""SELECT * FROM itinerary_items WHERE room_id=?
+                           ORDER BY day, position""", (room_id,))
+            items={}
+            for it in cur.fetchall(): items.setdefault(it["day"], []).append(it)
+            out["items_by_day"]=MappingProxyType({d: tuple(v) for d, v in items.items()})
+        if "cost" in sections:
+            cur.execute("""SELECT e.*, u.name AS payer_name, u.nickname AS payer_nick
+                           FROM expenses e JOIN users u ON u.id=e.payer_id
+                           WHERE e.room_id=? ORDER BY e.created_at DESC""",(room_id,))
+            out["expenses"]=tuple(cur.fetchall())
+            key=(room_id, room["version"], "settle")
+            settle=ROOM_CACHE.get(key)
+            if settle is None:
+                bal, total=_room_balances(cur, room_id, [m["id"] for m in members])
+                settle=(min_transfers(bal), total); ROOM_CACHE.put(key, settle)
+            out["transfers"], out["total"] = tuple(settle[0]), settle[1]
+            # 나간 멤버도 잔액이 남아 이체에 나올 수 있다 → 이름은 users 에서
+            names={m["id"]: (m["nickname"] or m["name"]) for m in members}
+            gone=sorted({u for t in settle[0] for u in (t["from"], t["to"])} - names.keys())
+            if gone:
+                cur.execute(f"SELECT id, COALESCE(nickname, name) FROM users WHERE id IN ({','.join('?'*len(gone))})", gone)
+                names.update({u: f"{n} (나간 멤버)" for u, n in cur.fetchall()})
+            out["transfer_names"]=MappingProxyType(names)
+    return RoomSnapshot(room=room, members=tuple(members), is_admin=is_admin, sections=sections, **out)
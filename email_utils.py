@@ -1,5 +1,6 @@
-import os, ssl, smtplib
+import os, ssl, smtplib, random, threading, time, datetime as dt
 from email.message import EmailMessage
+import database as DB
 
 try:
     from dotenv import load_dotenv
@@ -11,6 +12,8 @@ SMTP_SERVER = os.getenv("SMTP_SERVER")
 SMTP_PORT   = os.getenv("SMTP_PORT")
 SMTP_USER   = os.getenv("SMTP_USER")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_SECURITY = os.getenv("SMTP_SECURITY")   # ssl | starttls | none (없으면 465→ssl, 그 외 starttls)
+SMTP_FROM   = os.getenv("SMTP_FROM")
 
 try:
     import streamlit as st
@@ -18,33 +21,154 @@ try:
     SMTP_PORT   = st.secrets.get("SMTP_PORT", SMTP_PORT)
     SMTP_USER   = st.secrets.get("SMTP_USER", SMTP_USER)
     SMTP_PASSWORD = st.secrets.get("SMTP_PASSWORD", SMTP_PASSWORD)
+    SMTP_SECURITY = st.secrets.get("SMTP_SECURITY", SMTP_SECURITY)
+    SMTP_FROM   = st.secrets.get("SMTP_FROM", SMTP_FROM)
 except Exception:
     pass
 
-def send_reset_email(to_email: str, token: str) -> bool:
-    if not (SMTP_SERVER and SMTP_PORT and SMTP_USER and SMTP_PASSWORD):
-        return False
-    msg = EmailMessage()
-    msg["Subject"] = "비밀번호 재설정 안내"
-    msg["From"] = SMTP_USER
-    msg["To"] = to_email
-    msg.set_content(f"""안녕하세요,
+BATCH_SIZE = 20          # 한 번 깨어날 때 보내는 최대 메일 수
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 30.0      # 초. 30, 60, 120, ... (±20% 지터), 최대 BACKOFF_MAX
+BACKOFF_MAX = 3600.0
+LEASE_SECONDS = 300      # 보내는 중인 메일을 다른 워커가 잡지 않게 미뤄 두는 시간
+IDLE_CLOSE = 60.0        # 이 시간 동안 보낼 게 없으면 SMTP 연결을 닫는다
+POLL_INTERVAL = 30.0
+NOOP_AFTER = 5.0         # 이만큼 쉬었던 연결은 재사용 전에 NOOP 으로 살아 있는지 확인
+KEEP_FAILED_DAYS = 7     # 포기한 메일은 이 기간만 남겨 두고 지운다 (보낸 메일은 보내자마자 지운다)
+PURGE_EVERY = 3600.0
+
+def _security():
+    if SMTP_SECURITY: return SMTP_SECURITY.lower()
+    return "ssl" if str(SMTP_PORT) == "465" else "starttls"
+
+def smtp_configured() -> bool:
+    # security=none (로컬 디버그 SMTP 서버 등) 이면 계정 없이도 보낼 수 있다
+    if not (SMTP_SERVER and SMTP_PORT): return False
+    return _security() == "none" or bool(SMTP_USER and SMTP_PASSWORD)
+
+def _reset_body(token: str) -> str:
+    return f"""안녕하세요,
 
 아래 토큰을 '비밀번호 재설정' 탭에 붙여넣고 새 비밀번호를 설정하세요.
 
 토큰: {token}
 (유효기간 30분)
-""")
-    try:
-        port = int(SMTP_PORT)
-        if port == 465:
-            context = ssl.create_default_context()
-            with smtplib.SMTP_SSL(SMTP_SERVER, port, context=context) as s:
-                s.login(SMTP_USER, SMTP_PASSWORD); s.send_message(msg)
+"""
+
+def send_reset_email(to_email: str, token: str) -> bool:
+    """메일을 outbox 에 넣고 바로 반환. SMTP 미설정이면 False (화면에 토큰 표시용)."""
+    if not smtp_configured():
+        return False
+    DB.enqueue_email(to_email, "비밀번호 재설정 안내", _reset_body(token))
+    mail_worker().wake()
+    return True
+
+def _backoff(attempts: int) -> float:
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+
+class MailWorker:
+    """outbox 를 비우는 백그라운드 스레드. 인증된 SMTP 연결 하나를 메일 사이에 재사용한다."""
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._conn = None
+        self._last_used = 0.0
+        self._last_purge = 0.0
+        self._thread = threading.Thread(target=self._run, name="mail-worker", daemon=True)
+        self.sent = 0
+        self.connects = 0
+
+    def start(self):
+        self._thread.start(); return self
+
+    def wake(self):
+        self._wake.set()
+
+    def _connect(self):
+        port = int(SMTP_PORT); sec = _security()
+        if sec == "ssl":
+            s = smtplib.SMTP_SSL(SMTP_SERVER, port, context=ssl.create_default_context(), timeout=20)
         else:
-            with smtplib.SMTP(SMTP_SERVER, port) as s:
-                s.starttls(); s.login(SMTP_USER, SMTP_PASSWORD); s.send_message(msg)
-        return True
-    except Exception as e:
-        print("SMTP 전송 실패:", e)
-        return False
\ No newline at end of file
+            s = smtplib.SMTP(SMTP_SERVER, port, timeout=20)
+            if sec == "starttls": s.starttls(context=ssl.create_default_context())
+        if SMTP_USER and SMTP_PASSWORD and sec != "none": s.login(SMTP_USER, SMTP_PASSWORD)
+        self.connects += 1
+        return s
+
+    def _close(self):
+        if self._conn is not None:
+            try: self._conn.quit()
+            except Exception: pass
+            self._conn = None
+
+    def _smtp(self):
+        if self._conn is not None and time.monotonic() - self._last_used < NOOP_AFTER:
+            return self._conn
+        if self._conn is not None:
+            try:
+                if self._conn.noop()[0] == 250: return self._conn
+            except smtplib.SMTPException: pass
+            except OSError: pass
+            self._close()
+        self._conn = self._connect()
+        return self._conn
+
+    def _message(self, row):
+        msg = EmailMessage()
+        msg["Subject"] = row["subject"]; msg["From"] = SMTP_FROM or SMTP_USER or "noreply@localhost"
+        msg["To"] = row["to_addr"]; msg.set_content(row["body"])
+        return msg
+
+    def _send_batch(self, rows):
+        sent = []
+        for i, row in enumerate(rows):
+            try:
+                try:
+                    self._smtp().send_message(self._message(row))
+                except smtplib.SMTPServerDisconnected:          # 오래된 연결 → 한 번만 다시 연결
+                    self._close(); self._smtp().send_message(self._message(row))
+                sent.append(row["id"]); self._last_used = time.monotonic()
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPNotSupportedError) as e:
+                DB.mark_email_failed(row["id"], repr(e), None)  # 주소 문제 → 재시도해도 소용없음
+            except (smtplib.SMTPException, OSError) as e:
+                # 서버/네트워크 문제: 이 메일은 백오프, 나머지는 이번엔 건너뛰고 같이 미룬다
+                self._close()
+                wait = _backoff(row["attempts"])
+                for r in rows[i:]:
+                    DB.mark_email_failed(r["id"], repr(e), None if r["attempts"] >= MAX_ATTEMPTS else wait)
+                break
+        DB.mark_emails_sent(sent); self.sent += len(sent)
+        self._last_used = time.monotonic()
+        if sent and self._last_used - self._last_purge > PURGE_EVERY:
+            DB.purge_outbox(KEEP_FAILED_DAYS); self._last_purge = self._last_used
+
+    def _run(self):
+        while True:
+            self._wake.clear(); rows = []                       # 처리 중에 온 wake 는 다음 wait 를 바로 깨운다
+            if smtp_configured():
+                try:
+                    rows = DB.claim_due_emails(BATCH_SIZE, LEASE_SECONDS)
+                    if rows: self._send_batch(rows)
+                except Exception as e:
+                    print("메일 워커 오류:", e)
+            if len(rows) == BATCH_SIZE: continue                # 더 남았을 수 있음
+            if self._conn is not None and time.monotonic() - self._last_used > IDLE_CLOSE: self._close()
+            self._wake.wait(self._sleep_for())
+
+    def _sleep_for(self) -> float:
+        try: due = DB.next_email_due()
+        except Exception: due = None
+        t = POLL_INTERVAL
+        if due: t = min(t, max(0.05, (dt.datetime.fromisoformat(due) - dt.datetime.utcnow()).total_seconds()))
+        if self._conn is not None: t = min(t, IDLE_CLOSE)
+        return t
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def mail_worker() -> MailWorker:
+    """프로세스당 하나. 처음 부를 때 시작 (재시작 전에 남은 outbox 도 이어서 보낸다)."""
+    global _worker
+    with _worker_lock:
+        if _worker is None: _worker = MailWorker().start()
+        return _worker
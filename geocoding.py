@@ -0,0 +1,193 @@
+"""장소 검색 → 좌표. SQLite 캐시(TTL, '없음' 캐시) + 속도 제한 백그라운드 조회.
+
+    status = get_geocoder().add_place(room_id, day, "서울역", "기타", ...)
+
+캐시에 있으면 좌표를 넣어 바로 추가, 없으면 좌표 없이 추가한 뒤 백그라운드 스레드가
+provider 를 (초당 1건 이하로) 호출해 같은 검색어를 기다리는 장소를 한꺼번에 채운다.
+PLANNER_GEOCODER=local 이면 네트워크 없이 LocalProvider 를 쓴다 (테스트/오프라인).
+"""
+import os, heapq, queue, random, threading, time, unicodedata, logging
+import database as DB
+
+log = logging.getLogger(__name__)
+
+POS_TTL = float(os.environ.get("PLANNER_GEO_TTL_DAYS", "30")) * 86400
+NEG_TTL = float(os.environ.get("PLANNER_GEO_NEG_TTL_HOURS", "24")) * 3600
+MIN_INTERVAL = float(os.environ.get("PLANNER_GEO_INTERVAL", "1.0"))   # Nominatim 정책: 초당 1건
+RETRY_BASE = 30.0        # 실패한 검색어 재시도: 30, 60, 120, ... 초 (±20%), 최대 RETRY_MAX
+RETRY_MAX = 3600.0
+MAX_RETRIES = 8          # 넘으면 포기 (geo_query 는 남아 있어 재시작 때 다시 시도)
+
+def normalize(query: str) -> str:
+    """캐시 키: NFKC, 소문자, 공백 하나로"""
+    return " ".join(unicodedata.normalize("NFKC", query or "").lower().split())
+
+class NominatimProvider:
+    name = "nominatim"
+
+    def __init__(self, user_agent="youchin", timeout=5):
+        from geopy.geocoders import Nominatim
+        self._g = Nominatim(user_agent=user_agent, timeout=timeout)   # 한 번 만들어 재사용
+
+    def geocode(self, query):
+        loc = self._g.geocode(query)
+        return (loc.latitude, loc.longitude) if loc else None
+
+LOCAL_PLACES = {
+    "서울역": (37.5547, 126.9707), "강남역": (37.4979, 127.0276), "홍대입구역": (37.5572, 126.9245),
+    "부산역": (35.1151, 129.0422), "해운대해수욕장": (35.1587, 129.1604), "제주국제공항": (33.5104, 126.4914),
+}
+
+class LocalProvider:
+    """네트워크 없는 대체 provider. places: {검색어: (lat, lon)}, 없는 검색어는 None"""
+    name = "local"
+
+    def __init__(self, places=None):
+        self.places = {normalize(k): v for k, v in (LOCAL_PLACES if places is None else places).items()}
+        self.calls = 0
+
+    def geocode(self, query):
+        self.calls += 1
+        return self.places.get(normalize(query))
+
+def default_provider():
+    if os.environ.get("PLANNER_GEOCODER", "").lower() == "local": return LocalProvider()
+    try:
+        return NominatimProvider()
+    except Exception:          # geopy 미설치
+        return None
+
+class Geocoder:
+    def __init__(self, provider=None, min_interval=MIN_INTERVAL):
+        self.provider = provider
+        self.min_interval = min_interval
+        self.requests = 0                 # provider 실제 호출 수
+        self._q = queue.Queue()
+        self._inflight = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last = 0.0
+        self._retry = []                  # heap (due, key)
+        self._fails = {}                  # key -> 연속 실패 수
+        self._text = {}                   # key -> provider 에 보낼 원래 검색어
+        self.failures = 0
+
+    def lookup_many(self, queries) -> dict:
+        """캐시만 조회: {정규화 검색어: (lat, lon) 또는 None(없음)}. 모르는 검색어는 빠진다."""
+        return DB.geocode_cache_get_many([normalize(q) for q in queries if normalize(q)], POS_TTL, NEG_TTL)
+
+    def add_place(self, room_id, day, query, category, budget=0.0, is_anchor=False, created_by=None) -> str:
+        """장소를 바로 추가. 반환: 'cached' | 'pending'(좌표는 백그라운드) | 'not_found' | 'no_provider'
+        | 'empty'(검색어가 비어 추가하지 않음)"""
+        text = (query or "").strip()
+        key = normalize(text)
+        if not key: return "empty"
+        known = self.lookup_many([key])
+        if key not in known and self.provider is not None:
+            DB.add_item(room_id, day, text, category, None, None, budget,
+                        None, None, is_anchor, None, created_by, geo_query=key)
+            self.enqueue(key, text)
+            return "pending"
+        lat, lon = known.get(key) or (None, None)
+        DB.add_item(room_id, day, text, category, lat, lon, budget,
+                    None, None, is_anchor, None, created_by)
+        if key in known: return "cached" if lat is not None else "not_found"
+        return "no_provider"
+
+    def start(self) -> bool:
+        """워커를 띄우고 재시작 전에 남은 대기분을 이어서 조회 (여러 번 불러도 한 번만). provider 가 없으면 False"""
+        if self.provider is None: return False
+        with self._lock:
+            if self._thread is not None: return True
+            self._thread = threading.Thread(target=self._run, name="geocoder", daemon=True)
+            self._thread.start()
+            pending = DB.pending_geocodes()
+        for key, text in pending.items(): self.enqueue(key, text)
+        return True
+
+    def enqueue(self, key: str, text: str = None):
+        """key: 정규화 검색어 (캐시 키), text: provider 에 보낼 사용자 입력 그대로"""
+        self.start()
+        with self._lock:
+            if key in self._inflight: return
+            self._inflight.add(key)
+            self._text[key] = text or key
+        self._q.put(key)
+
+    def _throttle(self):
+        wait = self._last + self.min_interval - time.monotonic()
+        if wait > 0: time.sleep(wait)
+        self._last = time.monotonic()
+
+    def _next_batch(self):
+        """(큐에서 꺼낸 검색어 — task_done 필요, 재시도 시각이 된 검색어)"""
+        with self._lock: due = self._retry[0][0] if self._retry else None
+        queued = []
+        try:
+            queued.append(self._q.get(timeout=None if due is None else max(0.0, due - time.monotonic())))
+            while True: queued.append(self._q.get_nowait())
+        except queue.Empty:
+            pass
+        retry = []
+        with self._lock:
+            while self._retry and self._retry[0][0] <= time.monotonic():
+                retry.append(heapq.heappop(self._retry)[1])
+        return queued, retry
+
+    def _done(self, key):
+        with self._lock:
+            self._inflight.discard(key); self._fails.pop(key, None); self._text.pop(key, None)
+
+    def _fail(self, key, err):
+        """네트워크/DB 오류는 캐시하지 않고 백오프 뒤 다시 시도. inflight 에 남겨 중복 등록을 막는다."""
+        self.failures += 1
+        with self._lock:
+            n = self._fails[key] = self._fails.get(key, 0) + 1
+            if n > MAX_RETRIES:
+                self._inflight.discard(key); self._fails.pop(key, None); self._text.pop(key, None)
+                log.warning("geocode gave up on %r after %d attempts: %s", key, n - 1, err); return
+            delay = min(RETRY_MAX, RETRY_BASE * 2 ** (n - 1)) * random.uniform(0.8, 1.2)
+            heapq.heappush(self._retry, (time.monotonic() + delay, key))
+        log.warning("geocode failed for %r (retry in %.0fs): %s", key, delay, err)
+
+    def _resolve(self, batch):
+        try:
+            known = DB.geocode_cache_get_many(batch, POS_TTL, NEG_TTL)   # 그 사이 다른 세션이 채웠을 수도
+        except Exception as e:
+            for key in batch: self._fail(key, e)
+            return
+        for key in batch:
+            try:
+                if key in known:
+                    DB.resolve_geocode(key, known[key], None)
+                else:
+                    with self._lock: text = self._text.get(key, key)
+                    self._throttle(); self.requests += 1
+                    DB.resolve_geocode(key, self.provider.geocode(text), self.provider.name)
+                self._done(key)
+            except Exception as e:
+                self._fail(key, e)
+
+    def _run(self):
+        while True:
+            queued, retry = self._next_batch()
+            try:
+                batch = list(dict.fromkeys(queued + retry))
+                if batch: self._resolve(batch)
+            except Exception as e:            # 무슨 일이 있어도 워커는 죽지 않는다
+                log.exception("geocoder worker error: %s", e)
+            finally:
+                for _ in queued: self._q.task_done()
+
+    def wait_idle(self):
+        """대기열이 빌 때까지 (테스트/스크립트용). 백오프 중인 재시도는 기다리지 않는다."""
+        self._q.join()
+
+_default = None
+_default_lock = threading.Lock()
+
+def get_geocoder() -> Geocoder:
+    global _default
+    with _default_lock:
+        if _default is None: _default = Geocoder(default_provider())
+        return _default
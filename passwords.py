@@ -0,0 +1,77 @@
+"""bcrypt 해시/검증을 전용 스레드 풀에서 실행.
+
+bcrypt 는 GIL 을 놓고 CPU 만 쓰므로 스레드 풀이면 충분하다. 동시에 도는 해시 수를
+PLANNER_PW_WORKERS 로 묶어 로그인이 몰려도 나머지 코어는 화면 렌더링에 남긴다.
+비용(rounds)은 PLANNER_BCRYPT_ROUNDS, 바뀌면 다음 로그인 때 새 비용으로 다시 해시한다.
+"""
+import os, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.environ.get("PLANNER_BCRYPT_ROUNDS", "12"))
+PW_WORKERS = int(os.environ.get("PLANNER_PW_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+
+_pool = ThreadPoolExecutor(max_workers=PW_WORKERS, thread_name_prefix="bcrypt")
+
+class _Latency:
+    """최근 샘플로 p50/p95 (ms). wait=대기열, run=bcrypt 자체"""
+
+    def __init__(self, n=512):
+        self._lock = threading.Lock()
+        self._s = {"hash": deque(maxlen=n), "check": deque(maxlen=n)}
+        self.counts = {"hash": 0, "check": 0}
+
+    def add(self, kind, wait, run):
+        with self._lock:
+            self._s[kind].append((wait, run)); self.counts[kind] += 1
+
+    def stats(self) -> dict:
+        out = {"workers": PW_WORKERS, "rounds": BCRYPT_ROUNDS}
+        with self._lock:
+            for kind, s in self._s.items():
+                for i, part in enumerate(("wait", "run")):
+                    xs = sorted(x[i] * 1000 for x in s)
+                    out[f"{kind}_{part}_p50_ms"] = round(xs[len(xs) // 2], 2) if xs else None
+                    out[f"{kind}_{part}_p95_ms"] = round(xs[int(len(xs) * 0.95)], 2) if xs else None
+                out[f"{kind}_count"] = self.counts[kind]
+        return out
+
+LATENCY = _Latency()
+
+def _timed(kind, fn, *args):
+    queued = time.perf_counter()
+    def run():
+        t0 = time.perf_counter()
+        try: return fn(*args)
+        finally:
+            t1 = time.perf_counter(); LATENCY.add(kind, t0 - queued, t1 - t0)
+    return _pool.submit(run)
+
+def _hash(pw: str, rounds: int) -> bytes:
+    return bcrypt.hashpw(pw.encode("utf-8"), bcrypt.gensalt(rounds))
+
+def _check(pw: str, pw_hash: bytes) -> bool:
+    try: return bcrypt.checkpw(pw.encode("utf-8"), pw_hash)
+    except Exception: return False
+
+def hash_pw(pw: str, rounds: int = None) -> bytes:
+    return _timed("hash", _hash, pw, rounds or BCRYPT_ROUNDS).result()
+
+def check_pw(pw: str, pw_hash: bytes) -> bool:
+    return _timed("check", _check, pw, pw_hash).result()
+
+def hash_pw_async(pw: str, rounds: int = None):
+    """Future[bytes] — 기다리지 않고 다시 해시할 때"""
+    return _timed("hash", _hash, pw, rounds or BCRYPT_ROUNDS)
+
+def hash_rounds(pw_hash: bytes):
+    """b'$2b$12$...' -> 12"""
+    try: return int(bytes(pw_hash).split(b"$")[2])
+    except (ValueError, IndexError, TypeError): return None
+
+def needs_rehash(pw_hash: bytes) -> bool:
+    return hash_rounds(pw_hash) != BCRYPT_ROUNDS
+
+def stats() -> dict:
+    return LATENCY.stats()
@@ -1,5 +1,7 @@
 from typing import List, Dict
-import datetime as dt
+from collections.abc import Mapping
+import datetime as dt, heapq
+import numpy as np
 
 def daterange(d0: str, d1: str):
     a = dt.date.fromisoformat(d0); b = dt.date.fromisoformat(d1)
@@ -8,63 +10,617 @@ def daterange(d0: str, d1: str):
         yield cur.isoformat()
         cur += dt.timedelta(days=1)
 
-def best_windows(days: List[str], agg: Dict[str, dict], min_days: int, quorum: int) -> List[dict]:
-    wins = []
-    for i in range(0, len(days)-min_days+1):
-        chunk = days[i:i+min_days]
-        score = sum(agg[d]["score"] for d in chunk)
-        feasible = all(
-            (agg[d]["full"]+agg[d]["am"]+agg[d]["pm"]+agg[d]["eve"]) >= quorum
-            for d in chunk
-        )
-        wins.append({"days": chunk, "score": round(score,2), "feasible": feasible})
-    wins.sort(key=lambda x: (x["feasible"], x["score"]), reverse=True)
-    return wins[:3]
-
-import math
-
-def _haversine(a,b):
-    R=6371
-    lat1,lon1=a; lat2,lon2=b
-    p=math.radians
-    dlat=p(lat2-lat1); dlon=p(lon2-lon1)
-    x=math.sin(dlat/2)**2 + math.cos(p(lat1))*math.cos(p(lat2))*math.sin(dlon/2)**2
-    return 2*R*math.asin(math.sqrt(x))
+# ---------- 가용성 집계 엔진 ----------
+STATUSES = ("off", "eve", "pm", "am", "full")   # 코드 0..4 (가용 수준 순서)
+_STATUS_SORTED = np.array(sorted(STATUSES))
+_SORTED_TO_CODE = np.array([STATUSES.index(s) for s in _STATUS_SORTED], dtype=np.uint8)
+
+def weight_vector(w: dict) -> np.ndarray:
+    """{'full':..,'am':..} -> 코드 순서 가중치 벡터"""
+    return np.array([float(w.get(s, 0.0)) for s in STATUSES])
+
+def _lookup(sorted_keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """values 각각의 sorted_keys 내 위치, 없으면 -1"""
+    if not len(sorted_keys) or not len(values):
+        return np.full(len(values), -1, dtype=np.int64)
+    pos = np.searchsorted(sorted_keys, values)
+    pos[pos >= len(sorted_keys)] = 0
+    return np.where(sorted_keys[pos] == values, pos, -1)
+
+class DayAggregate(Mapping):
+    """(user, day, status) 정수 배열 -> 일자×상태 카운트 행렬, 점수, 쿼럼 마스크.
+    Mapping 으로서 기존 agg[day] -> {"full","am","pm","eve","off","score"} 형태도 그대로 제공."""
+
+    def __init__(self, days, user_idx, day_idx, codes, weights: dict, user_ids=()):
+        self.days = list(days)
+        self.user_ids = list(user_ids)
+        self.user_idx = np.asarray(user_idx, dtype=np.int32)
+        self.day_idx = np.asarray(day_idx, dtype=np.int32)
+        self.codes = np.asarray(codes, dtype=np.uint8)
+        n = len(self.days)
+        self.counts = np.bincount(self.day_idx.astype(np.int64) * 5 + self.codes,
+                                  minlength=n * 5).reshape(n, 5)
+        self.available = self.counts[:, 1:].sum(axis=1)
+        self._pos = {d: i for i, d in enumerate(self.days)}
+        self._dict = None
+        self._pdm = None
+        self._apply_weights(weights)
+        for a in (self.user_idx, self.day_idx, self.codes, self.counts, self.available):
+            a.flags.writeable = False
+
+    @classmethod
+    def from_rows(cls, days, rows, weights: dict):
+        """rows: user_id/day/status 를 가진 행들. 기간 밖 날짜·모르는 상태는 무시."""
+        rows = list(rows)
+        day_arr = np.array([r["day"] for r in rows], dtype=object).astype(str)
+        st_arr = np.array([r["status"] for r in rows], dtype=object).astype(str)
+        uid_arr = np.array([r["user_id"] for r in rows], dtype=np.int64)
+        d_idx = _lookup(np.array(days, dtype=str), day_arr)   # ISO 날짜는 문자열 정렬 = 날짜 정렬
+        s_pos = _lookup(_STATUS_SORTED, st_arr)
+        ok = (d_idx >= 0) & (s_pos >= 0)
+        user_ids, u_idx = np.unique(uid_arr[ok], return_inverse=True)
+        return cls(days, u_idx, d_idx[ok], _SORTED_TO_CODE[s_pos[ok]], weights, user_ids.tolist())
+
+    def _apply_weights(self, weights: dict):
+        self.weights = dict(weights)
+        self.wvec = weight_vector(self.weights)
+        self.scores = self.counts @ self.wvec
+        self._ps = np.concatenate(([0.0], np.cumsum(self.scores)))
+        self._dict = None
+
+    # --- 벡터 연산 ---
+    def quorum_mask(self, quorum: int) -> np.ndarray:
+        return self.available >= quorum
+
+    def index(self, day: str) -> int:
+        return self._pos[day]
+
+    def span_score(self, i: int, j: int) -> float:
+        """days[i..j] (포함) 점수 합"""
+        return float(self._ps[j+1] - self._ps[i])
+
+    def span_feasible(self, i: int, j: int, quorum: int) -> bool:
+        return bool(self.quorum_mask(quorum)[i:j+1].all())
+
+    def _window_feasible(self, min_days: int, quorum: int) -> np.ndarray:
+        pb = np.concatenate(([0], np.cumsum(~self.quorum_mask(quorum))))
+        return pb[min_days:] == pb[:-min_days]
+
+    @staticmethod
+    def _top_k(idx: np.ndarray, score: np.ndarray, k: int) -> np.ndarray:
+        """idx(오름차순) 중 점수 상위 k개를 (점수 내림차순, 앞선 구간) 순서로. 전체 정렬 없이
+        argpartition 으로 k번째 점수를 찾고, 그 점수와 같은 구간은 앞에서부터 채운다."""
+        if len(idx) > k:
+            neg = -score[idx]
+            t = np.partition(neg, k-1)[k-1]
+            above = idx[neg < t]
+            idx = np.concatenate((above, idx[neg == t][:k-len(above)]))
+        return idx[np.lexsort((idx, -score[idx]))]
+
+    def _rank(self, score: np.ndarray, feas: np.ndarray, min_days: int, k: int) -> List[dict]:
+        """쿼럼 충족 구간 먼저, 모자라면 미충족 구간으로 채운다"""
+        order = self._top_k(np.flatnonzero(feas), score, k)
+        if len(order) < k:
+            order = np.concatenate((order, self._top_k(np.flatnonzero(~feas), score, k - len(order))))
+        return [{"days": self.days[i:i+min_days], "score": float(score[i]), "feasible": bool(feas[i])}
+                for i in order.tolist()]
+
+    def windows(self, min_days: int, quorum: int, k: int = 3) -> List[dict]:
+        """best_windows 와 같은 정렬(쿼럼 충족 → 점수 → 앞선 구간)로 상위 k개"""
+        n = len(self.days)
+        if min_days < 1 or n < min_days or k <= 0:
+            return []
+        score = np.round(self._ps[min_days:] - self._ps[:-min_days], 2)
+        return self._rank(score, self._window_feasible(min_days, quorum), min_days, k)
+
+    def what_if(self, weight_sets: List[dict], min_days: int, quorum: int, k: int = 3) -> List[List[dict]]:
+        """여러 가중치 설정을 한 번에 비교: 카운트 행렬 × (5×m) 가중치 행렬 한 번으로
+        모든 설정의 일자 점수를 구하고, 설정별 상위 k 구간 리스트를 돌려준다."""
+        n = len(self.days)
+        if not weight_sets:
+            return []
+        if min_days < 1 or n < min_days or k <= 0:
+            return [[] for _ in weight_sets]
+        W = np.stack([weight_vector(w) for w in weight_sets], axis=1)     # 5 × m
+        ps = np.vstack((np.zeros(W.shape[1]), np.cumsum(self.counts @ W, axis=0)))
+        score = np.round(ps[min_days:] - ps[:-min_days], 2)                # 구간 × m
+        feas = self._window_feasible(min_days, quorum)
+        return [self._rank(score[:, c], feas, min_days, k) for c in range(W.shape[1])]
+
+    @property
+    def person_day(self) -> np.ndarray:
+        """사용자(user_ids 순)×일자 상태 코드 행렬, uint8 (입력 없음 = 0/off)"""
+        if self._pdm is None:
+            m = np.zeros((len(self.user_ids), len(self.days)), dtype=np.uint8)
+            m[self.user_idx, self.day_idx] = self.codes
+            m.flags.writeable = False
+            self._pdm = m
+        return self._pdm
+
+    # --- dict 호환 뷰 ---
+    def _as_dict(self):
+        if self._dict is None:
+            self._dict = {
+                d: {"full": c[4], "am": c[3], "pm": c[2], "eve": c[1], "off": c[0], "score": sc}
+                for d, c, sc in zip(self.days, self.counts.tolist(), self.scores.tolist())
+            }
+        return self._dict
+
+    def __getitem__(self, day):
+        return self._as_dict()[day]
+
+    def __iter__(self):
+        return iter(self.days)
+
+    def __len__(self):
+        return len(self.days)
+
+def best_windows(days: List[str], agg: Dict[str, dict], min_days: int, quorum: int, k: int = 3) -> List[dict]:
+    """길이 min_days 연속 구간 중 (쿼럼 충족, 점수) 상위 k개. 동점이면 앞선 구간 우선.
+    prefix sum + 미충족 일수 누적으로 O(n). top-k 는 DayAggregate 면 np.argpartition 으로 고른 k개만 정렬,
+    dict 집계면 크기 k 힙(heapq.nsmallest)으로 O(n log k)."""
+    if isinstance(agg, DayAggregate) and agg.days == list(days):
+        return agg.windows(min_days, quorum, k)
+    n = len(days)
+    if min_days < 1 or n < min_days or k <= 0:
+        return []
+    ps = [0.0] * (n + 1)   # 점수 누적합
+    pb = [0] * (n + 1)     # 쿼럼 미달 일수 누적
+    for i, d in enumerate(days):
+        a = agg[d]
+        ps[i+1] = ps[i] + a["score"]
+        pb[i+1] = pb[i] + ((a["full"]+a["am"]+a["pm"]+a["eve"]) < quorum)
+    top = heapq.nsmallest(
+        k,
+        ((pb[i+min_days] == pb[i], round(ps[i+min_days] - ps[i], 2), i) for i in range(n - min_days + 1)),
+        key=lambda w: (not w[0], -w[1], w[2]),
+    )
+    return [{"days": days[i:i+min_days], "score": score, "feasible": feasible} for feasible, score, i in top]
+
+import time
+from collections import deque
+
+# ---------- 동선 최적화 ----------
+ROUTE_TIME_BUDGET = 0.08     # 초. 지역 탐색은 이 시간 안에서만 돈다
+ROUTE_MAX_MOVES = 20000
+ROUTE_NEIGHBORS = 10         # 후보 이웃 수 (neighbor list)
+_EPS = 1e-9
+
+def distance_matrix(lat, lon) -> np.ndarray:
+    """위경도 배열 -> 하버사인 거리(km) 행렬, 한 번에 벡터 계산"""
+    la = np.radians(np.asarray(lat, dtype=float)); lo = np.radians(np.asarray(lon, dtype=float))
+    x = (np.sin((la[:, None] - la[None, :]) / 2) ** 2
+         + np.cos(la)[:, None] * np.cos(la)[None, :] * np.sin((lo[:, None] - lo[None, :]) / 2) ** 2)
+    return 2 * 6371 * np.arcsin(np.sqrt(np.clip(x, 0.0, 1.0)))
+
+def _points_matrix(points) -> np.ndarray:
+    return distance_matrix([p["lat"] for p in points], [p["lon"] for p in points])
+
+def path_length(D, path) -> float:
+    return float(sum(D[a][b] for a, b in zip(path, path[1:])))
+
+def _nearest_neighbor(Dm: np.ndarray, start: int, end=None) -> List[int]:
+    """start 에서 시작하는 최근접 이웃 경로. end 가 있으면 맨 끝에 고정."""
+    n = len(Dm)
+    used = np.zeros(n, dtype=bool); used[start] = True
+    if end is not None: used[end] = True
+    path = [start]; cur = start
+    for _ in range(n - int(used.sum())):
+        row = np.where(used, np.inf, Dm[cur])
+        cur = int(row.argmin()); used[cur] = True; path.append(cur)
+    if end is not None: path.append(end)
+    return path
+
+def _local_search(Dm: np.ndarray, path: List[int], time_budget=ROUTE_TIME_BUDGET,
+                  max_moves=ROUTE_MAX_MOVES, k=ROUTE_NEIGHBORS) -> List[int]:
+    """양 끝이 고정된 경로를 neighbor-list 2-opt + Or-opt(1~3개 구간 이동)로 개선.
+    don't-look bit 큐로 바뀐 지점 주변만 다시 보고, 시간/이동 횟수 예산에서 멈춘다."""
+    P = list(path); n = len(P)
+    if n < 4: return P
+    D = Dm.tolist()                                   # 파이썬 루프에선 list 인덱싱이 빠르다
+    kk = min(k, len(Dm) - 1)
+    Dn = Dm.copy(); np.fill_diagonal(Dn, np.inf)      # 자기 자신 제외 (거리 0 인 복제점이 있을 수 있음)
+    neigh = np.argsort(Dn, axis=1)[:, :kk].tolist()
+    pos = [0] * len(Dm)
+    for idx, v in enumerate(P): pos[v] = idx
+    deadline = time.perf_counter() + time_budget
+    queue = deque(P); inq = set(P); moves = 0
+
+    def push(*vs):
+        for v in vs:
+            if v not in inq: inq.add(v); queue.append(v)
+
+    def reverse(i, j):   # P[i+1..j] 뒤집기 → 간선 (P[i],P[j]), (P[i+1],P[j+1])
+        P[i+1:j+1] = P[i+1:j+1][::-1]
+        for t in range(i+1, j+1): pos[P[t]] = t
+
+    def try_2opt(a):
+        i = pos[a]
+        for succ in (True, False):
+            if (succ and i >= n-1) or (not succ and i == 0): continue
+            b = P[i+1] if succ else P[i-1]
+            dab = D[a][b]
+            for c in neigh[a]:
+                if dab - D[a][c] <= _EPS: break
+                j = pos[c]
+                if (succ and j >= n-1) or (not succ and j == 0): continue
+                d = P[j+1] if succ else P[j-1]
+                if c == a or c == b or d == a: continue
+                if D[a][c] + D[b][d] - dab - D[c][d] < -_EPS:
+                    if succ: reverse(min(i, j), max(i, j))
+                    else:    reverse(min(i, j) - 1, max(i, j) - 1)
+                    push(a, b, c, d); return True
+        return False
+
+    def try_oropt(a):
+        i = pos[a]
+        for L in (1, 2, 3):
+            if i < 1 or i + L - 1 > n - 2: return False
+            s0, sL = P[i], P[i+L-1]; p, nx = P[i-1], P[i+L]
+            gain = D[p][s0] + D[sL][nx] - D[p][nx]
+            if gain <= _EPS: continue
+            for c in neigh[s0] + neigh[sL]:
+                kc = pos[c]
+                if i <= kc <= i + L - 1: continue
+                for e in (kc - 1, kc):                # 간선 (P[e], P[e+1]) 사이에 삽입
+                    if e < 0 or e > n - 2 or i - 1 <= e <= i + L - 1: continue
+                    u, v = P[e], P[e+1]
+                    fwd = D[u][s0] + D[sL][v] - D[u][v]
+                    rev = D[u][sL] + D[s0][v] - D[u][v]
+                    if min(fwd, rev) < gain - _EPS:
+                        seg = P[i:i+L] if fwd <= rev else P[i:i+L][::-1]
+                        rest = P[:i] + P[i+L:]
+                        at = (e if e < i else e - L) + 1
+                        P[:] = rest[:at] + seg + rest[at:]
+                        for t, w in enumerate(P): pos[w] = t
+                        push(p, nx, s0, sL, u, v); return True
+        return False
+
+    while queue and moves < max_moves and time.perf_counter() < deadline:
+        a = queue.popleft(); inq.discard(a)
+        if try_2opt(a) or try_oropt(a):
+            moves += 1; push(a)
+    return P
+
+def held_karp(Dm: np.ndarray, start: int = 0, end=None, closed: bool = True) -> List[int]:
+    """비트마스크 DP 로 정확한 최단 경로. O(n^2 2^n) 이라 작은 n 전용.
+    end 지정: start→end 고정 경로 / end=None, closed: start 로 돌아오는 순환 /
+    end=None, not closed: 끝점 자유(열린 경로). 반환은 방문 인덱스 순서(순환이면 start 재방문 제외)."""
+    n = len(Dm)
+    inner = [v for v in range(n) if v != start and v != end]
+    m = len(inner)
+    if m == 0: return [start] + ([end] if end is not None and end != start else [])
+    D = np.asarray(Dm, dtype=float)[np.ix_(inner, inner)]
+    full = (1 << m) - 1
+    dp = np.full((full + 1, m), np.inf); par = np.full((full + 1, m), -1, dtype=np.int16)
+    bits = 1 << np.arange(m)
+    dp[bits, np.arange(m)] = np.asarray(Dm, dtype=float)[start, inner]
+    masks = np.arange(full + 1)
+    pc = np.zeros(full + 1, dtype=np.int8)
+    for b in range(m): pc += (masks >> b) & 1
+    for size in range(2, m + 1):                      # 원소 수 순서대로 → 이전 층은 항상 완성돼 있음
+        layer = masks[pc == size]
+        for j in range(m):
+            sel = layer[(layer & bits[j]) != 0]
+            cand = dp[sel ^ bits[j]] + D[:, j]        # (len(sel), m): 직전 지점 i 에서 j 로
+            arg = cand.argmin(axis=1)
+            dp[sel, j] = cand[np.arange(len(sel)), arg]; par[sel, j] = arg
+    tail = end if end is not None else (start if closed else None)
+    last = dp[full] + (np.asarray(Dm, dtype=float)[inner, tail] if tail is not None else 0.0)
+    j = int(last.argmin()); mask = full; rev = []
+    while j >= 0:
+        rev.append(inner[j]); pj = int(par[mask, j]); mask ^= 1 << j; j = pj
+    path = [start] + rev[::-1]
+    return path + [end] if end is not None else path
+
+ROUTE_EXACT_MAX = 15         # 지점 수가 이 이하이면 Held-Karp (정확해, 15개에서 ~20ms)
+
+def _solve(Dm: np.ndarray, start: int, end, closed: bool, time_budget) -> tuple:
+    """크기에 따라 solver 선택 -> (인덱스 순서, solver 이름)"""
+    n = len(Dm)
+    if n <= 2: return [start] + [k for k in range(n) if k != start], "trivial"
+    if n <= ROUTE_EXACT_MAX:
+        return held_karp(Dm, start, end, closed), "held-karp"
+    if end is None:
+        # 순환: start 복제본(더미 n)을 끝점으로 / 열린 경로: 모든 점과 거리 0 인 더미를 끝점으로
+        Dx = np.zeros((n+1, n+1)); Dx[:n, :n] = Dm
+        if closed: Dx[n, :n] = Dm[start]; Dx[:n, n] = Dm[:, start]
+        return _local_search(Dx, _nearest_neighbor(Dx, start, n), time_budget)[:-1], "2opt+oropt"
+    return _local_search(Dm, _nearest_neighbor(Dm, start, end), time_budget), "2opt+oropt"
+
+def route_order(Dm: np.ndarray, start: int = 0, end=None, time_budget=ROUTE_TIME_BUDGET,
+                closed: bool = True) -> List[int]:
+    """거리 행렬 위에서 방문 순서(인덱스). end=None 이면 closed 에 따라 순환/열린 경로."""
+    return _solve(Dm, start, end, closed, time_budget)[0]
 
 def nn_route(points):
     """points: [{'id':..,'lat':..,'lon':..}] -> index 순서 반환"""
     if not points: return []
-    rem=list(range(len(points))); path=[rem.pop(0)]
-    while rem:
-        last=points[path[-1]]
-        j=min(rem, key=lambda k:_haversine((last["lat"],last["lon"]),(points[k]["lat"],points[k]["lon"])))
-        rem.remove(j); path.append(j)
-    return path
+    return _nearest_neighbor(_points_matrix(points), 0)
 
 def two_opt(points, order):
-    improved=True
-    while improved:
-        improved=False
-        for i in range(1,len(order)-2):
-            for j in range(i+1,len(order)-1):
-                a,b=order[i-1],order[i]
-                c,d=order[j],order[j+1]
-                dab=_haversine((points[a]["lat"],points[a]["lon"]),(points[b]["lat"],points[b]["lon"]))
-                dcd=_haversine((points[c]["lat"],points[c]["lon"]),(points[d]["lat"],points[d]["lon"]))
-                dac=_haversine((points[a]["lat"],points[a]["lon"]),(points[c]["lat"],points[c]["lon"]))
-                dbd=_haversine((points[b]["lat"],points[b]["lon"]),(points[d]["lat"],points[d]["lon"]))
-                if dac+dbd < dab+dcd - 1e-6:
-                    order[i:j+1]=reversed(order[i:j+1]); improved=True
-    return order
-
-def optimize_route(items):
-    pts=[{"id":it["id"],"lat":it["lat"],"lon":it["lon"],"is_anchor":it["is_anchor"]} for it in items if it["lat"] and it["lon"]]
-    if len(pts)<2: return [it["id"] for it in items]
+    """양 끝을 고정한 채 order 개선 (2-opt + Or-opt)"""
+    return _local_search(_points_matrix(points), order)
+
+def optimize_route(items, time_budget=ROUTE_TIME_BUDGET, round_trip: bool = True) -> dict:
+    """items(id/lat/lon/is_anchor) -> {"order": id 순서, "distance_km": 총 거리, "solver": 사용한 solver}.
+    앵커 0개: 첫 지점에서 출발(round_trip 이면 복귀) / 1개: 그 앵커(숙소)에서 출발(·복귀) /
+    2개 이상: 첫 앵커에서 출발, 마지막 앵커에서 끝 (중간 앵커는 일반 지점처럼 배치).
+    지점이 ROUTE_EXACT_MAX 이하면 Held-Karp, 그보다 많으면 NN + 2-opt/Or-opt.
+    좌표 없는 항목은 기존 순서대로 맨 뒤에 붙인다 (거리 계산에서 제외)."""
+    pts=[it for it in items if it["lat"] is not None and it["lon"] is not None]
+    if len(pts)<2: return {"order": [it["id"] for it in items], "distance_km": 0.0, "solver": "trivial"}
+    no_coord=[it["id"] for it in items if it["lat"] is None or it["lon"] is None]
     anchors=[i for i,p in enumerate(pts) if p["is_anchor"]]
-    start_idx = anchors[0] if anchors else 0
-    pts[0], pts[start_idx] = pts[start_idx], pts[0]
-    order = nn_route(pts)
-    order = two_opt(pts, order+[order[0]])[:-1]
-    ids_order=[pts[i]["id"] for i in order]
-    # anchor를 맨앞/맨뒤로 고정하려면 여기서 조정 가능
-    return ids_order
\ No newline at end of file
+    start = anchors[0] if anchors else 0
+    end = anchors[-1] if len(anchors) >= 2 else None
+    Dm = _points_matrix(pts)
+    order, solver = _solve(Dm, start, end, round_trip, time_budget)
+    if end is None and round_trip and len(order) > 2 and pts[order[1]]["id"] > pts[order[-1]]["id"]:
+        order = order[:1] + order[:0:-1]          # 순환은 방향만 다른 해가 같은 거리 → 다시 돌려도 같은 순서가 나오게
+    dist = path_length(Dm, order + ([start] if end is None and round_trip else []))
+    return {"order": [pts[i]["id"] for i in order] + no_coord, "distance_km": dist, "solver": solver}
+
+# ---------- 시간창 일정 ----------
+TRAVEL_SPEED_KMH = 25.0      # 시내 이동 평균 속도 (거리 → 이동 시간 추정)
+DEFAULT_DWELL_MIN = 60       # 시간이 없는 장소의 기본 체류 시간(분)
+DAY_START_MIN = 9 * 60       # 시작 시각이 없으면 09:00 출발
+SCHEDULE_TIME_BUDGET = 0.15  # 초. 삽입 후 재배치(relocate) 탐색 예산
+_INF = float("inf")
+
+def parse_hhmm(s):
+    """'10:00' -> 600(분). 비었거나 형식이 틀리면 None"""
+    try:
+        h, m = str(s).strip().split(":")[:2]; v = int(h) * 60 + int(m)
+        return v if 0 <= v <= 48 * 60 else None
+    except (ValueError, AttributeError):
+        return None
+
+def fmt_hhmm(m) -> str:
+    m = int(round(m)); return f"{m // 60:02d}:{m % 60:02d}"
+
+def _windows(items):
+    """(earliest, latest_start, dwell) 리스트.
+    시작·종료 둘 다: 예약 — 시작 시각에 정확히 시작, 종료까지 체류 / 시작만: 그 시각에 시작 /
+    종료만: 종료 전까지 끝나야 함 / 없음: 자유, 기본 체류 (앵커는 체류 0)."""
+    out = []
+    for it in items:
+        s, e = parse_hhmm(it.get("start_time")), parse_hhmm(it.get("end_time"))
+        dwell = (e - s if s is not None and e is not None and e > s
+                 else 0 if it.get("is_anchor") else DEFAULT_DWELL_MIN)
+        if s is not None: out.append((s, s, dwell))
+        elif e is not None: out.append((-_INF, e - dwell, dwell))
+        else: out.append((-_INF, _INF, dwell))
+    return out
+
+class _Schedule:
+    """고정 양끝 경로의 시간 전개. B=서비스 시작, W=대기, S=뒤로 밀 수 있는 여유(Savelsbergh push-forward)"""
+
+    def __init__(self, T, win, path, t0):
+        self.T, self.win, self.path, self.t0 = T, win, path, t0
+        self.update()
+
+    def update(self):
+        T, win, P = self.T, self.win, self.path
+        n = len(P); B = [0.0] * n; W = [0.0] * n
+        e0, _, _ = win[P[0]]; B[0] = e0 if e0 > -_INF else self.t0
+        for i in range(1, n):
+            a = B[i-1] + win[P[i-1]][2] + T[P[i-1]][P[i]]
+            B[i] = max(a, win[P[i]][0]); W[i] = B[i] - a
+        S = [0.0] * n; S[-1] = win[P[-1]][1] - B[-1]
+        for i in range(n - 2, -1, -1):
+            S[i] = min(win[P[i]][1] - B[i], W[i+1] + S[i+1])
+        L = [0.0] * (n + 1)                                  # L[i] = P[:i] 의 지각 합
+        for i, v in enumerate(P): L[i+1] = L[i] + max(0.0, B[i] - win[v][1])
+        self.B, self.W, self.S, self.L = B, W, S, L
+        self.late = L[n]
+
+    def late_with(self, u, i) -> float:
+        """u 를 P[i] 뒤에 넣었을 때 정확한 지각 합 (P[i] 이후만 다시 전개)"""
+        T, win, P = self.T, self.win, self.path
+        late = self.L[i+1]; prev, t = P[i], self.B[i]
+        for v in [u] + P[i+1:]:
+            t = max(t + win[prev][2] + T[prev][v], win[v][0]); late += max(0.0, t - win[v][1]); prev = v
+        return late
+
+    def best_insert(self, D, u):
+        """u 를 넣을 위치 (추가 지각, 추가 거리, i) 최소 — 간선 (P[i], P[i+1]) 사이. O(n)"""
+        T, win, P, B, W, S = self.T, self.win, self.path, self.B, self.W, self.S
+        eu, lu, du = win[u]; best = (_INF, _INF, -1)
+        for i in range(len(P) - 1):
+            a, b = P[i], P[i+1]
+            bu = max(B[i] + win[a][2] + T[a][u], eu)
+            shift = bu + du + T[u][b] - (B[i] + win[a][2] + T[a][b])
+            push = max(0.0, shift - W[i+1])
+            viol = max(0.0, bu - lu) + max(0.0, push - max(0.0, S[i+1]))
+            cand = (viol, D[a][u] + D[u][b] - D[a][b], i)
+            if cand < best: best = cand
+        return best
+
+    def insert(self, D, u, exact=False, deadline=_INF):
+        """가장 싼 위치에 삽입. 여유(S)가 음수(이미 지각)면 추정이 부정확하므로 exact 면 전부 다시 계산.
+        다시 계산하는 도중 deadline 이 지나면 추정 위치를 쓴다."""
+        viol, dd, i = self.best_insert(D, u)
+        if viol > 0 and exact:
+            P = self.path; best = (_INF, _INF, i)
+            for k in range(len(P) - 1):
+                if time.perf_counter() >= deadline: break
+                cand = (round(self.late_with(u, k), 6), D[P[k]][u] + D[u][P[k+1]] - D[P[k]][P[k+1]], k)
+                if cand < best: best = cand
+            else:
+                i = best[2]
+        self.path.insert(i + 1, u); self.update()
+
+def schedule_route(items, time_budget=SCHEDULE_TIME_BUDGET, speed_kmh=TRAVEL_SPEED_KMH,
+                   round_trip: bool = True, day_start=DAY_START_MIN) -> dict:
+    """시간창(start_time/end_time)·앵커를 지키는 방문 순서 + 시간표.
+    시간이 하나도 없으면 optimize_route 순서를 그대로 쓰고 시간표만 붙인다. 있으면
+    시간 지정 장소(늦은 마감 순) → 나머지(거리 최적 순서)를 가장 싼 위치에 삽입하고
+    (지각 분, 거리) 기준으로 relocate 를 time_budget 동안 반복.
+    반환: optimize_route 결과 + schedule(장소별 도착/시작/출발/지각) + infeasible(못 지킨 시간창).
+    좌표 없는 항목은 시간표 없이 맨 뒤. time_budget 은 거리 최적화까지 포함한 전체 탐색 시간의 상한."""
+    deadline = time.perf_counter() + time_budget
+    base = optimize_route(items, time_budget=min(time_budget / 2, ROUTE_TIME_BUDGET), round_trip=round_trip)
+    pts = [it for it in items if it["lat"] is not None and it["lon"] is not None]
+    if len(pts) < 2: return {**base, "schedule": [], "infeasible": []}
+    no_coord = [it["id"] for it in items if it["lat"] is None or it["lon"] is None]
+    idx = {p["id"]: i for i, p in enumerate(pts)}
+    n = len(pts); Dm = _points_matrix(pts)
+    anchors = [i for i, p in enumerate(pts) if p["is_anchor"]]
+    start = anchors[0] if anchors else 0
+    end = anchors[-1] if len(anchors) >= 2 else None
+    # 끝점: 고정 앵커 / 순환이면 start 복제 / 열린 경로면 거리 0 더미 (더미는 시간창 없음)
+    if end is None:
+        Dx = np.zeros((n+1, n+1)); Dx[:n, :n] = Dm
+        if round_trip: Dx[n, :n] = Dm[start]; Dx[:n, n] = Dm[:, start]
+        Dm, end = Dx, n
+    D = Dm.tolist(); T = (Dm * (60.0 / speed_kmh)).tolist()
+    win = _windows(pts) + [(-_INF, _INF, 0)] * (len(Dm) - n)
+    timed = [i for i in range(n) if win[i][1] < _INF and i not in (start, end)]
+    solver = base["solver"]
+    if timed:
+        sch = _Schedule(T, win, [start, end], day_start)
+        flex_order = [idx[i] for i in base["order"] if i in idx]
+        todo = (sorted(timed, key=lambda v: (win[v][1], win[v][0]))
+                + [v for v in flex_order if win[v][1] == _INF and v not in (start, end)])
+        for k, u in enumerate(todo):
+            if time.perf_counter() >= deadline:
+                # 예산 초과: 남은 장소는 (마감 순 → 거리 순서) 그대로 끝점 앞에 붙인다
+                sch.path[-1:-1] = todo[k:]; sch.update(); break
+            sch.insert(D, u, exact=True, deadline=deadline)
+        # relocate: 하나씩 빼서 가장 좋은 자리에 다시 넣기, 개선 없을 때까지 / 예산까지
+        cost = lambda s: (round(s.late, 6), path_length(D, s.path))
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = False
+            for u in list(sch.path[1:-1]):
+                if time.perf_counter() >= deadline: break
+                cur = cost(sch); keep = list(sch.path)
+                sch.path.remove(u); sch.update(); sch.insert(D, u, exact=True, deadline=deadline)
+                if cost(sch) < cur: improved = True
+                else: sch.path = keep; sch.update()
+        path = sch.path; solver = "time-window"
+    else:
+        path = [idx[i] for i in base["order"] if i in idx] + ([end] if end >= n else [])
+        sch = _Schedule(T, win, path, day_start)
+    sched = []; infeasible = []
+    for i, v in enumerate(path):
+        if v >= n: continue
+        e, l, dw = win[v]; b = sch.B[i]; late = max(0.0, b - l)
+        arrive = b - sch.W[i] if i else b
+        row = {"id": pts[v]["id"], "arrive": fmt_hhmm(arrive), "start": fmt_hhmm(b),
+               "leave": fmt_hhmm(b + dw), "wait_min": round(sch.W[i]), "late_min": round(late)}
+        sched.append(row)
+        if late > 0.5:
+            infeasible.append({"id": pts[v]["id"], "late_min": round(late),
+                               "window": (pts[v].get("start_time") or "", pts[v].get("end_time") or "")})
+    order = [pts[v]["id"] for v in path if v < n]
+    return {"order": order + no_coord, "distance_km": path_length(D, path), "solver": solver,
+            "schedule": sched, "infeasible": infeasible}
+
+# ---------- 여러 날 한 번에 ----------
+import os, threading
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+
+ROUTE_WORKERS = int(os.environ.get("PLANNER_ROUTE_WORKERS", str(min(4, os.cpu_count() or 1))))
+PARALLEL_MIN_STOPS = 40      # 전체 지점 수가 이보다 적으면 프로세스 왕복보다 그냥 도는 게 빠르다
+_pool = None
+_pool_lock = threading.Lock()
+
+def _route_pool():
+    """프로세스 풀은 한 번 만들어 재사용 (spawn: 스트림릿 스레드가 있는 상태에서 fork 하지 않도록)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=ROUTE_WORKERS, mp_context=mp.get_context("spawn"))
+        return _pool
+
+def _drop_pool(pool):
+    """망가진 풀은 워커 프로세스까지 정리하고 버린다 (다음 호출이 새로 만든다)"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool: _pool = None
+    if pool is not None: pool.shutdown(wait=False, cancel_futures=True)
+
+def _schedule_day(args):
+    day, items, time_budget = args
+    return day, schedule_route(items, time_budget=time_budget)
+
+def schedule_days(day_items: Dict[str, list], time_budget=SCHEDULE_TIME_BUDGET, workers=None) -> Dict[str, dict]:
+    """{day: items} -> {day: schedule_route 결과}. 날짜별로 독립이라 프로세스 풀에서 병렬로 푼다."""
+    jobs = [(d, its, time_budget) for d, its in day_items.items() if its]
+    workers = ROUTE_WORKERS if workers is None else workers
+    if workers <= 1 or len(jobs) < 2 or sum(len(j[1]) for j in jobs) < PARALLEL_MIN_STOPS:
+        return dict(map(_schedule_day, jobs))
+    pool = None
+    try:
+        pool = _route_pool()
+        return dict(pool.map(_schedule_day, jobs))
+    except (OSError, RuntimeError):      # 풀 생성/작업 실패(BrokenProcessPool 포함) → 버리고 순차로
+        _drop_pool(pool)
+        return dict(map(_schedule_day, jobs))
+
+# ---------- 정산 ----------
+SETTLE_EXACT_MAX = 16        # 잔액이 0 이 아닌 사람이 이 이하이면 최소 이체 수를 정확히 구한다
+
+def split_won(amount: int, ids) -> Dict[int, int]:
+    """정수 원 단위 n분할. 나머지 r 원은 id 순으로 앞의 r 명이 1원씩 더 낸다 → 합이 정확히 amount"""
+    ids = sorted(ids)
+    if not ids: return {}
+    q, r = divmod(int(amount), len(ids))
+    return {u: q + (1 if k < r else 0) for k, u in enumerate(ids)}
+
+def _greedy_transfers(bal: Dict[int, int]) -> List[dict]:
+    """큰 채무자 ↔ 큰 채권자부터 맞춘다. 매 단계 한 명 이상이 0 이 되므로 이체 ≤ 인원-1"""
+    debt = sorted(([u, -b] for u, b in bal.items() if b < 0), key=lambda x: (-x[1], x[0]))
+    cred = sorted(([u, b] for u, b in bal.items() if b > 0), key=lambda x: (-x[1], x[0]))
+    out = []; i = j = 0
+    while i < len(debt) and j < len(cred):
+        x = min(debt[i][1], cred[j][1])
+        out.append({"from": debt[i][0], "to": cred[j][0], "amount": x})
+        debt[i][1] -= x; cred[j][1] -= x
+        if debt[i][1] == 0: i += 1
+        if cred[j][1] == 0: j += 1
+    return out
+
+def _zero_sum_groups(users: List[int], vals: List[int]) -> List[List[int]]:
+    """합이 0 인 부분집합으로 최대한 많이 쪼갠다 (비트마스크 DP, 층별 벡터화).
+    그룹 g 개면 최소 이체 수 = 인원 - g (그룹마다 인원-1 번)"""
+    n = len(vals); full = (1 << n) - 1
+    masks = np.arange(full + 1); bits = 1 << np.arange(n)
+    has = (masks[:, None] & bits[None, :]) != 0                     # (2^n, n)
+    sums = has.astype(np.int64) @ np.asarray(vals, dtype=np.int64)
+    zero = (sums == 0).astype(np.int32)
+    pc = has.sum(axis=1)
+    dp = np.zeros(full + 1, dtype=np.int32)
+    for size in range(1, n + 1):
+        layer = masks[pc == size]
+        best = np.full(len(layer), -1, dtype=np.int32)
+        for i in range(n):
+            m = (layer & bits[i]) != 0
+            best[m] = np.maximum(best[m], dp[layer[m] ^ bits[i]])
+        dp[layer] = best + zero[layer]
+    # 되짚기: dp[mask] = (mask 원소를 어떤 순서로 늘어놓았을 때 합 0 인 prefix 수)의 최댓값.
+    # 그 순서를 복원해 합이 0 이 되는 곳마다 끊으면 그룹이 된다.
+    order = []; mask = full
+    while mask:
+        i = next(i for i in range(n) if mask >> i & 1 and dp[mask ^ (1 << i)] + zero[mask] == dp[mask])
+        order.append(i); mask ^= 1 << i
+    groups = []; cur = []; acc = 0
+    for i in reversed(order):
+        cur.append(users[i]); acc += vals[i]
+        if acc == 0: groups.append(cur); cur = []
+    return groups
+
+def min_transfers(balances: Dict[int, int]) -> List[dict]:
+    """정수 잔액(+: 받을 돈, -: 낼 돈, 합 0) -> 이체 목록.
+    SETTLE_EXACT_MAX 명 이하면 합 0 부분집합 분할로 최소 이체 수, 그보다 많으면 greedy."""
+    nz = {u: int(b) for u, b in balances.items() if int(b) != 0}
+    if not nz: return []
+    if len(nz) > SETTLE_EXACT_MAX: return _greedy_transfers(nz)
+    users = sorted(nz)
+    out = []
+    for g in _zero_sum_groups(users, [nz[u] for u in users]):
+        out += _greedy_transfers({u: nz[u] for u in g})
+    return out
@@ -0,0 +1,58 @@
+"""방 단위 변경 알림 (프로세스 내 pub/sub).
+
+database 의 쓰기 함수가 커밋한 뒤 publish(room_id, version) 하고, 다른 프로세스의 쓰기는
+database.start_change_watcher() 가 PRAGMA data_version 으로 알아채 같은 버스에 흘려 보낸다.
+세션은 버스에 있는 버전만 보고 (DB 를 읽지 않고) 자기 방이 바뀌었을 때만 다시 그린다.
+
+    BUS.watch(room_id, snap.room["version"])
+    if BUS.changed(room_id, snap.room["version"]): st.rerun()
+"""
+import threading, time
+
+WATCH_TTL = 120.0      # 이 시간 동안 아무 세션도 보지 않은 방은 watcher 가 더 이상 확인하지 않는다
+
+class RoomBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}        # room_id -> 마지막으로 알려진 version
+        self._watched = {}         # room_id -> 마지막 watch() 시각 (monotonic)
+        self.published = 0         # 실제로 버전이 올라가 알린 횟수
+
+    def publish(self, room_id, version):
+        """버전이 올라갔을 때만 기록한다 (같은/낮은 버전은 무시). 새로 올라갔으면 True"""
+        if version is None: return False
+        with self._lock:
+            if version <= self._versions.get(room_id, -1): return False
+            self._versions[room_id] = version; self.published += 1
+            return True
+
+    def publish_many(self, versions: dict):
+        for room_id, v in versions.items(): self.publish(room_id, v)
+
+    def unwatch(self, room_id):
+        """watcher 확인 대상에서 뺀다 (삭제된 방). 마지막 버전은 남겨 둬 changed() 는 계속 참"""
+        with self._lock:
+            self._watched.pop(room_id, None)
+
+    def watch(self, room_id, version=None):
+        """세션이 이 방을 보고 있음을 알림. 처음 보는 방이면 스냅샷 버전으로 시작값을 채운다."""
+        with self._lock:
+            self._watched[room_id] = time.monotonic()
+            if version is not None and version > self._versions.get(room_id, -1):
+                self._versions[room_id] = version
+
+    def watched_rooms(self, ttl=WATCH_TTL) -> list:
+        now = time.monotonic()
+        with self._lock:
+            for r in [r for r, t in self._watched.items() if now - t > ttl]: del self._watched[r]
+            return list(self._watched)
+
+    def version(self, room_id):
+        with self._lock:
+            return self._versions.get(room_id)
+
+    def changed(self, room_id, seen) -> bool:
+        v = self.version(room_id)
+        return v is not None and seen is not None and v > seen
+
+BUS = RoomBus()
@@ -1,8 +1,12 @@
-import streamlit as st, pandas as pd, datetime as dt
+import streamlit as st, pandas as pd, numpy as np, datetime as dt, html, io, os
 import database as DB
 import auth as AUTH
-from planner_core import best_windows, optimize_route
-from email_utils import send_reset_email
+from planner_core import best_windows, schedule_route, DayAggregate, STATUSES
+from cache_utils import LRUCache
+from email_utils import send_reset_email, smtp_configured, mail_worker
+from geocoding import get_geocoder
+from room_events import BUS
+from streamlit.errors import StreamlitAPIException
 
 # optional deps (안 깔려 있어도 죽지 않도록)
 try:
@@ -12,113 +16,182 @@ except Exception:
     st_folium = None
     folium = None
 try:
-    from geopy.geocoders import Nominatim
+    from matplotlib.figure import Figure     # pyplot 전역 상태 없이 (세션 스레드끼리 안전)
 except Exception:
-    Nominatim = None
-try:
-    import matplotlib.pyplot as plt
-except Exception:
-    plt = None
+    Figure = None
 
 st.set_page_config(page_title="친구 약속 잡기", layout="wide")
-DB.init_db()
+@st.cache_resource
+def _startup():
+    """프로세스당 한 번: 스키마 확인/마이그레이션, 백그라운드 워커 (rerun 마다 돌지 않게)"""
+    DB.init_db()
+    if smtp_configured(): mail_worker()    # 재시작 전에 못 보낸 outbox 도 이어서 보낸다
+    DB.start_change_watcher()              # 다른 프로세스의 쓰기도 BUS 로
+    get_geocoder().start()                 # 재시작 전에 좌표를 못 채운 장소도 이어서
+    return True
+
+_startup()
 
 def _rerun():
     if hasattr(st, "rerun"): st.rerun()
     else: st.experimental_rerun()
 
+LIVE_REFRESH_SECONDS = 2
+
+def live_refresh(room_id, seen):
+    """다른 사람이 방을 바꾸면 (BUS 버전 > 본 버전) 한 번만 전체 rerun. 기다리는 동안 DB 는 읽지 않는다."""
+    st.session_state["room_seen"] = seen
+    BUS.watch(room_id, seen)
+    @st.fragment(run_every=LIVE_REFRESH_SECONDS)
+    def _poll():
+        BUS.watch(room_id)
+        if BUS.changed(room_id, st.session_state.get("room_seen")): _rerun()
+    _poll()
+
+# ---- room_page 섹션 (fragment) ----
+# 섹션 안의 버튼은 그 섹션만 다시 그린다. 전체 rerun 때는 room_page 가 읽은 스냅샷을 섹션마다 한 번씩
+# 쓰고, 섹션만 다시 돌 때는 그 섹션 데이터만 새로 읽는다.
+def _section_snap(rid, section):
+    DB.track_my_versions()
+    stash = st.session_state.get("_room_snap")
+    if stash and stash["snap"].room["id"] == rid and section in stash["fresh"]:
+        stash["fresh"].discard(section); return stash["snap"]
+    snap = DB.load_room_snapshot(rid, st.session_state["user_id"], sections=(section,))
+    if snap is None: _rerun()                 # 방이 사라짐 → room_page 가 처리
+    return snap
+
+def _rerun_section(rid):
+    """내 쓰기로 올라간 버전은 '본 것'으로 넘겨 live_refresh 가 페이지 전체를 다시 그리지 않게 하고
+    현재 섹션만 rerun. 사이에 다른 사람의 변경이 끼어 있으면 live_refresh 가 전체를 다시 그린다."""
+    seen = st.session_state.get("room_seen")
+    mine = DB.take_my_versions().get(rid, ())
+    if seen is not None:
+        while seen + 1 in mine: seen += 1
+        st.session_state["room_seen"] = seen
+    try: st.rerun(scope="fragment")
+    except StreamlitAPIException: _rerun()      # 전체 실행 중에 눌린 경우 (fragment rerun 이 아님)
+
+def _flash(section, msg):
+    """rerun 뒤에도 보이도록 메시지를 남겨 둔다 (다음 실행에서 _show_flash 가 한 번 보여 주고 지움)"""
+    st.session_state[f"flash_{section}"] = msg
+
+def _show_flash(section):
+    msg = st.session_state.pop(f"flash_{section}", None)
+    if msg: st.success(msg)
+
+def _rerun_submitted(rid, owner_or_admin):
+    # 제출 여부는 방 관리 패널의 멤버 목록에도 보이므로 방장/관리자는 전체를 다시 그린다
+    if owner_or_admin: _rerun()
+    else: _rerun_section(rid)
+
 # 색약 친화 팔레트 + 심볼
 COLOR = {
-    "off":  {"bg":"#000000","fg":"#FFFFFF","label":"불가(0.0)"},
-    "eve":  {"bg":"#56B4E9","fg":"#FFFFFF","label":"3시간 이상 / 잘 모르겠다(0.4)"},
-    "pm":   {"bg":"#009E73","fg":"#FFFFFF","label":"5시간 이상(0.5)"},
-    "am":   {"bg":"#E69F00","fg":"#000000","label":"7시간 이상(0.7)"},
-    "full": {"bg":"#CC79A7","fg":"#FFFFFF","label":"하루종일(1.0)"},
+    "off":  {"bg":"#000000","fg":"#FFFFFF"},
+    "eve":  {"bg":"#56B4E9","fg":"#FFFFFF"},
+    "pm":   {"bg":"#009E73","fg":"#FFFFFF"},
+    "am":   {"bg":"#E69F00","fg":"#000000"},
+    "full": {"bg":"#CC79A7","fg":"#FFFFFF"},
 }
 STATUS_SYMBOL  = {"off":"×","eve":"3","pm":"5","am":"7","full":"F"}
 STATUS_KO      = {"off":"불가","eve":"3시간/모름","pm":"5시간","am":"7시간","full":"하루종일"}
+STATUS_TEXT    = {"off":"불가","eve":"3시간 이상 / 잘 모르겠다","pm":"5시간 이상","am":"7시간 이상","full":"하루종일"}
+
+def status_label(s, weights):
+    """'7시간 이상(0.7)' — 가중치는 방 설정(snap.weights)에서"""
+    w = f"{float(weights.get(s, 0.0)):.2f}".rstrip("0")
+    return f"{STATUS_TEXT[s]}({w}0)" if w.endswith(".") else f"{STATUS_TEXT[s]}({w})"
 def level_rank(s): return {"off":0,"eve":1,"pm":2,"am":3,"full":4}.get(s,0)
 
 def chip(txt):
     return f'<span style="background:#f5f5f5;border:1px solid #ddd;padding:2px 8px;border-radius:999px;margin-right:6px;display:inline-block">{txt}</span>'
 
-def legend():
+def legend(weights):
     st.markdown("""
 <style>
 .badge{padding:6px 10px;border-radius:999px;margin-right:6px;display:inline-block;font-weight:700}
 </style>
-    """, unsafe_allow_html=True)
+    """ + _matrix_css(), unsafe_allow_html=True)
     for s in ["off","eve","pm","am","full"]:
         c = COLOR[s]
         st.markdown(
-            f'<span class="badge" style="background:{c["bg"]};color:{c["fg"]}">{STATUS_SYMBOL[s]} · {c["label"]}</span>',
+            f'<span class="badge" style="background:{c["bg"]};color:{c["fg"]}">{STATUS_SYMBOL[s]} · {status_label(s, weights)}</span>',
             unsafe_allow_html=True
         )
     st.caption("심볼: F=하루종일, 7=7시간, 5=5시간, 3=3시간/모름, ×=불가")
 
 # -------- 매트릭스 --------
-def build_person_day_map(days_seq, names_by_day):
-    persons=set()
-    for d in days_seq:
-        for s in ("full","am","pm","eve"):
-            for n in names_by_day.get(d,{}).get(s, []):
-                persons.add(n)
-    persons=sorted(persons, key=lambda x:x.lower())
-    pmap={n:{} for n in persons}
-    for d in days_seq:
-        for s in ("full","am","pm","eve"):
-            for n in names_by_day.get(d,{}).get(s, []):
-                pmap[n][d]=s
-        for n in persons:
-            pmap[n].setdefault(d,"off")
-    return persons, pmap
-
-def render_availability_matrix(days_seq, names_by_day, title=None, note=None, max_rows=None):
-    persons, pmap = build_person_day_map(days_seq, names_by_day)
-    if max_rows: persons = persons[:max_rows]
-    header = "".join(
-        f'<th style="position:sticky;top:0;background:#fff;border-bottom:1px solid #eee;'
-        f'font-weight:600;font-size:12px;padding:6px 4px;text-align:center">{d[5:]}</th>'
-        for d in days_seq
+# 사람×날짜 매트릭스는 snap.agg.person_day (uint8 코드 행렬)에서 바로 그린다.
+# 칸 스타일은 CSS 클래스(s0~s4)로, 큰 표는 행/열 페이지로 나눠 그리고
+# 만든 HTML 은 (room, version, 구간, 페이지) 단위로, 구간의 행 목록은 (room, version, 구간) 단위로 캐시한다.
+MATRIX_PAGE_ROWS = 30
+MATRIX_PAGE_COLS = 31
+_CELL = [(f'<td class="s{i}" title="{{}} · {{}} · {STATUS_KO[s]}">', f'{STATUS_SYMBOL[s]}</td>')
+         for i, s in enumerate(STATUSES)]
+
+def _matrix_css():
+    rules = "".join(f".pdm td.s{i}{{background:{COLOR[s]['bg']};color:{COLOR[s]['fg']}}}" for i, s in enumerate(STATUSES))
+    return ("<style>"
+            ".pdm{overflow:auto;border:1px solid #eee;border-radius:10px}"
+            ".pdm table{border-collapse:separate;border-spacing:3px 2px;min-width:100%}"
+            ".pdm th{position:sticky;top:0;background:#fff;border-bottom:1px solid #eee;font-weight:600;font-size:12px;padding:6px 4px;text-align:center}"
+            ".pdm .n{position:sticky;left:0;background:#fff;font-size:13px;padding:4px 8px;border-right:1px solid #eee;white-space:nowrap;text-align:left;font-weight:400}"
+            ".pdm th.n{z-index:2;font-weight:600}"
+            ".pdm td{width:24px;height:18px;border-radius:5px;text-align:center;font-weight:800;font-size:12px}"
+            f"{rules}</style>")
+
+@st.cache_resource
+def _matrix_html_cache():
+    return LRUCache(maxsize=256)
+
+def _matrix_rows(snap, i, j):
+    """구간 [i, j] 에 한 번이라도 가능한 사람들의 (행 인덱스, 이름) 튜플 (이름순)"""
+    def compute():
+        agg = snap.agg
+        active = np.flatnonzero((agg.person_day[:, i:j+1] > 0).any(axis=1))
+        names = [snap.user_names.get(agg.user_ids[r], "?") for r in active.tolist()]
+        order = sorted(range(len(names)), key=lambda k: names[k].lower())
+        return tuple(active[k] for k in order), tuple(names[k] for k in order)
+    return _matrix_html_cache().get_or_compute(("rows", snap.room["id"], snap.room["version"], i, j), compute)
+
+def _matrix_html(snap, i, j, row_page, title, note, max_rows):
+    rows, names = _matrix_rows(snap, i, j)
+    if max_rows: rows, names = rows[:max_rows], names[:max_rows]
+    r0 = row_page * MATRIX_PAGE_ROWS
+    rows, names = rows[r0:r0+MATRIX_PAGE_ROWS], names[r0:r0+MATRIX_PAGE_ROWS]
+    days = snap.days[i:j+1]
+    header = "".join(f'<th title="{d}">{d[5:]}</th>' for d in days)
+    M = snap.agg.person_day
+    def row(r, n):
+        n = html.escape(n)
+        cells = "".join(_CELL[c][0].format(n, d) + _CELL[c][1] for c, d in zip(M[r, i:j+1].tolist(), days))
+        return f'<tr><td class="n">{n}</td>{cells}</tr>'
+    body = "".join(row(r, n) for r, n in zip(rows, names))
+    return (
+        '<div style="margin-top:6px;margin-bottom:10px">'
+        + (f'<div style="font-weight:700;margin-bottom:4px">{title}</div>' if title else '')
+        + f'<div class="pdm"><table><thead><tr><th class="n">이름</th>{header}</tr></thead>'
+        + f'<tbody>{body or "<tr><td class=n>데이터 없음</td></tr>"}</tbody></table></div>'
+        + (f'<div style="color:#666;font-size:12px;margin-top:6px">{note}</div>' if note else '')
+        + '</div>'
     )
-    rows=[]
-    for n in persons:
-        cells=[]
-        for d in days_seq:
-            s = pmap[n][d]; c = COLOR[s]
-            sym = STATUS_SYMBOL[s]
-            tip = f"{n} · {d} · {STATUS_KO[s]}"
-            cells.append(
-                f'<td title="{tip}" style="text-align:center;padding:2px 3px;">'
-                f'<div style="width:24px;height:18px;border-radius:5px;background:{c["bg"]};color:{c["fg"]};'
-                f'display:flex;align-items:center;justify-content:center;font-weight:800;font-size:12px">{sym}</div>'
-                f'</td>'
-            )
-        rows.append(
-            f'<tr>'
-            f'<td style="position:sticky;left:0;background:#fff;font-size:13px;padding:4px 8px;'
-            f'border-right:1px solid #eee;white-space:nowrap">{n}</td>'
-            f'{"".join(cells)}'
-            f'</tr>'
-        )
-    html = f"""
-<div style="margin-top:6px;margin-bottom:10px">
-  {f'<div style="font-weight:700;margin-bottom:4px">{title}</div>' if title else ''}
-  <div style="overflow:auto;border:1px solid #eee;border-radius:10px">
-    <table style="border-collapse:separate;border-spacing:0;min-width:100%">
-      <thead><tr>
-        <th style="position:sticky;left:0;z-index:2;background:#fff;border-bottom:1px solid #eee;padding:6px 8px;text-align:left">이름</th>
-        {header}
-      </tr></thead>
-      <tbody>
-        {"".join(rows) or '<tr><td style="padding:8px">데이터 없음</td></tr>'}
-      </tbody>
-    </table>
-  </div>
-  {f'<div style="color:#666;font-size:12px;margin-top:6px">{note}</div>' if note else ''}
-</div>
-"""
-    st.markdown(html, unsafe_allow_html=True)
+
+def render_availability_matrix(snap, i, j, title=None, note=None, max_rows=None, key="pdm"):
+    """snap.days[i..j] 구간의 사람×날짜 매트릭스. 행/열이 많으면 페이지 선택 위젯을 띄운다."""
+    n_rows = len(_matrix_rows(snap, i, j)[0])
+    if max_rows: n_rows = min(n_rows, max_rows)
+    row_page = 0
+    if n_rows > MATRIX_PAGE_ROWS:
+        pages = (n_rows + MATRIX_PAGE_ROWS - 1) // MATRIX_PAGE_ROWS
+        row_page = st.selectbox("멤버 페이지", range(pages), key=f"{key}_rp",
+                                format_func=lambda p: f"{p*MATRIX_PAGE_ROWS+1}–{min(n_rows,(p+1)*MATRIX_PAGE_ROWS)}번째")
+    if j - i + 1 > MATRIX_PAGE_COLS:
+        starts = list(range(i, j+1, MATRIX_PAGE_COLS))
+        c0 = st.selectbox("기간 페이지", starts, key=f"{key}_cp",
+                          format_func=lambda c: f"{snap.days[c]} ~ {snap.days[min(j, c+MATRIX_PAGE_COLS-1)]}")
+        i, j = c0, min(j, c0 + MATRIX_PAGE_COLS - 1)
+    ck = ("html", snap.room["id"], snap.room["version"], i, j, row_page, title, note, max_rows)
+    out = _matrix_html_cache().get_or_compute(ck, lambda: _matrix_html(snap, i, j, row_page, title, note, max_rows))
+    st.markdown(out, unsafe_allow_html=True)
 
 # ===== 겹치거나 인접(하루 차이) 구간 병합 =====
 def merge_overlapping_windows(raw_top, agg_by_day, quorum: int):
@@ -142,11 +215,17 @@ def merge_overlapping_windows(raw_top, agg_by_day, quorum: int):
     out = []
     for m in merged:
         days_sorted = sorted(list(m["days"]))
-        score = sum(agg_by_day[d]["score"] for d in days_sorted)
-        feasible = all(
-            (agg_by_day[d]["full"] + agg_by_day[d]["am"] + agg_by_day[d]["pm"] + agg_by_day[d]["eve"]) >= quorum
-            for d in days_sorted
-        )
+        if isinstance(agg_by_day, DayAggregate):
+            # 병합 구간은 항상 연속 → prefix sum 으로 바로 계산
+            i, j = agg_by_day.index(days_sorted[0]), agg_by_day.index(days_sorted[-1])
+            score = agg_by_day.span_score(i, j)
+            feasible = agg_by_day.span_feasible(i, j, quorum)
+        else:
+            score = sum(agg_by_day[d]["score"] for d in days_sorted)
+            feasible = all(
+                (agg_by_day[d]["full"] + agg_by_day[d]["am"] + agg_by_day[d]["pm"] + agg_by_day[d]["eve"]) >= quorum
+                for d in days_sorted
+            )
         out.append({"days": days_sorted, "score": score, "feasible": feasible})
     out.sort(key=lambda w: (-w["score"], w["days"][0]))
     return out
@@ -223,12 +302,56 @@ def _row_get(row, key, default=None):
     return default
 
 # ===== 지출 목록/통계 (안전 버전) =====
-import matplotlib.pyplot as plt
+# 그래프: vega(기본, 브라우저가 그리는 JSON 스펙) | matplotlib(PNG, 서버에서 래스터화)
+CHART_BACKEND = os.environ.get("PLANNER_CHART_BACKEND", "vega").lower()
+
+@st.cache_resource
+def _chart_cache():
+    return LRUCache(maxsize=256)
+
+def _vega_charts(data):
+    by_day = [{"날짜": d, "금액": a} for d, a in data["by_day"]]
+    by_cat = [{"카테고리": c, "금액": a} for c, a in data["by_category"]]
+    bar = {"data": {"values": by_day}, "mark": "bar", "height": 260,
+           "encoding": {"x": {"field": "날짜", "type": "ordinal", "axis": {"labelAngle": -45}},
+                        "y": {"field": "금액", "type": "quantitative", "title": "금액(원)"},
+                        "tooltip": [{"field": "날짜"}, {"field": "금액", "format": ",.0f"}]}}
+    pie = {"data": {"values": by_cat}, "mark": {"type": "arc", "tooltip": True}, "height": 260,
+           "encoding": {"theta": {"field": "금액", "type": "quantitative", "stack": "normalize"},
+                        "color": {"field": "카테고리", "type": "nominal", "sort": None}}}
+    return bar, pie
+
+def _png(fig):
+    buf = io.BytesIO(); fig.savefig(buf, format="png", dpi=100); return buf.getvalue()
+
+def _matplotlib_charts(data):
+    days, day_amt = zip(*data["by_day"]); cats, cat_amt = zip(*data["by_category"])
+    fig1 = Figure(figsize=(5.5, 3)); ax1 = fig1.subplots()
+    ax1.bar(days, day_amt); ax1.set_xlabel("날짜"); ax1.set_ylabel("금액(원)")
+    ax1.tick_params(axis="x", rotation=45); fig1.tight_layout()
+    fig2 = Figure(figsize=(5, 3.5)); ax2 = fig2.subplots()
+    ax2.pie(cat_amt, labels=cats, autopct="%1.0f%%", startangle=90); ax2.axis("equal"); fig2.tight_layout()
+    return _png(fig1), _png(fig2)
+
+def render_expense_charts(room_id: str):
+    """날짜별/카테고리별 합계 그래프. 집계는 SQL, 그린 결과는 (방, 지출 version, backend) 로 캐시."""
+    data = DB.expense_chart_data(room_id)
+    if not data["by_day"]:
+        st.info("금액이 0원인 항목만 있어 그래프를 생략합니다."); return
+    backend = CHART_BACKEND if (CHART_BACKEND != "matplotlib" or Figure is not None) else "vega"
+    make = _matplotlib_charts if backend == "matplotlib" else _vega_charts
+    day_chart, cat_chart = _chart_cache().get_or_compute((room_id, data["version"], backend), lambda: make(data))
+    show = st.image if backend == "matplotlib" else (lambda spec: st.vega_lite_chart(spec, use_container_width=True))
+    c1, c2 = st.columns(2)
+    with c1:
+        st.markdown("**날짜별 지출 합계**"); show(day_chart)
+    with c2:
+        st.markdown("**카테고리별 지출 비중**"); show(cat_chart)
 
-def render_expenses(room_id: str, members):
+def render_expenses(room_id: str, exps):
     st.subheader("지출 목록 / 통계")
 
-    exps = DB.list_expenses(room_id) or []
+    exps = exps or []
 
     # 아무것도 없으면 바로 안내만 보여주고 끝
     if not exps:
@@ -279,41 +402,12 @@ def render_expenses(room_id: str, members):
     if st.button("지출 삭제", key="exp_del_btn_list") and del_id > 0:
         DB.delete_expense(int(del_id), room_id)
         st.success("삭제됨")
-        _rerun()
-
-    # ----- 통계 (데이터 있을 때만 그림) -----
-    df_ok = df_exp_raw[df_exp_raw["금액"] > 0]
-    if df_ok.empty:
-        st.info("금액이 0원인 항목만 있어 그래프를 생략합니다.")
-        return
-
-    # 날짜별 합계
-    by_day = df_ok.groupby("날짜", as_index=False)["금액"].sum().sort_values("날짜")
-    # 카테고리별 합계
-    by_cat = df_ok.groupby("카테고리", as_index=False)["금액"].sum().sort_values("금액", ascending=False)
-
-    c1, c2 = st.columns(2)
+        _rerun_section(room_id)
 
-    with c1:
-        st.markdown("**날짜별 지출 합계**")
-        fig1, ax1 = plt.subplots(figsize=(5.5, 3))
-        ax1.bar(by_day["날짜"], by_day["금액"])
-        ax1.set_xlabel("날짜")
-        ax1.set_ylabel("금액(원)")
-        ax1.tick_params(axis="x", rotation=45)
-        fig1.tight_layout()
-        st.pyplot(fig1)
-        plt.close(fig1)
+    # ----- 통계: 켰을 때만 집계/렌더 -----
+    if st.toggle("📊 지출 그래프 보기", value=False, key="exp_charts"):
+        render_expense_charts(room_id)
 
-    with c2:
-        st.markdown("**카테고리별 지출 비중**")
-        fig2, ax2 = plt.subplots(figsize=(5, 3.5))
-        ax2.pie(by_cat["금액"], labels=by_cat["카테고리"], autopct="%1.0f%%", startangle=90)
-        ax2.axis("equal")
-        fig2.tight_layout()
-        st.pyplot(fig2)
-        plt.close(fig2)
-        
 # ---------------- Dashboard ----------------
 def dashboard():
     require_login()
@@ -366,18 +460,21 @@ def room_page():
     if not rid:
         st.session_state["page"] = "dashboard"; _rerun(); return
 
-    room, members = DB.get_room(rid)
-    if not room:
+    snap = DB.load_room_snapshot(rid, st.session_state["user_id"])
+    if not snap:
         st.error("방이 존재하지 않습니다.")
         st.session_state["page"] = "dashboard"
         st.session_state.pop("room_id", None)
         _rerun(); return
+    room, members = snap.room, snap.members
+    live_refresh(rid, room["version"])
+    st.session_state["_room_snap"] = {"snap": snap, "fresh": set(DB.SNAPSHOT_SECTIONS)}
 
     st.session_state["room_start"] = room["start"]
     st.session_state["room_end"]   = room["end"]
 
     is_owner = (room["owner_id"] == st.session_state["user_id"])
-    is_admin = DB.is_site_admin(st.session_state["user_id"])
+    is_admin = snap.is_admin
     owner_or_admin = is_owner or is_admin
 
     st.header(f"방: {room['title']} ({rid})")
@@ -390,86 +487,11 @@ def room_page():
             unsafe_allow_html=True
         )
 
-    legend()
+    legend(snap.weights)
 
     # ----- 사이드바: 공지 & 투표 -----
     with st.sidebar:
-        st.header("🗞 공지 & 🗳 투표")
-
-        st.subheader("📌 공지사항")
-        anns = DB.list_announcements(rid)
-        pinned = [a for a in anns if a["pinned"]]
-        for a in pinned[:2]:
-            st.info(f"**{a['title']}**\n\n{a['body']}")
-        with st.expander("전체 공지 보기", expanded=False):
-            for a in anns:
-                st.markdown(f"**{a['title']}**  · {a['created_at'][:16].replace('T',' ')}")
-                st.caption(a["body"])
-                if owner_or_admin:
-                    c1,c2 = st.columns(2)
-                    with c1:
-                        if st.button(("고정 해제" if a["pinned"] else "고정"), key=f"pin_{a['id']}"):
-                            DB.toggle_pin_announcement(a["id"], rid, room["owner_id"]); _rerun()
-                    with c2:
-                        if st.button("삭제", key=f"delann_{a['id']}"):
-                            DB.delete_announcement(a["id"], rid, room["owner_id"]); _rerun()
-                st.markdown("---")
-
-        # 멤버 누구나 새 공지 작성 가능
-        st.caption("새 공지")
-        ann_title = st.text_input("제목", key="ann_title_sb")
-        ann_body  = st.text_area("내용", key="ann_body_sb")
-        ann_pin   = st.checkbox("고정(방장/관리자만 반영)", value=False, key="ann_pin_sb")
-        if st.button("등록", key="ann_add_sb"):
-            if ann_title.strip():
-                # pin은 방장/관리자만 실제 반영
-                pin_val = (1 if ann_pin and owner_or_admin else 0)
-                DB.add_announcement(rid, ann_title.strip(), ann_body.strip(), pin_val, st.session_state["user_id"])
-                st.success("등록됨"); _rerun()
-            else:
-                st.error("제목은 필수예요.")
-        st.markdown("---")
-
-        st.subheader("🗳 투표")
-        polls = DB.list_polls(rid)
-        if not polls:
-            st.caption("진행 중 투표 없음")
-        else:
-            for p in polls:
-                st.markdown(f"**{p['question']}**" + (f" · 마감 {p['closes_at'][:16].replace('T',' ')}" if p["closes_at"] else ""))
-                opts = DB.list_poll_options(p["id"])
-                my_votes = set(DB.get_user_votes(p["id"], st.session_state["user_id"]))
-                if p["is_multi"]:
-                    picked = st.multiselect("선택", [o["id"] for o in opts], default=list(my_votes),
-                                            format_func=lambda oid: next(o["text"] for o in opts if o["id"]==oid), key=f"pv_{p['id']}")
-                else:
-                    all_ids = [o["id"] for o in opts]
-                    idx = all_ids.index(next(iter(my_votes))) if my_votes else 0
-                    picked = st.radio("선택", all_ids, index=idx,
-                                      format_func=lambda oid: next(o["text"] for o in opts if o["id"]==oid), key=f"pv_{p['id']}")
-                    picked = [picked]
-                if st.button("투표/변경", key=f"vote_{p['id']}"):
-                    DB.cast_vote(p["id"], picked, st.session_state["user_id"], bool(p["is_multi"]))
-                    st.success("반영됨"); _rerun()
-                counts, total = DB.tally_poll(p["id"])
-                for o in opts:
-                    c = counts.get(o["id"], 0); ratio = (c/total*100) if total else 0
-                    st.progress(min(1.0, ratio/100.0), text=f"{o['text']} · {c}표 ({ratio:0.0f}%)")
-                st.markdown("---")
-        # 멤버 누구나 생성
-        with st.expander("새 투표 만들기", expanded=False):
-            q = st.text_input("질문", key="newpoll_q")
-            raw_opts = st.text_area("보기들(줄바꿈)", key="newpoll_opts")
-            multi = st.checkbox("다중 선택", value=False, key="newpoll_multi")
-            closes = st.date_input("마감일(선택)", value=None, key="newpoll_date")
-            if st.button("투표 생성", key="newpoll_make"):
-                options = [s.strip() for s in (raw_opts or "").splitlines() if s.strip()]
-                closes_at = (dt.datetime.combine(closes, dt.time(23,59)).isoformat() if closes else None)
-                if q.strip() and options:
-                    DB.create_poll(rid, q.strip(), int(multi), options, closes_at, st.session_state["user_id"])
-                    st.success("투표 생성!"); _rerun()
-                else:
-                    st.error("질문과 보기 필요")
+        board_section(rid, room["owner_id"], owner_or_admin)
 
     # ---- 방 관리 ---- (방장/관리자)
     if owner_or_admin:
@@ -488,6 +510,23 @@ def room_page():
             with c9:  wpm = st.number_input("가중치: 5시간 이상", 0.0, 1.0, float(room["w_pm"]), 0.1)
             with c10: wev = st.number_input("가중치: 3시간 이상/모름", 0.0, 1.0, float(room["w_eve"]), 0.1)
 
+            # 저장 전에 바뀐 설정으로 추천이 어떻게 달라지는지 바로 비교 (what_if: 카운트 행렬 재사용, 한 번에 계산)
+            new_w = {"full": wfull, "am": wam, "pm": wpm, "eve": wev, "off": 0.0}
+            new_md, new_q = int(min_days), int(quorum)
+            old_md, old_q = int(room["min_days"]), int(room["quorum"])
+            if new_w != dict(snap.weights) or (new_md, new_q) != (old_md, old_q):
+                if (new_md, new_q) == (old_md, old_q):
+                    saved, edited_res = snap.agg.what_if([dict(snap.weights), new_w], old_md, old_q)
+                else:
+                    saved = snap.agg.what_if([dict(snap.weights)], old_md, old_q)[0]
+                    edited_res = snap.agg.what_if([new_w], new_md, new_q)[0]
+                st.markdown("**저장 전 비교: 추천 상위 3개**")
+                st.dataframe(pd.DataFrame([
+                    {"설정": name, "순위": i, "구간": f'{w["days"][0]} ~ {w["days"][-1]}',
+                     "점수": w["score"], "쿼럼": "✅" if w["feasible"] else "❌"}
+                    for name, wins in (("저장된 설정", saved), ("입력값", edited_res)) for i, w in enumerate(wins, 1)
+                ]), hide_index=True, use_container_width=True)
+
             b1, b2, b3, b4 = st.columns(4)
             with b1:
                 if st.button("설정 저장", key="owner_save"):
@@ -556,331 +595,442 @@ def room_page():
     st.markdown("---")
     tab_time, tab_plan, tab_cost = st.tabs(["⏰ 시간/약속", "🗺️ 계획 & 동선 / 예산", "💳 정산"])
 
-    # ========== ⏰ 시간/약속 ==========
-    with tab_time:
-        st.subheader("내 달력 입력")
-        my_av = DB.get_my_availability(st.session_state["user_id"], rid)
-
-        days = []
-        d0 = dt.date.fromisoformat(room["start"]); d1 = dt.date.fromisoformat(room["end"])
-        cur = d0
-        while cur <= d1:
-            ds = cur.isoformat()
-            days.append({"날짜": ds, "상태": my_av.get(ds, "off")})
-            cur += dt.timedelta(days=1)
-        df = pd.DataFrame(days)
-
-        label_map = {
-            "off":  "불가(0.0)",
-            "am":   "7시간 이상(0.7)",
-            "pm":   "5시간 이상(0.5)",
-            "eve":  "3시간 이상 / 잘 모르겠다(0.4)",
-            "full": "하루종일(1.0)"
+    # 각 탭은 fragment: 탭 안의 버튼은 그 탭만 다시 그린다
+    with tab_time: time_section(rid, is_owner, owner_or_admin)
+    with tab_plan: plan_section(rid)
+    with tab_cost: cost_section(rid)
+
+# ---------------- Room sections (fragment) ----------------
+@st.fragment
+def board_section(rid, owner_id, owner_or_admin):
+    snap = _section_snap(rid, "board")
+    st.header("🗞 공지 & 🗳 투표")
+
+    st.subheader("📌 공지사항")
+    anns = snap.announcements
+    pinned = [a for a in anns if a["pinned"]]
+    for a in pinned[:2]:
+        st.info(f"**{a['title']}**\n\n{a['body']}")
+    with st.expander("전체 공지 보기", expanded=False):
+        for a in anns:
+            st.markdown(f"**{a['title']}**  · {a['created_at'][:16].replace('T',' ')}")
+            st.caption(a["body"])
+            if owner_or_admin:
+                c1,c2 = st.columns(2)
+                with c1:
+                    if st.button(("고정 해제" if a["pinned"] else "고정"), key=f"pin_{a['id']}"):
+                        DB.toggle_pin_announcement(a["id"], rid, owner_id); _rerun_section(rid)
+                with c2:
+                    if st.button("삭제", key=f"delann_{a['id']}"):
+                        DB.delete_announcement(a["id"], rid, owner_id); _rerun_section(rid)
+            st.markdown("---")
+
+    # 멤버 누구나 새 공지 작성 가능
+    st.caption("새 공지")
+    ann_title = st.text_input("제목", key="ann_title_sb")
+    ann_body  = st.text_area("내용", key="ann_body_sb")
+    ann_pin   = st.checkbox("고정(방장/관리자만 반영)", value=False, key="ann_pin_sb")
+    if st.button("등록", key="ann_add_sb"):
+        if ann_title.strip():
+            # pin은 방장/관리자만 실제 반영
+            pin_val = (1 if ann_pin and owner_or_admin else 0)
+            DB.add_announcement(rid, ann_title.strip(), ann_body.strip(), pin_val, st.session_state["user_id"])
+            st.success("등록됨"); _rerun_section(rid)
+        else:
+            st.error("제목은 필수예요.")
+    st.markdown("---")
+
+    st.subheader("🗳 투표")
+    polls = snap.polls
+    if not polls:
+        st.caption("진행 중 투표 없음")
+    else:
+        for p in polls:
+            st.markdown(f"**{p['question']}**" + (f" · 마감 {p['closes_at'][:16].replace('T',' ')}" if p["closes_at"] else ""))
+            opts = p["options"]
+            my_votes = p["my_votes"]
+            all_ids = [o["id"] for o in opts]
+            if p["is_multi"]:
+                picked = st.multiselect("선택", all_ids, default=[o for o in all_ids if o in my_votes],
+                                        format_func=p["option_text"].get, key=f"pv_{p['id']}")
+            else:
+                idx = all_ids.index(next(iter(my_votes))) if my_votes else 0
+                picked = st.radio("선택", all_ids, index=idx,
+                                  format_func=p["option_text"].get, key=f"pv_{p['id']}")
+                picked = [picked]
+            if st.button("투표/변경", key=f"vote_{p['id']}"):
+                DB.cast_vote(p["id"], picked, st.session_state["user_id"], bool(p["is_multi"]))
+                st.success("반영됨"); _rerun_section(rid)
+            counts, total = p["counts"], p["total"]
+            for o in opts:
+                c = counts.get(o["id"], 0); ratio = (c/total*100) if total else 0
+                st.progress(min(1.0, ratio/100.0), text=f"{o['text']} · {c}표 ({ratio:0.0f}%)")
+            st.markdown("---")
+    # 멤버 누구나 생성
+    with st.expander("새 투표 만들기", expanded=False):
+        q = st.text_input("질문", key="newpoll_q")
+        raw_opts = st.text_area("보기들(줄바꿈)", key="newpoll_opts")
+        multi = st.checkbox("다중 선택", value=False, key="newpoll_multi")
+        closes = st.date_input("마감일(선택)", value=None, key="newpoll_date")
+        if st.button("투표 생성", key="newpoll_make"):
+            options = [s.strip() for s in (raw_opts or "").splitlines() if s.strip()]
+            closes_at = (dt.datetime.combine(closes, dt.time(23,59)).isoformat() if closes else None)
+            if q.strip() and options:
+                DB.create_poll(rid, q.strip(), int(multi), options, closes_at, st.session_state["user_id"])
+                st.success("투표 생성!"); _rerun_section(rid)
+            else:
+                st.error("질문과 보기 필요")
+
+# ========== ⏰ 시간/약속 ==========
+@st.fragment
+def time_section(rid, is_owner, owner_or_admin):
+    snap = _section_snap(rid, "time")
+    room, members = snap.room, snap.members
+    st.subheader("내 달력 입력")
+    _show_flash("time")
+    my_av = snap.my_availability
+
+    days = []
+    d0 = dt.date.fromisoformat(room["start"]); d1 = dt.date.fromisoformat(room["end"])
+    cur = d0
+    while cur <= d1:
+        ds = cur.isoformat()
+        days.append({"날짜": ds, "상태": my_av.get(ds, "off")})
+        cur += dt.timedelta(days=1)
+    df = pd.DataFrame(days)
+
+    label_map = {k: status_label(k, snap.weights) for k in ("off","am","pm","eve","full")}
+    # 가중치 부분은 떼고 본다 (편집 중에 방장이 가중치를 바꿔도 옛 라벨이 그대로 풀리게)
+    inv_label = {STATUS_TEXT[k]: k for k in label_map}
+    df["상태(선택)"] = [label_map.get(v, label_map["off"]) for v in df["상태"]]
+
+    edited = st.data_editor(
+        df[["날짜","상태(선택)"]],
+        hide_index=True,
+        column_config={
+            "날짜": st.column_config.TextColumn(disabled=True),
+            "상태(선택)": st.column_config.SelectboxColumn(options=list(label_map.values()))
+        },
+        use_container_width=True,
+        key="time_editor"
+    )
+    # 저장된 값(없으면 off)과 달라진 칸만 보낸다
+    delta = {
+        d: inv_label[lbl.rsplit("(", 1)[0]] for d, lbl in zip(edited["날짜"], edited["상태(선택)"])
+        if inv_label[lbl.rsplit("(", 1)[0]] != my_av.get(d, "off")
+    }
+
+    c1,c2,c3 = st.columns(3)
+    with c1:
+        if st.button("저장", key="time_save"):
+            n = DB.apply_availability_delta(st.session_state["user_id"], rid, delta, submitted=False)
+            _flash("time", f"저장 완료(미제출) · 변경 {n}일"); _rerun_submitted(rid, owner_or_admin)
+    with c2:
+        if st.button("제출(Submit)", key="time_submit"):
+            n = DB.apply_availability_delta(st.session_state["user_id"], rid, delta, submitted=True)
+            _flash("time", f"제출 완료 · 변경 {n}일"); _rerun_submitted(rid, owner_or_admin)
+    with c3:
+        if st.button("내 입력 삭제", key="time_clear"):
+            DB.clear_my_availability(st.session_state["user_id"], rid, submitted=False)
+            _flash("time", "입력을 비웠습니다."); _rerun_submitted(rid, owner_or_admin)
+
+    st.markdown("#### 제출 현황")
+    submitted = [ (m["nickname"] or m["name"]) for m in members if m["submitted"]]
+    pending   = [ (m["nickname"] or m["name"]) for m in members if not m["submitted"]]
+    pill = lambda t: f'<span style="background:#eee;padding:4px 8px;border-radius:999px;margin-right:6px">{t}</span>'
+    st.markdown("**제출 완료:** " + (" ".join(pill(n) for n in submitted) or "없음"), unsafe_allow_html=True)
+    st.markdown("**제출 대기:** " + (" ".join(pill(n) for n in pending) or "없음"), unsafe_allow_html=True)
+
+    st.markdown("---")
+    st.subheader("집계 및 추천")
+
+    room_row, days_list, agg, weights = room, list(snap.days), snap.agg, snap.weights
+    names_by_day = snap.names_by_day
+
+    df_agg = pd.DataFrame([
+        {
+            "date": d,
+            "full": agg[d]["full"], "am": agg[d]["am"], "pm": agg[d]["pm"], "eve": agg[d]["eve"],
+            "score": round(agg[d]["score"],2),
+            "quorum_ok": "✅" if (agg[d]["full"]+agg[d]["am"]+agg[d]["pm"]+agg[d]["eve"])>=room_row["quorum"] else "❌",
+            "FULL(이름)": ", ".join(names_by_day.get(d, {}).get("full", [])),
+            "AM(이름)":   ", ".join(names_by_day.get(d, {}).get("am", [])),
+            "PM(이름)":   ", ".join(names_by_day.get(d, {}).get("pm", [])),
+            "EVE(이름)":  ", ".join(names_by_day.get(d, {}).get("eve", [])),
         }
-        inv_label = {v:k for k,v in label_map.items()}
-        df["상태(선택)"] = [label_map.get(v, "불가(0.0)") for v in df["상태"]]
-
-        edited = st.data_editor(
-            df[["날짜","상태(선택)"]],
-            hide_index=True,
-            column_config={
-                "날짜": st.column_config.TextColumn(disabled=True),
-                "상태(선택)": st.column_config.SelectboxColumn(options=list(label_map.values()))
-            },
-            use_container_width=True,
-            key="time_editor"
-        )
-        edited["상태"] = [inv_label[x] for x in edited["상태(선택)"]]
-        payload = {row["날짜"]: row["상태"] for _, row in edited.iterrows()}
+        for d in days_list
+    ])
+    st.dataframe(df_agg, use_container_width=True, hide_index=True)
+
+    st.markdown("#### 날짜별 가능 멤버(뱃지)")
+    pick_for_names = st.selectbox("날짜 선택", days_list, index=0, key="names_day_pick")
+    nb = names_by_day.get(pick_for_names, {})
+    for label, key in [("하루종일","full"),("7시간","am"),("5시간","pm"),("3시간/모름","eve")]:
+        chips = " ".join(chip(n) for n in nb.get(key, [])) or "(없음)"
+        st.markdown(f"**{label}** · {chips}", unsafe_allow_html=True)
+
+    raw_top = best_windows(days_list, agg, int(room_row["min_days"]), int(room_row["quorum"]))
+    if raw_top:
+        merged_top = merge_overlapping_windows(raw_top, agg, int(room_row["quorum"]))
+        st.markdown("### ⭐ 추천 Top‑7 (겹치거나 붙는 구간은 하나로 합침)")
+        def render_win_summary(days_seq, score, feasible, show_select_button=False, small=False):
+            feas = "충족" if feasible else "⚠️ 최소 인원 미충족 포함"
+            if show_select_button:
+                colL, colR = st.columns([5,2])
+                with colL:
+                    st.write(f"**{days_seq[0]} ~ {days_seq[-1]} | 점수 {score:.2f} | {feas}**")
+                with colR:
+                    if st.button("이 구간 최종 선택", key=f"choose_{days_seq[0]}_{days_seq[-1]}"):
+                        if is_owner:
+                            DB.set_final_window(rid, room["owner_id"], days_seq[0], days_seq[-1])
+                        else:
+                            DB.set_final_window_admin(rid, days_seq[0], days_seq[-1])
+                        st.success("최종 일정으로 저장했습니다."); _rerun()   # 상단 확정 배너까지 바뀜 → 전체
+            else:
+                st.write(f"**{days_seq[0]} ~ {days_seq[-1]} | 점수 {score:.2f} | {feas}**")
+
+            # 구간 내 가능 일수 / 가장 낮은 가능 수준을 매트릭스에서 바로 계산
+            i0, i1 = snap.agg.index(days_seq[0]), snap.agg.index(days_seq[-1])
+            K = i1 - i0 + 1
+            rows_idx, row_names = _matrix_rows(snap, i0, i1)
+            sub = snap.agg.person_day[rows_idx, i0:i1+1] if rows_idx else np.zeros((0, K), dtype=np.uint8)
+            cnt = (sub > 0).sum(axis=1).tolist()
+            lowest = np.where(sub > 0, sub, 9).min(axis=1).tolist()
+            full_ok = [ (n, STATUSES[lo]) for n, c, lo in zip(row_names, cnt, lowest) if c == K ]
+            part_ok = [ (n, STATUSES[lo], c) for n, c, lo in zip(row_names, cnt, lowest) if 0 < c < K ]
+            full_ok.sort(key=lambda x: (-level_rank(x[1]), x[0].lower()))
+            part_ok.sort(key=lambda x: (-x[2], -level_rank(x[1]), x[0].lower()))
+            level_label={"full":"하루종일","am":"7시간","pm":"5시간","eve":"3시간/모름"}
+            chips_full = " ".join(chip(f"{n} · {level_label.get(lvl,lvl)}") for n,lvl in full_ok) or "(없음)"
+            st.markdown("가능 멤버(구간 **전체**): " + chips_full, unsafe_allow_html=True)
+            if part_ok:
+                chips_part = " ".join(chip(f"{n} · {level_label.get(lvl,lvl)} · {cnt}/{K}일") for n,lvl,cnt in part_ok)
+                st.markdown("가능 멤버(구간 **부분**): " + chips_part, unsafe_allow_html=True)
+
+            # 미니 매트릭스
+            render_availability_matrix(
+                snap, i0, i1,
+                title="사람×날짜 가능수준 (F/7/5/3/×)",
+                note="칸에 마우스를 올리면 이름·날짜·가능수준이 보여요.",
+                key=f"pdm_{days_seq[0]}_{days_seq[-1]}"
+            )
 
-        c1,c2,c3 = st.columns(3)
-        with c1:
-            if st.button("저장", key="time_save"):
-                DB.upsert_availability(st.session_state["user_id"], rid, payload)
-                DB.set_submitted(st.session_state["user_id"], rid, False)
-                st.success("저장 완료(미제출)"); _rerun()
-        with c2:
-            if st.button("제출(Submit)", key="time_submit"):
-                DB.upsert_availability(st.session_state["user_id"], rid, payload)
-                DB.set_submitted(st.session_state["user_id"], rid, True)
-                st.success("제출 완료"); _rerun()
-        with c3:
-            if st.button("내 입력 삭제", key="time_clear"):
-                DB.clear_my_availability(st.session_state["user_id"], rid)
-                DB.set_submitted(st.session_state["user_id"], rid, False)
-                st.success("입력을 비웠습니다."); _rerun()
-
-        st.markdown("#### 제출 현황")
-        submitted = [ (m["nickname"] or m["name"]) for m in members if m["submitted"]]
-        pending   = [ (m["nickname"] or m["name"]) for m in members if not m["submitted"]]
-        pill = lambda t: f'<span style="background:#eee;padding:4px 8px;border-radius:999px;margin-right:6px">{t}</span>'
-        st.markdown("**제출 완료:** " + (" ".join(pill(n) for n in submitted) or "없음"), unsafe_allow_html=True)
-        st.markdown("**제출 대기:** " + (" ".join(pill(n) for n in pending) or "없음"), unsafe_allow_html=True)
+        for i, w in enumerate(merged_top[:7], 1):
+            st.write(f"**#{i}**")
+            render_win_summary(w["days"], w["score"], w["feasible"], show_select_button=True)
+    else:
+        st.info("추천할 구간이 아직 없어요. 인원 입력을 더 받아보세요.")
+    if snap.all_submitted:
+        st.success("모든 인원이 제출 완료! 위 추천 구간을 참고해 최종 확정하세요 ✅")
+
+    if st.toggle("사람별 타임라인(전체 기간) 보기", value=False):
+        render_availability_matrix(
+            snap, 0, len(days_list) - 1,
+            title="전체 기간 타임라인 (F/7/5/3/×)",
+            note="이름/날짜 헤더는 스크롤해도 고정됩니다.",
+            key="pdm_full"
+        )
 
-        st.markdown("---")
-        st.subheader("집계 및 추천")
-
-        room_row, days_list, agg, weights = DB.day_aggregate(rid)
-        names_by_day = DB.availability_names_by_day(rid)
-
-        df_agg = pd.DataFrame([
-            {
-                "date": d,
-                "full": agg[d]["full"], "am": agg[d]["am"], "pm": agg[d]["pm"], "eve": agg[d]["eve"],
-                "score": round(agg[d]["score"],2),
-                "quorum_ok": "✅" if (agg[d]["full"]+agg[d]["am"]+agg[d]["pm"]+agg[d]["eve"])>=room_row["quorum"] else "❌",
-                "FULL(이름)": ", ".join(names_by_day.get(d, {}).get("full", [])),
-                "AM(이름)":   ", ".join(names_by_day.get(d, {}).get("am", [])),
-                "PM(이름)":   ", ".join(names_by_day.get(d, {}).get("pm", [])),
-                "EVE(이름)":  ", ".join(names_by_day.get(d, {}).get("eve", [])),
-            }
-            for d in days_list
-        ])
-        st.dataframe(df_agg, use_container_width=True, hide_index=True)
-
-        st.markdown("#### 날짜별 가능 멤버(뱃지)")
-        pick_for_names = st.selectbox("날짜 선택", days_list, index=0, key="names_day_pick")
-        nb = names_by_day.get(pick_for_names, {})
-        for label, key in [("하루종일","full"),("7시간","am"),("5시간","pm"),("3시간/모름","eve")]:
-            chips = " ".join(chip(n) for n in nb.get(key, [])) or "(없음)"
-            st.markdown(f"**{label}** · {chips}", unsafe_allow_html=True)
-
-        raw_top = best_windows(days_list, agg, int(room_row["min_days"]), int(room_row["quorum"]))
-        if raw_top:
-            merged_top = merge_overlapping_windows(raw_top, agg, int(room_row["quorum"]))
-            st.markdown("### ⭐ 추천 Top‑7 (겹치거나 붙는 구간은 하나로 합침)")
-            def render_win_summary(days_seq, score, feasible, show_select_button=False, small=False):
-                feas = "충족" if feasible else "⚠️ 최소 인원 미충족 포함"
-                if show_select_button:
-                    colL, colR = st.columns([5,2])
-                    with colL:
-                        st.write(f"**{days_seq[0]} ~ {days_seq[-1]} | 점수 {score:.2f} | {feas}**")
-                    with colR:
-                        if st.button("이 구간 최종 선택", key=f"choose_{days_seq[0]}_{days_seq[-1]}"):
-                            if is_owner:
-                                DB.set_final_window(rid, room["owner_id"], days_seq[0], days_seq[-1])
-                            else:
-                                DB.set_final_window_admin(rid, days_seq[0], days_seq[-1])
-                            st.success("최종 일정으로 저장했습니다."); _rerun()
+# ========== 🗺️ 계획 & 동선 / 예산 ==========
+@st.fragment
+def plan_section(rid):
+    snap = _section_snap(rid, "plan")
+    room = snap.room
+    left, right = st.columns([1.1, 1.2])
+
+    days_options = pd.date_range(room["start"], room["end"]).strftime("%Y-%m-%d").tolist()
+    pick_day = st.selectbox("날짜 선택", days_options, index=0, key="plan_day")
+    _show_flash("plan")
+
+    with left:
+        st.subheader("계획표 (순서·시간·카테고리·장소·예산)")
+
+        with st.expander("📍 장소 검색해서 추가", expanded=False):
+            q = st.text_input("장소/주소 검색", key="plan_q")
+            cA,cB,cC = st.columns([2,1,1])
+            with cA: cat = st.selectbox("카테고리", ["식사","숙소","놀기","카페","쇼핑","기타"], key="plan_cat")
+            with cB: bud = st.number_input("예산(원)", 0, step=1000, value=0, key="plan_budget")
+            with cC: is_anchor = st.checkbox("숙소/고정", value=False, key="plan_anchor")
+            if st.button("검색 & 추가", key="plan_add"):
+                status = get_geocoder().add_place(rid, pick_day, q, cat, bud, is_anchor, st.session_state["user_id"])
+                if status == "empty": st.warning("장소/주소를 입력해 주세요.")
                 else:
-                    st.write(f"**{days_seq[0]} ~ {days_seq[-1]} | 점수 {score:.2f} | {feas}**")
+                    st.success({"cached": "추가됨",
+                                "pending": "추가됨 · 좌표는 잠시 후 자동으로 채워져요",
+                                "not_found": "추가됨 · 검색 결과가 없어 지도에는 표시되지 않아요",
+                                "no_provider": "추가됨 (좌표 없음)"}[status]); _rerun_section(rid)
 
-                K = len(days_seq)
-                stats = {}; all_names=set()
-                for d in days_seq:
-                    nb_d = names_by_day.get(d, {})
-                    for s in ("full","am","pm","eve"):
-                        for name in nb_d.get(s, []):
-                            all_names.add(name)
-                            rec = stats.setdefault(name, {"cnt":0, "lowest":"full"})
-                            rec["cnt"] += 1
-                            rec["lowest"] = min(rec["lowest"], s, key=level_rank)
-                full_ok = [ (n, stats[n]["lowest"]) for n in all_names if stats[n]["cnt"] == K ]
-                part_ok = [ (n, stats[n]["lowest"], stats[n]["cnt"]) for n in all_names if 0 < stats[n]["cnt"] < K ]
-                full_ok.sort(key=lambda x: (-level_rank(x[1]), x[0].lower()))
-                part_ok.sort(key=lambda x: (-x[2], -level_rank(x[1]), x[0].lower()))
-                level_label={"full":"하루종일","am":"7시간","pm":"5시간","eve":"3시간/모름"}
-                chips_full = " ".join(chip(f"{n} · {level_label.get(lvl,lvl)}") for n,lvl in full_ok) or "(없음)"
-                st.markdown("가능 멤버(구간 **전체**): " + chips_full, unsafe_allow_html=True)
-                if part_ok:
-                    chips_part = " ".join(chip(f"{n} · {level_label.get(lvl,lvl)} · {cnt}/{K}일") for n,lvl,cnt in part_ok)
-                    st.markdown("가능 멤버(구간 **부분**): " + chips_part, unsafe_allow_html=True)
-
-                # 미니 매트릭스
-                render_availability_matrix(
-                    days_seq, names_by_day,
-                    title="사람×날짜 가능수준 (F/7/5/3/×)",
-                    note="칸에 마우스를 올리면 상태 툴팁이 보여요.",
-                    max_rows=None
-                )
-
-            for i, w in enumerate(merged_top[:7], 1):
-                st.write(f"**#{i}**")
-                render_win_summary(w["days"], w["score"], w["feasible"], show_select_button=True)
+        rows = snap.items_for(pick_day)
+        table = []
+        for r in rows:
+            table.append({
+                "id": r["id"], "position": r["position"], "번호": 0,
+                "start_time": r["start_time"] or "", "end_time": r["end_time"] or "",
+                "category": r["category"], "name": r["name"],
+                "budget": float(r["budget"] or 0)
+            })
+        df_plan = pd.DataFrame(table)
+        if not df_plan.empty:
+            df_plan = df_plan.sort_values("position").reset_index(drop=True)
+            df_plan["번호"] = range(1, len(df_plan)+1)
+
+        if df_plan.empty:
+            st.info("이 날짜의 계획이 없습니다. 위에서 장소를 검색/추가하세요.")
         else:
-            st.info("추천할 구간이 아직 없어요. 인원 입력을 더 받아보세요.")
-        if DB.all_submitted(rid):
-            st.success("모든 인원이 제출 완료! 위 추천 구간을 참고해 최종 확정하세요 ✅")
+            edited = st.data_editor(
+                df_plan,
+                column_config={
+                    "id": st.column_config.TextColumn("ID", disabled=True),
+                    "번호": st.column_config.NumberColumn("번호(표시용)", disabled=True),
+                    "position": st.column_config.NumberColumn("순서", min_value=1, step=1),
+                    "start_time": st.column_config.TextColumn("시작", help="예: 10:00"),
+                    "end_time": st.column_config.TextColumn("종료", help="예: 12:00"),
+                    "category": st.column_config.SelectboxColumn("카테고리", options=["식사","숙소","놀기","카페","쇼핑","기타"]),
+                    "name": st.column_config.TextColumn("장소"),
+                    "budget": st.column_config.NumberColumn("예산(원)", step=1000),
+                },
+                hide_index=True, use_container_width=True, key="plan_editor"
+            )
 
-        if st.toggle("사람별 타임라인(전체 기간) 보기", value=False):
-            render_availability_matrix(
-                days_list, names_by_day,
-                title="전체 기간 타임라인 (F/7/5/3/×)",
-                note="이름/날짜 헤더는 스크롤해도 고정됩니다."
+            rep = st.session_state.get("route_report")
+            if rep and rep[0] == pick_day:
+                res = rep[1]
+                st.caption(f"추천 동선: 총 {res['distance_km']:.1f}km · {res['solver']} · "
+                           + " → ".join(f"{s['start']}" for s in res["schedule"]))
+                names = {r["id"]: r["name"] for r in rows}
+                for bad in res["infeasible"]:
+                    st.warning(f"⏰ {names.get(bad['id'], bad['id'])}: 시간창 {bad['window'][0] or '-'}~{bad['window'][1] or '-'} "
+                               f"을(를) {bad['late_min']}분 넘김 (이동시간 추정 기준)")
+
+            d1, d2, d3 = st.columns(3)
+            with d1:
+                if st.button("저장(계획)", key="plan_save"):
+                    DB.bulk_save_positions(rid, pick_day, edited.to_dict("records"))
+                    st.success("저장 완료"); _rerun_section(rid)
+            with d2:
+                if st.button("자동 동선 추천(순서 재배치)", key="plan_opt"):
+                    recs = {rr["id"]: rr for rr in edited.to_dict("records")}
+                    items_for_route = [{
+                        "id": r["id"], "lat": r["lat"], "lon": r["lon"], "is_anchor": r["is_anchor"],
+                        "start_time": recs.get(r["id"], r)["start_time"], "end_time": recs.get(r["id"], r)["end_time"]
+                    } for r in rows]
+                    res = schedule_route(items_for_route)
+                    st.session_state["route_report"] = (pick_day, res)
+                    new_rows = [dict(recs[oid], position=p) for p, oid in enumerate(res["order"], 1) if oid in recs]
+                    DB.bulk_save_positions(rid, pick_day, new_rows)
+                    st.success(f"동선 정렬 완료! (총 {res['distance_km']:.1f}km · {res['solver']})"); _rerun_section(rid)
+            with d3:
+                del_id = st.number_input("삭제할 ID", min_value=0, step=1, value=0, key="plan_del_id")
+                if st.button("선택 ID 삭제", key="plan_del_btn") and del_id>0:
+                    DB.delete_item(int(del_id), rid)
+                    rest = DB.list_items(rid, pick_day)
+                    rest_sorted = sorted(rest, key=lambda x: x["position"])
+                    repacked = []
+                    p = 1
+                    for it in rest_sorted:
+                        repacked.append({
+                            "id": it["id"], "position": p,
+                            "start_time": it["start_time"], "end_time": it["end_time"],
+                            "category": it["category"], "name": it["name"],
+                            "budget": float(it["budget"] or 0)
+                        })
+                        p += 1
+                    if repacked:
+                        DB.bulk_save_positions(rid, pick_day, repacked)
+                    st.success("삭제 및 순서 재정렬 완료"); _rerun_section(rid)
+
+        if st.button("모든 날짜 동선 한 번에 추천", key="plan_opt_all"):
+            results = DB.optimize_room_routes(rid)
+            if pick_day in results: st.session_state["route_report"] = (pick_day, results[pick_day])
+            skipped = [d for d, r in results.items() if r["changed"] is None]
+            late = sum(len(r["infeasible"]) for r in results.values())
+            _flash("plan", f"{len(results)}일 동선 정렬 완료 · {sum(r['changed'] or 0 for r in results.values())}개 순서 변경"
+                   + (f" · 시간창 초과 {late}곳" if late else "")
+                   + (f" · 수정 중이라 건너뜀: {', '.join(skipped)}" if skipped else ""))
+            _rerun_section(rid)      # 표·지도를 새 순서로 (옛 순서를 다시 저장하지 않게)
+
+    with right:
+        st.subheader("동선 지도")
+        if st_folium is None or folium is None:
+            st.info("지도 기능을 사용하려면 streamlit-folium, folium 패키지가 필요해요.")
+        else:
+            items = snap.items_for(pick_day)
+            if not items:
+                st.info("표에서 장소를 추가하면 지도에 표시됩니다.")
+            else:
+                lat0 = next((it["lat"] for it in items if it["lat"]), None) or 37.5665
+                lon0 = next((it["lon"] for it in items if it["lon"]), None) or 126.9780
+                m = folium.Map(location=[lat0, lon0], zoom_start=12, control_scale=True)
+                items_sorted = sorted(items, key=lambda r:r["position"])
+                coords=[]
+                for i,it in enumerate(items_sorted, start=1):
+                    if it["lat"] and it["lon"]:
+                        coords.append((it["lat"], it["lon"]))
+                        popup = f"{i}. {it['name']} · {it['category']} · 예산 {int(it['budget'])}원"
+                        icon = folium.DivIcon(html=f"<div style='font-weight:700'>{i}</div>")
+                        folium.Marker([it["lat"], it["lon"]], popup=popup, tooltip=popup, icon=icon).add_to(m)
+                if len(coords)>=2:
+                    folium.PolyLine(coords, weight=4, opacity=0.8).add_to(m)
+                st_folium(m, height=520, width=None)
+
+# ========== 💳 정산 ==========
+@st.fragment
+def cost_section(rid):
+    snap = _section_snap(rid, "cost")
+    room, members = snap.room, snap.members
+    left, right = st.columns([1.2, 1])
+
+    with left:
+        # ---- 지출 입력 폼 (복구) ----
+        st.subheader("지출 입력")
+        days_options = pd.date_range(room["start"], room["end"]).strftime("%Y-%m-%d").tolist()
+        exp_day = st.selectbox("날짜", days_options, key="exp_day")
+        c1, c2 = st.columns([1.2, 1])
+        with c1:
+            place_n = st.text_input("장소(선택 입력)", key="exp_place")
+        with c2:
+            payer = st.selectbox(
+                "결제자",
+                options=[(m["id"], (m["nickname"] or m["name"])) for m in members],
+                format_func=lambda x: x[1],
+                key="exp_payer"
             )
+        c3, c4 = st.columns([1, 1.2])
+        with c3:
+            amt = st.number_input("금액(원)", 0, step=1000, key="exp_amt")
+        with c4:
+            memo = st.text_input("메모", key="exp_memo")
 
-    # ========== 🗺️ 계획 & 동선 / 예산 ==========
-    with tab_plan:
-        left, right = st.columns([1.1, 1.2])
+        category = st.selectbox("카테고리", ["식사", "숙소", "놀기", "카페", "쇼핑", "기타"], key="exp_cat")
 
-        days_options = pd.date_range(room["start"], room["end"]).strftime("%Y-%m-%d").tolist()
-        pick_day = st.selectbox("날짜 선택", days_options, index=0, key="plan_day")
-
-        with left:
-            st.subheader("계획표 (순서·시간·카테고리·장소·예산)")
-
-            with st.expander("📍 장소 검색해서 추가", expanded=False):
-                q = st.text_input("장소/주소 검색", key="plan_q")
-                cA,cB,cC = st.columns([2,1,1])
-                with cA: cat = st.selectbox("카테고리", ["식사","숙소","놀기","카페","쇼핑","기타"], key="plan_cat")
-                with cB: bud = st.number_input("예산(원)", 0, step=1000, value=0, key="plan_budget")
-                with cC: is_anchor = st.checkbox("숙소/고정", value=False, key="plan_anchor")
-                if st.button("검색 & 추가", key="plan_add"):
-                    lat=lon=None
-                    if Nominatim is not None and q.strip():
-                        try:
-                            geoloc = Nominatim(user_agent="youchin").geocode(q)
-                            if geoloc: lat, lon = geoloc.latitude, geoloc.longitude
-                        except Exception:
-                            lat=lon=None
-                    DB.add_item(rid, pick_day, q.strip() or "장소", cat, lat, lon, bud, None, None, is_anchor, None, st.session_state["user_id"])
-                    st.success("추가됨"); _rerun()
-
-            rows = DB.list_items(rid, pick_day)
-            table = []
-            for r in rows:
-                table.append({
-                    "id": r["id"], "position": r["position"], "번호": 0,
-                    "start_time": r["start_time"] or "", "end_time": r["end_time"] or "",
-                    "category": r["category"], "name": r["name"],
-                    "budget": float(r["budget"] or 0)
-                })
-            df_plan = pd.DataFrame(table)
-            if not df_plan.empty:
-                df_plan = df_plan.sort_values("position").reset_index(drop=True)
-                df_plan["번호"] = range(1, len(df_plan)+1)
-
-            if df_plan.empty:
-                st.info("이 날짜의 계획이 없습니다. 위에서 장소를 검색/추가하세요.")
-            else:
-                edited = st.data_editor(
-                    df_plan,
-                    column_config={
-                        "id": st.column_config.TextColumn("ID", disabled=True),
-                        "번호": st.column_config.NumberColumn("번호(표시용)", disabled=True),
-                        "position": st.column_config.NumberColumn("순서", min_value=1, step=1),
-                        "start_time": st.column_config.TextColumn("시작", help="예: 10:00"),
-                        "end_time": st.column_config.TextColumn("종료", help="예: 12:00"),
-                        "category": st.column_config.SelectboxColumn("카테고리", options=["식사","숙소","놀기","카페","쇼핑","기타"]),
-                        "name": st.column_config.TextColumn("장소"),
-                        "budget": st.column_config.NumberColumn("예산(원)", step=1000),
-                    },
-                    hide_index=True, use_container_width=True, key="plan_editor"
-                )
-
-                d1, d2, d3 = st.columns(3)
-                with d1:
-                    if st.button("저장(계획)", key="plan_save"):
-                        DB.bulk_save_positions(rid, pick_day, edited.to_dict("records"))
-                        st.success("저장 완료"); _rerun()
-                with d2:
-                    if st.button("자동 동선 추천(순서 재배치)", key="plan_opt"):
-                        items_for_route = [{
-                            "id": r["id"], "lat": r["lat"], "lon": r["lon"], "is_anchor": r["is_anchor"]
-                        } for r in DB.list_items(rid, pick_day)]
-                        order_ids = optimize_route(items_for_route)
-                        new_rows=[]; p=1
-                        for oid in order_ids:
-                            row = next(rr for rr in edited.to_dict("records") if rr["id"]==oid)
-                            row["position"]=p; new_rows.append(row); p+=1
-                        DB.bulk_save_positions(rid, pick_day, new_rows)
-                        st.success("동선 정렬 완료!"); _rerun()
-                with d3:
-                    del_id = st.number_input("삭제할 ID", min_value=0, step=1, value=0, key="plan_del_id")
-                    if st.button("선택 ID 삭제", key="plan_del_btn") and del_id>0:
-                        DB.delete_item(int(del_id), rid)
-                        rest = DB.list_items(rid, pick_day)
-                        rest_sorted = sorted(rest, key=lambda x: x["position"])
-                        repacked = []
-                        p = 1
-                        for it in rest_sorted:
-                            repacked.append({
-                                "id": it["id"], "position": p,
-                                "start_time": it["start_time"] or "",
-                                "end_time": it["end_time"] or "",
-                                "category": it["category"], "name": it["name"],
-                                "budget": float(it["budget"] or 0)
-                            })
-                            p += 1
-                        if repacked:
-                            DB.bulk_save_positions(rid, pick_day, repacked)
-                        st.success("삭제 및 순서 재정렬 완료"); _rerun()
-
-        with right:
-            st.subheader("동선 지도")
-            if st_folium is None or folium is None:
-                st.info("지도 기능을 사용하려면 streamlit-folium, folium 패키지가 필요해요.")
-            else:
-                items = DB.list_items(rid, pick_day)
-                if not items:
-                    st.info("표에서 장소를 추가하면 지도에 표시됩니다.")
-                else:
-                    lat0 = next((it["lat"] for it in items if it["lat"]), None) or 37.5665
-                    lon0 = next((it["lon"] for it in items if it["lon"]), None) or 126.9780
-                    m = folium.Map(location=[lat0, lon0], zoom_start=12, control_scale=True)
-                    items_sorted = sorted(items, key=lambda r:r["position"])
-                    coords=[]
-                    for i,it in enumerate(items_sorted, start=1):
-                        if it["lat"] and it["lon"]:
-                            coords.append((it["lat"], it["lon"]))
-                            popup = f"{i}. {it['name']} · {it['category']} · 예산 {int(it['budget'])}원"
-                            icon = folium.DivIcon(html=f"<div style='font-weight:700'>{i}</div>")
-                            folium.Marker([it["lat"], it["lon"]], popup=popup, tooltip=popup, icon=icon).add_to(m)
-                    if len(coords)>=2:
-                        folium.PolyLine(coords, weight=4, opacity=0.8).add_to(m)
-                    st_folium(m, height=520, width=None)
-
-    # ========== 💳 정산 ==========
-    with tab_cost:
-        left, right = st.columns([1.2, 1])
-
-        with left:
-            # ---- 지출 입력 폼 (복구) ----
-            st.subheader("지출 입력")
-            days_options = pd.date_range(room["start"], room["end"]).strftime("%Y-%m-%d").tolist()
-            exp_day = st.selectbox("날짜", days_options, key="exp_day")
-            c1, c2 = st.columns([1.2, 1])
-            with c1:
-                place_n = st.text_input("장소(선택 입력)", key="exp_place")
-            with c2:
-                payer = st.selectbox(
-                    "결제자",
-                    options=[(m["id"], (m["nickname"] or m["name"])) for m in members],
-                    format_func=lambda x: x[1],
-                    key="exp_payer"
-                )
-            c3, c4 = st.columns([1, 1.2])
-            with c3:
-                amt = st.number_input("금액(원)", 0, step=1000, key="exp_amt")
-            with c4:
-                memo = st.text_input("메모", key="exp_memo")
-
-            # 카테고리를 DB에 저장하지 않는 스키마라면 화면 용도로만 사용(옵션)
-            category = st.selectbox("카테고리", ["식사", "숙소", "놀기", "카페", "쇼핑", "기타"], key="exp_cat")
-
-            if st.button("지출 추가", key="exp_add"):
-                # 현재 DB 스키마가 category 컬럼이 없으면 아래 add_expense 그대로 사용
-                DB.add_expense(rid, exp_day, place_n or "", payer[0], float(amt), memo or "")
-                st.success("지출 추가됨")
-                _rerun()
+        member_opts = [(m["id"], (m["nickname"] or m["name"])) for m in members]
+        sharers = st.multiselect("나눠 낼 사람 (기본: 전원)", member_opts, default=member_opts,
+                                 format_func=lambda x: x[1], key="exp_sharers")
 
-            st.markdown("---")
+        if st.button("지출 추가", key="exp_add"):
+            parts = None if len(sharers) in (0, len(member_opts)) else [u for u, _ in sharers]
+            DB.add_expense(rid, exp_day, place_n or "", payer[0], float(amt), memo or "", category, participants=parts)
+            st.success("지출 추가됨")
+            _rerun_section(rid)
 
-            # ---- 목록/그래프 출력 ----
-            render_expenses(rid, members)
+        st.markdown("---")
+
+        # ---- 목록/그래프 출력 ----
+        render_expenses(rid, snap.expenses)
+
+    with right:
+        st.subheader("정산 요약")
+        transfers, total = snap.transfers, snap.total
+        per_head = int(total / max(1, len(members)))
+        st.caption(f"총 지출: **{int(total)}원** · 인당 **{per_head}원**")
+        if not transfers:
+            st.info("정산할 항목이 아직 없어요.")
+        else:
+            name_of = lambda uid: snap.transfer_names.get(uid, "(나간 멤버)")
+            st.write("**이체 추천 목록 (최소 이체 수)**")
+            for t in transfers:
+                st.write(f"- {name_of(t['from'])} → {name_of(t['to'])} : **{int(t['amount'])}원**")
 
-        with right:
-            st.subheader("정산 요약")
-            transfers, total = DB.settle_transfers(rid)
-            per_head = int(total / max(1, len(members)))
-            st.caption(f"총 지출: **{int(total)}원** · 인당 **{per_head}원**")
-            if not transfers:
-                st.info("정산할 항목이 아직 없어요.")
-            else:
-                name_of = {m["id"]: (m["nickname"] or m["name"]) for m in members}
-                st.write("**이체 추천 목록 (최소 이체 수)**")
-                for t in transfers:
-                    st.write(f"- {name_of[t['from']]} → {name_of[t['to']]} : **{int(t['amount'])}원**")
 
 # ---------------- Router ----------------
 def router():